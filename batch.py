@@ -0,0 +1,152 @@
+"""
+Headless computation of Allan deviation reports from presets, without the GUI.
+
+Example (nightly report of two presets, written as CSV and PNG):
+    pixi run python batch.py Lock_1 Lock_2 --output reports --format csv png --workers 4
+"""
+import argparse
+import os
+import sys
+import pandas as pd
+
+from database.multi_source import create_handler, MultiSourceHandler
+from database.data_cache import DataCache, iter_db_chunks
+from database.presets import read_table, read_tree, tree_value, PresetBundle
+from data_processing import kernels
+from data_processing.pipeline import compute_adev, compute_budget, table_scale
+from data_processing.chunked_adev import chunked_stab
+from data_processing.utils import string_to_date, date_math
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compute Allan deviation reports from presets, without the GUI.")
+    parser.add_argument("presets", nargs="+", help="Names of the presets (presets/<name>.json and presets/<name>_tree.json)")
+    parser.add_argument("--presets-dir", default="presets", help="Directory of the presets")
+    parser.add_argument("--config", default="config/settings.json", help="Configuration file")
+    parser.add_argument("--bucket", default=None, help="Override the bucket of the configuration file")
+    parser.add_argument("--output", default="reports", help="Output directory")
+    parser.add_argument("--format", nargs="+", default=["csv"], choices=["csv", "parquet", "png"], help="Output formats")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of processes (threads with the numba kernels) computing the ADev")
+    parser.add_argument("--kernels", default="auto", choices=kernels.BACKENDS, help="Numerical kernels: numba if installed (auto), numba or numpy")
+    parser.add_argument("--acquisition-range", action="store_true", help="Use the data acquisition range (e.g. 'now-24h') instead of the ADev region")
+    parser.add_argument("--all", action="store_true", help="Compute all the measurements of the preset, not only the ones plotted")
+    parser.add_argument("--out-of-core", action="store_true", help="Stream the data by chunks instead of loading the region (regions larger than the memory)")
+    return parser.parse_args()
+
+def run_preset(preset_name, handler, args):
+    table_df = read_table(preset_name, args.presets_dir)
+    state = read_tree(preset_name, args.presets_dir)
+
+    # Time range
+    if args.acquisition_range:
+        start = tree_value(state, "Data acquisition", "Start")
+        stop = tree_value(state, "Data acquisition", "Stop")
+    else:
+        start = tree_value(state, "Data processing", "Allan deviation", "Start")
+        stop = tree_value(state, "Data processing", "Allan deviation", "Stop")
+    start = string_to_date(date_math(start))
+    stop = string_to_date(date_math(stop))
+
+    avg_window = tree_value(state, "Data processing", "Allan deviation", "Initial tau (s)", default="1")
+    mode = tree_value(state, "Data processing", "Allan deviation", "Mode", default="Decade").lower()
+
+    measurement_list = table_df["Name"].to_list() if args.all else table_df.query("Plot_adev == True")["Name"].to_list()
+
+    if args.out_of_core:
+        derived = table_df.loc[table_df["Expression"] != "", "Name"].to_list()
+        for measurement in derived:
+            if measurement in measurement_list:
+                print("Derived measurement '{}' of '{}' not computed out of core (it needs its inputs aligned in memory).".format(measurement, preset_name))
+        measurement_list = [measurement for measurement in measurement_list if not measurement in derived]
+        if tree_value(state, "Allan deviation plot settings", "Budget", default=False):
+            print("Budget of '{}' not computed out of core (it needs the samples of all the measurements at once).".format(preset_name))
+        return results_to_df(run_out_of_core(preset_name, handler, table_df, measurement_list, start, stop, avg_window, mode, args))
+
+    # Fetch
+    cache = DataCache(handler)
+    cache.set_derived(table_df)
+    cache.fetch(start, stop, measurement_list, avg_window, "adev")
+
+    # Compute
+    results = compute_adev(cache.adev_store, table_df, measurement_list, start.timestamp(), stop.timestamp(), mode, workers=args.workers)
+
+    if tree_value(state, "Allan deviation plot settings", "Budget", default=False):
+        main_measurement = tree_value(state, "Global settings", "Main measurement")
+        budget = compute_budget(cache.adev_store, table_df, main_measurement, measurement_list, start.timestamp(), stop.timestamp(), mode)
+        if budget is not None:
+            results.update(budget)
+
+    return results_to_df(results)
+
+def run_out_of_core(preset_name, handler, table_df, measurement_list, start, stop, avg_window, mode, args):
+    # Each measurement streamed by chunks, from the preset bundle when it has the region or else from the database
+    bundle = PresetBundle.open(preset_name, args.presets_dir)
+    start_ns, stop_ns = pd.Timestamp(start).value, pd.Timestamp(stop).value
+    avg_window_fetch = int(avg_window) if avg_window != "" else None
+
+    results = {}
+    for measurement, scale in zip(measurement_list, table_scale(table_df, measurement_list)):
+        if bundle is not None and bundle.covers("adev", measurement, start_ns, stop_ns, avg_window):
+            chunks = bundle.iter_read("adev", measurement, start_ns, stop_ns)
+        else:
+            chunks = iter_db_chunks(handler, start, stop, measurement, avg_window_fetch)
+
+        result = chunked_stab(chunks, mode, scale, spill_dir=args.output)
+        if result is not None:
+            results[measurement] = result
+    return results
+
+def results_to_df(results):
+    # Long format: one row per measurement and tau
+    report = [
+        pd.DataFrame({"measurement": title, "tau": taus, "adev": devs, "err_lo": error_bars[0], "err_hi": error_bars[1]})
+        for title, (taus, devs, error_bars) in results.items()
+        ]
+    if not report:
+        return pd.DataFrame(columns=["measurement", "tau", "adev", "err_lo", "err_hi"])
+    return pd.concat(report, ignore_index=True)
+
+def save_png(report, filename, title):
+    import matplotlib # Optional dependency, only needed for PNG reports
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for measurement, df in report.groupby("measurement", sort=False):
+        line, = ax.loglog(df["tau"], df["adev"], label=measurement)
+        ax.fill_between(df["tau"], df["adev"]-df["err_lo"], df["adev"]+df["err_hi"], color=line.get_color(), alpha=0.3)
+    ax.set_xlabel("Integration time (s)")
+    ax.set_ylabel("Allan deviation")
+    ax.set_title(title)
+    ax.grid(True, which="both", alpha=0.5)
+    ax.legend(fontsize=8)
+    fig.savefig(filename, dpi=150, bbox_inches="tight")
+    plt.close(fig)
+
+def main():
+    args = parse_args()
+    kernels.set_backend(args.kernels)
+
+    handler = create_handler(args.config)
+    if args.bucket and isinstance(handler, MultiSourceHandler):
+        sys.exit("--bucket needs a configuration with a single source.")
+    if args.bucket:
+        handler.bucket = args.bucket
+
+    os.makedirs(args.output, exist_ok=True)
+
+    for preset_name in args.presets:
+        report = run_preset(preset_name, handler, args)
+        report.insert(0, "preset", preset_name)
+
+        filename = os.path.join(args.output, preset_name+"_adev")
+        if "csv" in args.format:
+            report.to_csv(filename+".csv", index=False)
+        if "parquet" in args.format:
+            report.to_parquet(filename+".parquet", index=False)
+        if "png" in args.format:
+            save_png(report, filename+".png", preset_name)
+
+        print("Report of '{}' saved ({} measurements).".format(preset_name, report["measurement"].nunique()))
+
+if __name__ == "__main__":
+    main()
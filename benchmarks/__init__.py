@@ -0,0 +1,26 @@
+import sys
+
+class Checks:
+    """
+    Results of named checks, printed as they are made (see the check_* scripts).
+
+    Example:
+        check = Checks()
+        check("values of the stub", np.array_equal(values, expected))
+        check.exit() # With an error if a check failed
+    """
+    def __init__(self, width=60):
+        self.width = width
+        self.results = [] # (name, passed)
+
+    def __call__(self, name, condition, detail=""):
+        self.results.append((name, bool(condition)))
+        print(f"{name:<{self.width}} {detail:>12}  {'ok' if condition else 'FAILED'}")
+
+    @property
+    def failures(self):
+        return [name for name, passed in self.results if not passed]
+
+    def exit(self):
+        if self.failures:
+            sys.exit("Failed checks:\n" + "\n".join(self.failures))
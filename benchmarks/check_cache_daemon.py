@@ -0,0 +1,83 @@
+"""
+Checks of the cache daemon with two clients, against the InfluxDB stub (no database or network
+needed): the requests reaching the database, the data handed over, and the memory limit.
+Exits with an error if a check fails.
+
+Example:
+    pixi run python -m benchmarks.check_cache_daemon
+"""
+import asyncio
+import secrets
+import numpy as np
+import pandas as pd
+
+from benchmarks import Checks
+from benchmarks.influx_stub import InfluxStub
+from database.cache_daemon import CacheDaemon, DaemonHandler
+from database.influxdb_handler import InfluxDBHandler
+
+def fetch(client, start, stop, measurement=None):
+    return asyncio.run(client.db_to_df(start, stop, measurement=measurement))
+
+def served(stub, start, stop, measurement):
+    # Values the stub serves within [start, stop)
+    a, b = np.searchsorted(stub.time_ns, [start.value, stop.value])
+    return stub.series[measurement][a:b]
+
+def run(stub):
+    t0 = stub.t0
+    hours = [t0 + pd.Timedelta(hours=k) for k in range(7)]
+    handler = InfluxDBHandler(source={**stub.config()["influxdb"], "query_cache_mb": 0})
+    key = secrets.token_bytes(32)
+    daemon = CacheDaemon(handler, ("127.0.0.1", 0), key=key, max_bytes=2**19).start()
+    first, second = DaemonHandler(daemon.address, key), DaemonHandler(daemon.address, key)
+
+    check = Checks()
+
+    try:
+        # The same range, from both clients: fetched once
+        df = fetch(first, hours[0], hours[2], "white_fm")
+        requests = stub.requests
+        check("first fetch reaches the database", requests > 0)
+        df2 = fetch(second, hours[0], hours[2], "white_fm")
+        check("second client: no request", stub.requests == requests)
+        check("same data for both clients", df["value"].equals(df2["value"]) and df["_time"].equals(df2["_time"]))
+        check("values of the stub", np.array_equal(df["value"].to_numpy(), served(stub, hours[0], hours[2], "white_fm")))
+        check("read-only view of the segment", not df["value"].to_numpy().flags.writeable)
+
+        # All the measurements, then one of them: its data is part of the first fetch
+        stub.reset_counters()
+        all_df = fetch(first, hours[2], hours[3])
+        requests = stub.requests
+        check("all the measurements", sorted(all_df["_measurement"].unique()) == sorted(stub.series))
+        fetch(second, hours[2], hours[3], "flicker_fm")
+        check("measurement after all of them: no request", stub.requests == requests)
+
+        # A range overlapping the cached ones: only the missing part is requested
+        stub.reset_counters()
+        df = fetch(second, hours[1], hours[4], "white_fm")
+        check("overlapping range: one request for the missing hour", stub.requests == 1)
+        check("no duplicated samples", df["_time"].is_unique and np.array_equal(df["value"].to_numpy(), served(stub, hours[1], hours[4], "white_fm")))
+
+        # Memory limit (512 kB, about 32k samples): the least recently used segments (the first
+        # hours of white_fm) are evicted
+        fetch(first, hours[0], hours[6], "random_walk_fm")
+        check("memory within the limit", daemon.nbytes <= daemon.max_bytes)
+        check("least recently used range evicted", daemon.missing("white_fm", None, hours[0].value, hours[1].value))
+        stub.reset_counters()
+        df = fetch(first, hours[0], hours[1], "white_fm")
+        check("evicted range fetched again", stub.requests == 1 and np.array_equal(df["value"].to_numpy(), served(stub, hours[0], hours[1], "white_fm")))
+        check("evicted segments freed", len(daemon.segments) == sum(len(ranges) for ranges in daemon.ranges.values()))
+    finally:
+        first.close()
+        second.close()
+        daemon.close()
+    return check
+
+def main():
+    with InfluxStub(duration=6*3600 + 1, rate=1.0) as stub:
+        check = run(stub)
+    check.exit()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Checks of the chunked Allan deviation against get_stab on a generated series, for several chunk
+sizes (down to chunks shorter than the largest tau), carry-over lengths (the small factors summed
+on the fly across the chunks) and block sizes (the large factors read back from the spilled phase).
+Exits with an error if a check fails.
+
+Example:
+    pixi run python -m benchmarks.check_chunked_adev
+"""
+import os
+import tempfile
+import numpy as np
+
+from benchmarks import Checks
+from data_processing.allan_deviation import get_stab
+from data_processing.chunked_adev import ChunkedOADEV, chunked_stab
+
+def chunks(time, values, size):
+    for a in range(0, len(values), size):
+        yield time[a:a+size], values[a:a+size]
+
+def same_stab(result, expected, rtol=1e-9):
+    taus, devs, (err_lo, err_hi) = result
+    return (len(taus) == len(expected[0]) and np.allclose(taus, expected[0], rtol=rtol, atol=0)
+            and np.allclose(devs, expected[1], rtol=rtol, atol=0)
+            and np.allclose(err_lo, expected[2][0], rtol=rtol, atol=0)
+            and np.allclose(err_hi, expected[2][1], rtol=rtol, atol=0))
+
+def run(directory, size=200000):
+    check = Checks()
+    rng = np.random.default_rng(0)
+    time = 1.7e9 + np.arange(size)*0.5
+    # White and random walk frequency noise on an offset (cancelled in the second differences)
+    values = 1e3 + rng.standard_normal(size) + np.cumsum(rng.standard_normal(size))*1e-2
+
+    for mode in ("decade", "octave"):
+        expected = get_stab(time, values, mode)
+        largest = int(round(expected[0][-1]*2)) # Largest averaging factor, in samples
+
+        # Default carry-over: the factors above 2**15 samples come from the spilled phase
+        for chunk_size in (largest//10, largest - 1, largest + 1, size):
+            result = chunked_stab(chunks(time, values, chunk_size), mode, spill_dir=directory)
+            check(f"{mode}: chunks of {chunk_size} samples", same_stab(result, expected), f"m <= {largest}")
+
+        # Carry-over shorter than the chunks, and the spilled phase read by small blocks
+        for carry, block_size in ((64, 1000), (4096, 2**22), (2**18, 777)):
+            with ChunkedOADEV(mode, carry=carry, spill_dir=directory, block_size=block_size) as adev:
+                for chunk in chunks(time, values, 3000):
+                    adev.add(*chunk)
+                result = adev.result()
+            check(f"{mode}: carry {carry}, blocks of {block_size}", same_stab(result, expected))
+
+    # Scaled values, missing samples dropped
+    values[rng.integers(0, size, 100)] = np.nan
+    valid = ~np.isnan(values)
+    expected = get_stab(time[valid], values[valid]*3e-3)
+    check("scaled, with missing samples", same_stab(chunked_stab(chunks(time, values, 5000), scale=3e-3, spill_dir=directory), expected))
+
+    check("too short: no result", chunked_stab(chunks(time[:2], values[:2], 1)) is None)
+    check("spilled phase removed", not os.listdir(directory))
+    return check
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        check = run(directory)
+    check.exit()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Checks of the CSV file source on small generated files: reads of time ranges with a numeric time
+column and with dates (parsed by pyarrow, or left as strings and parsed by pandas), through the
+index of the file. Exits with an error if a check fails.
+
+Example:
+    pixi run python -m benchmarks.check_file_sources
+"""
+import asyncio
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+from benchmarks import Checks
+from data_processing.utils import to_nanoseconds
+from database.file_sources import CSVSource
+
+# Time column formats: name -> function of the timestamps (UTC)
+TIME_FORMATS = {
+    "seconds": lambda time: (time - pd.Timestamp(0, tz="UTC"))/pd.Timedelta(seconds=1),
+    "ISO dates": lambda time: time.strftime("%Y-%m-%d %H:%M:%S.%f"),
+    "dates with offset": lambda time: time.tz_convert("Europe/Paris").strftime("%Y-%m-%dT%H:%M:%S%z"),
+    "dates as strings": lambda time: time.strftime("%Y/%m/%d %H:%M:%S"), # Not parsed by pyarrow
+}
+
+def run(directory, size=10000):
+    check = Checks()
+    time = pd.Timestamp("2025-01-07", tz="UTC") + pd.to_timedelta(np.arange(size), unit="s")
+    values = np.random.default_rng(0).standard_normal((2, size))
+    ranges = [(100, 200), (0, size), (size - 50, size + 50), (5000, 5000 + 3600)]
+
+    for name, time_format in TIME_FORMATS.items():
+        path = os.path.join(directory, name.replace(" ", "_") + ".csv")
+        pd.DataFrame({"time": time_format(time), "a": values[0], "b": values[1]}).to_csv(path, index=False)
+        source = CSVSource({"path": path, "index_step": 4096})
+        check(f"{name}: measurements", source.measurements == ["a", "b"])
+
+        exact = True
+        for a, b in ranges:
+            stop = time[0] + pd.Timedelta(seconds=b)
+            df = asyncio.run(source.db_to_df(time[a], stop, measurement=["a", "b"]))
+            for i, measurement in enumerate(["a", "b"]):
+                measurement_df = df[df["_measurement"] == measurement]
+                exact &= np.array_equal(to_nanoseconds(measurement_df["_time"]), to_nanoseconds(time[a:b]))
+                exact &= np.allclose(measurement_df["value"].to_numpy(), values[i, a:b], rtol=1e-12, atol=0)
+        check(f"{name}: samples of the ranges", exact)
+
+        # Averaged over 60 s windows, timestamped at their end
+        df = asyncio.run(source.db_to_df(time[0], time[-1], avg_window=60, measurement="a"))
+        check(f"{name}: 60 s averages", np.allclose(df["value"].to_numpy()[:5], values[0, :300].reshape(5, 60).mean(axis=1)))
+
+        df = asyncio.run(source.db_to_df(time[0] - pd.Timedelta(days=1), time[0], measurement="a"))
+        check(f"{name}: nothing before the file", df is None)
+    return check
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        check = run(directory)
+    check.exit()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Parity of the compiled (numba) kernels with the NumPy/allantools/pandas implementations, on
+synthetic power-law noise. Exits with an error if a result differs by more than the tolerance.
+
+Examples:
+    pixi run python -m benchmarks.check_kernels
+    pixi run python -m benchmarks.check_kernels --sizes 1e3 1e6 --tolerance 1e-9
+"""
+import argparse
+import sys
+import time
+import numpy as np
+
+from benchmarks.noise import power_law_noise, NOISE_TYPES
+from data_processing import kernels
+from data_processing.allan_deviation import get_stab, oadev_batch
+from data_processing.moving_average import moving_average
+from data_processing.utils import resample_data
+
+def cases(size, noise_type, rng):
+    """
+    (name, function, elementwise, tolerance) of the checked functions, on one series.
+    elementwise: differences relative to each value (e.g. deviations over several decades), else to the largest one
+    tolerance: minimum tolerance (e.g. float32 results)
+    """
+    values = power_law_noise(size, NOISE_TYPES[noise_type], seed=0)
+    ts = 1.7e9 + np.arange(size, dtype=np.float64)
+    gappy = values.copy()
+    gappy[rng.random(size) < 0.05] = np.nan
+    irregular = np.sort(1.7e9 + rng.uniform(0, size/4, size))
+    modes = ["decade", "octave"] + (["all"] if size <= 10**4 else [])
+
+    for mode in modes:
+        yield f"get_stab ({mode})", lambda mode=mode: get_stab(ts, values, mode)[:2], True, 0
+    yield "oadev_batch", lambda: oadev_batch(np.vstack([values, values[::-1]]), 1.0)[:2], True, 0
+    yield "moving_average", lambda: moving_average(gappy, 100), False, 0
+    yield "moving_average (time)", lambda: moving_average(gappy, 100, time=irregular), False, 0
+    yield "moving_average (2-D)", lambda: moving_average(np.vstack([gappy, values]), 11), False, 0
+    yield "moving_average (float32 out)", lambda: moving_average(gappy, 100, out=np.empty(size, dtype=np.float32)), False, 1e-6
+    yield "resample_data", lambda: resample_data(irregular, gappy), False, 0
+
+def max_difference(expected, result, elementwise=True):
+    # Largest relative difference between two (nested) results, NaN at the same places
+    if isinstance(expected, (tuple, list)):
+        return max(max_difference(e, r, elementwise) for e, r in zip(expected, result))
+    expected, result = np.asarray(expected, dtype=np.float64), np.asarray(result, dtype=np.float64)
+    if expected.shape != result.shape or (np.isnan(expected) != np.isnan(result)).any():
+        return np.inf
+    valid = ~np.isnan(expected)
+    scale = np.abs(expected[valid]) if elementwise else np.abs(expected[valid]).max(initial=0)
+    return (np.abs(result[valid] - expected[valid])/np.maximum(scale, 1e-300)).max(initial=0)
+
+def run(sizes, noise_type, tolerance):
+    failures = []
+    for size in sizes:
+        for name, function, elementwise, min_tolerance in cases(size, noise_type, np.random.default_rng(0)):
+            kernels.set_backend("numpy")
+            start = time.perf_counter()
+            expected = function()
+            numpy_time = time.perf_counter() - start
+
+            kernels.set_backend("numba")
+            function() # Compilation
+            start = time.perf_counter()
+            result = function()
+            numba_time = time.perf_counter() - start
+
+            difference = max_difference(expected, result, elementwise)
+            failed = difference > max(tolerance, min_tolerance)
+            status = "FAILED" if failed else "ok"
+            print(f"{name + f' @ {size:.0e}':<40} {difference:>10.2e} {numpy_time*1e3:>10.2f} ms {numba_time*1e3:>10.2f} ms  {status}")
+            if failed:
+                failures.append(f"{name} @ {size:.0e}")
+    kernels.set_backend("auto")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity of the compiled kernels with the NumPy implementations.")
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1e3, 1e4, 1e5], help="Sizes of the synthetic series")
+    parser.add_argument("--noise", default="white_fm", choices=list(NOISE_TYPES), help="Type of synthetic noise")
+    parser.add_argument("--tolerance", type=float, default=1e-8, help="Maximum relative difference")
+    args = parser.parse_args()
+
+    print(f"{'Function':<40} {'Rel. diff':>10} {'NumPy':>13} {'Numba':>13}")
+    failures = run([int(size) for size in args.sizes], args.noise, args.tolerance)
+    if failures:
+        sys.exit("Results differing from the NumPy implementations:\n" + "\n".join(failures))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Checks of the memory budget of the cache against the InfluxDB stub (no database or network
+needed): ranges fetched far apart don't allocate the aligned grid in between, only the least
+recently used hours needed are evicted, and the ADev index tables are counted and dropped.
+Exits with an error if a check fails.
+
+Example:
+    pixi run python -m benchmarks.check_memory_budget
+"""
+import pandas as pd
+
+from benchmarks import Checks
+from benchmarks.influx_stub import InfluxStub
+from database.data_cache import DataCache
+from database.influxdb_handler import InfluxDBHandler
+
+def run(stub):
+    check = Checks()
+
+    handler = InfluxDBHandler(source={**stub.config()["influxdb"], "query_cache_mb": 0})
+    cache = DataCache(handler)
+    budget, store = cache.budget, cache.adev_store
+    measurements = list(stub.series)
+    t0 = stub.t0
+    hour = pd.Timedelta(hours=1)
+
+    def fetch(start, duration):
+        cache.fetch(start, start + duration, measurements, "1", "adev")
+
+    def covered(start, stop):
+        return all(cache.coverage["adev"][name].covers(start.value, stop.value) for name in measurements)
+
+    # Four contiguous hours, then one hour a week later: within a budget of twice their size
+    fetch(t0, 4*hour)
+    grid_nbytes = store.nbytes
+    budget.max_bytes = 2*budget.total()
+    week = t0 + pd.Timedelta(days=7)
+    fetch(week, hour)
+    check("a week apart: grid without the gap", store.nbytes < 2*grid_nbytes, f"{store.nbytes/2**20:.2f} MB")
+    check("a week apart: two blocks", len(store.blocks) == 2)
+    check("a week apart: nothing evicted", covered(t0, t0 + 4*hour) and budget.total() <= budget.max_bytes)
+
+    # The index tables count in the budget
+    cache.adev_index.table(measurements[0], "decade")
+    index_nbytes = budget.usage()["adev (index)"]
+    check("index tables counted", index_nbytes > 0, f"{index_nbytes/2**20:.2f} MB")
+
+    # Tight budget: the oldest hours are evicted, only as many as needed
+    total, grid_nbytes = budget.total(), store.nbytes
+    budget.max_bytes = int(total - index_nbytes - (total - index_nbytes)/10)
+    fetch(week + 2*hour, hour/2)
+    check("tight: within the budget", budget.total() <= budget.max_bytes, f"{budget.total()/2**20:.2f} MB")
+    check("tight: index tables dropped first", budget.usage()["adev (index)"] == 0)
+    check("tight: oldest hour evicted", not covered(t0, t0 + hour))
+    check("tight: the other hours kept", covered(t0 + 2*hour, t0 + 4*hour) and covered(week, week + hour))
+    check("tight: grid columns freed", store.nbytes < grid_nbytes, f"{store.nbytes/2**20:.2f} MB")
+
+    # A table left stale by new data is dropped, even within the budget
+    budget.max_bytes = 0
+    cache.adev_index.table(measurements[0], "decade")
+    fetch(t0, hour)
+    check("stale index table dropped", not cache.adev_index.tables)
+    return check
+
+def main():
+    with InfluxStub(duration=8*24*3600, rate=1.0) as stub:
+        check = run(stub)
+    check.exit()
+
+if __name__ == "__main__":
+    main()
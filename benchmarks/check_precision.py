@@ -0,0 +1,96 @@
+"""
+Checks of the storage precisions (see the storage_precision setting): round trip of the values,
+memory of the cached series, and Allan deviations unchanged on data stored exactly (e.g. 16-bit
+ADC readings). Exits with an error if a check fails.
+
+Example:
+    pixi run python -m benchmarks.check_precision --size 1e6
+"""
+import argparse
+import numpy as np
+import pandas as pd
+
+from benchmarks import Checks
+from benchmarks.noise import power_law_noise
+from data_processing.allan_deviation import get_stab
+from data_processing.precision import Precision
+from data_processing.sorted_store import SortedStore
+
+def adc_readings(size, dtype, scale, offset, rng):
+    # Values on the grid of a scaled integer type (as read from an ADC), with some NaN
+    info = np.iinfo(dtype)
+    noise = power_law_noise(size, -2, seed=0)
+    counts = np.rint(noise/np.abs(noise).max()*info.max*0.9)
+    values = offset + scale*counts
+    values[rng.random(size) < 0.01] = np.nan
+    return values
+
+def run(size):
+    check = Checks()
+
+    rng = np.random.default_rng(0)
+
+    # Round trips
+    values = power_law_noise(size, 0, seed=1) + 10
+    values[rng.random(size) < 0.01] = np.nan
+    float32 = Precision("float32")
+    data = float32.encode(values)
+    check("float32: stored as float32", data.dtype == np.float32)
+    check("float32: round trip", np.array_equal(float32.decode(data), values.astype(np.float32), equal_nan=True))
+
+    for dtype, scale, offset in [("int16", 1e-4, 10.0), ("int32", 1e-9, -3.0)]:
+        precision = Precision(dtype, scale, offset)
+        readings = adc_readings(size, dtype, scale, offset, rng)
+        data = precision.encode(readings)
+        decoded = precision.decode(data)
+        check(f"{dtype}: stored as {dtype}", data.dtype == np.dtype(dtype))
+        check(f"{dtype}: exact round trip", np.array_equal(decoded, readings, equal_nan=True))
+        check(f"{dtype}: NaN stored as the sentinel", np.array_equal(data == np.iinfo(dtype).min, np.isnan(readings)))
+
+        # Out of range: clipped to the valid integers (never to the NaN sentinel)
+        info = np.iinfo(dtype)
+        out_of_range = np.array([offset + scale*(info.max + 10.0), offset + scale*(info.min - 10.0), np.nan])
+        clipped = precision.decode(precision.encode(out_of_range))
+        check(f"{dtype}: clipped to the storage range", np.allclose(clipped[:2], [offset + scale*info.max, offset + scale*(info.min + 1)]) and np.isnan(clipped[2]))
+
+    # Memory of the cached series, against float64 and against the long dataframe it replaces
+    time = pd.Timestamp("2025-01-07", tz="UTC").value + np.arange(size, dtype=np.int64)*10**9
+    readings = adc_readings(size, "int16", 1e-4, 10.0, rng)
+    stores = {}
+    for setting in ["float64", "float32", {"dtype": "int16", "scale": 1e-4, "offset": 10.0}]:
+        store = SortedStore({"default": setting})
+        store.insert("adc", time, readings)
+        stores[str(Precision.from_setting(setting).dtype)] = store
+    long_df = pd.DataFrame({"_time": pd.to_datetime(time, utc=True), "_measurement": "adc", "value": readings})
+    df_nbytes = long_df.memory_usage(deep=True).sum()
+
+    float64_nbytes = stores["float64"].nbytes
+    for dtype in ["float32", "int16"]:
+        ratio = df_nbytes/stores[dtype].nbytes
+        check(f"{dtype} store: at least 2x smaller than the dataframe", ratio >= 2, f"{ratio:.1f}x")
+    ratio = float64_nbytes/stores["int16"].nbytes
+    check("int16 store: at least 2x smaller than float64", ratio >= 2, f"{ratio:.1f}x")
+    ratio = float64_nbytes/stores["float32"].nbytes
+    check("float32 store: smaller than float64", ratio > 1, f"{ratio:.1f}x")
+
+    # Allan deviation of the values stored exactly: unchanged
+    series_time, series_values = stores["int16"].series("adc")
+    valid = ~np.isnan(readings)
+    check("int16 store: float64 values for the ADev", series_values.dtype == np.float64)
+    for mode in ["decade", "octave"]:
+        expected = get_stab(time[valid]/1e9, readings[valid], mode)
+        valid_stored = ~np.isnan(series_values)
+        result = get_stab(series_time[valid_stored]/1e9, series_values[valid_stored], mode)
+        check(f"int16 store: ADev ({mode}) unchanged", all(np.array_equal(e, r) for e, r in zip(expected[:2], result[:2])))
+
+    return check
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks of the storage precisions.")
+    parser.add_argument("--size", type=float, default=1e5, help="Size of the synthetic series")
+    args = parser.parse_args()
+
+    run(int(args.size)).exit()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Checks of the query cache of InfluxDBHandler against the InfluxDB stub (no database or network
+needed), by the requests reaching the stub: concurrent identical or overlapping fetches request
+each hour block once, settled blocks are served from the cache, and live blocks (still receiving
+data) are requested again once expired. Exits with an error if a check fails.
+
+Example:
+    pixi run python -m benchmarks.check_query_cache
+"""
+import asyncio
+import time
+import pandas as pd
+
+from benchmarks import Checks
+from benchmarks.influx_stub import InfluxStub
+from database.influxdb_handler import InfluxDBHandler
+
+LIVE_TTL = 1.0 # s
+
+def run(past, live):
+    check = Checks()
+    hour = pd.Timedelta(hours=1)
+
+    def fetch(stub, handler, *ranges):
+        # Concurrent fetches of the ranges, returns the requests reaching the stub and the results
+        stub.reset_counters()
+        async def gather():
+            return await asyncio.gather(*[handler.db_to_df(start.to_pydatetime(), stop.to_pydatetime()) for start, stop in ranges])
+        results = asyncio.run(gather())
+        return stub.requests, results
+
+    # Settled blocks (in the past)
+    handler = InfluxDBHandler(source={**past.config()["influxdb"], "live_cache_seconds": LIVE_TTL})
+    t0 = past.t0
+    requests, (a, b) = fetch(past, handler, (t0, t0 + 2*hour), (t0, t0 + 2*hour))
+    check("identical concurrent fetches: one request per block", requests == 2, f"{requests} requests")
+    check("identical concurrent fetches: same data", a.equals(b) and len(a) == 2*3600*len(past.series))
+
+    requests, _ = fetch(past, handler, (t0 + 2*hour, t0 + 4*hour), (t0 + 3*hour, t0 + 5*hour))
+    check("overlapping concurrent fetches: shared block requested once", requests == 3, f"{requests} requests")
+
+    requests, (c,) = fetch(past, handler, (t0, t0 + 2*hour))
+    check("settled blocks: served from the cache", requests == 0 and c.equals(a), f"{requests} requests")
+    time.sleep(1.5*LIVE_TTL)
+    requests, _ = fetch(past, handler, (t0, t0 + 5*hour))
+    check("settled blocks: kept after the live TTL", requests == 0, f"{requests} requests")
+
+    # The previous hour (settled, waited for in the first minutes of an hour) and the current one (live)
+    now = pd.Timestamp.now(tz="UTC")
+    t0, stop = now.floor("h") - hour, now + hour/6
+    time.sleep(max((t0 + hour + 2*InfluxDBHandler.SETTLE_TIME - now).total_seconds(), 0))
+    handler = InfluxDBHandler(source={**live.config()["influxdb"], "live_cache_seconds": LIVE_TTL})
+    requests, _ = fetch(live, handler, (t0, stop))
+    check("live block: requested", requests == 2, f"{requests} requests")
+    requests, _ = fetch(live, handler, (t0, stop))
+    check("live block: cached within the TTL", requests == 0, f"{requests} requests")
+    time.sleep(1.5*LIVE_TTL)
+    requests, _ = fetch(live, handler, (t0, stop))
+    check("live block: requested again after the TTL", requests == 1, f"{requests} requests")
+    return check
+
+def main():
+    t0 = pd.Timestamp.now(tz="UTC").floor("h") - pd.Timedelta(hours=1)
+    with InfluxStub(duration=5*3600, rate=1.0) as past, InfluxStub(t0=t0, duration=3*3600, rate=1.0) as live:
+        check = run(past, live)
+    check.exit()
+
+if __name__ == "__main__":
+    main()
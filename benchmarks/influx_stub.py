@@ -0,0 +1,133 @@
+import asyncio
+import re
+import threading
+import numpy as np
+import pandas as pd
+from aiohttp import web
+
+from benchmarks.noise import power_law_noise
+
+class InfluxStub:
+    """
+    Local HTTP server answering the Flux queries of InfluxDBHandler with annotated CSV.
+
+    Serves synthetic measurements sampled at `rate` Hz from `t0`, for `duration` seconds.
+    The values only depend on the timestamp, so repeated queries return the same data.
+    Counts the requests and the bytes served.
+    """
+    def __init__(self, measurements=None, t0="2025-01-07T00:00:00Z", duration=3600, rate=1.0, port=0, seed=0):
+        self.measurements = measurements or {"white_fm": 0, "flicker_fm": -1, "random_walk_fm": -2}
+        self.t0 = pd.Timestamp(t0)
+        self.rate = float(rate)
+        self.port = port
+
+        # Precomputed series, one per measurement
+        n = int(duration*rate)
+        self.time_ns = self.t0.value + (np.arange(n)*1e9/self.rate).astype(np.int64)
+        self.series = {name: power_law_noise(n, alpha, seed=seed+i) for i, (name, alpha) in enumerate(self.measurements.items())}
+
+        self.requests = 0
+        self.bytes_served = 0
+        self.queries = []
+        self._loop = None
+        self._thread = None
+        self._runner = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def config(self, bucket="bucket"):
+        # Configuration for InfluxDBHandler
+        return {"influxdb": {"url": self.url, "token": "token", "org": "org", "bucket": bucket}}
+
+    def reset_counters(self):
+        self.requests = 0
+        self.bytes_served = 0
+        self.queries = []
+
+    def to_csv(self, query):
+        # Parse the parts of the query used by InfluxDBHandler
+        start, stop = [pd.Timestamp(value).value for value in re.search(r"range\(start: ([^,]+), stop: ([^)]+)\)", query).groups()]
+        measurements = list(self.series)
+        match = re.search(r"set: (\[.*?\])", query)
+        if match:
+            measurements = [name for name in re.findall(r'"([^"]+)"', match.group(1)) if name in self.series]
+        match = re.search(r"timedMovingAverage\(every: (\d+)s", query)
+        every = int(match.group(1)) if match else None
+
+        a, b = np.searchsorted(self.time_ns, [start, stop])
+        tables = []
+        for table, name in enumerate(measurements):
+            time_ns = self.time_ns[a:b]
+            values = self.series[name][a:b]
+            if every:
+                # Block average, timestamped at the end of each window
+                bins = (time_ns - 1) // (every*10**9)
+                keys, index = np.unique(bins, return_inverse=True)
+                values = np.bincount(index, weights=values)/np.bincount(index)
+                time_ns = (keys + 1)*every*10**9
+            if len(values) == 0:
+                continue
+            df = pd.DataFrame({
+                "": "", # Annotation column
+                "result": "",
+                "table": table,
+                "_start": pd.Timestamp(start, tz="UTC").isoformat().replace("+00:00", "Z"),
+                "_stop": pd.Timestamp(stop, tz="UTC").isoformat().replace("+00:00", "Z"),
+                "_time": pd.to_datetime(time_ns, utc=True).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                "_measurement": name,
+                "value": values,
+                })
+            tables.append(df)
+
+        header = "#datatype,string,long,dateTime:RFC3339,dateTime:RFC3339,dateTime:RFC3339,string,double\n" \
+                 "#group,false,false,true,true,false,true,false\n" \
+                 "#default,_result,,,,,,\n"
+        if not tables:
+            return header + ",result,table,_start,_stop,_time,_measurement,value\n"
+        return header + pd.concat(tables).to_csv(index=False)
+
+    async def handle_query(self, request):
+        self.requests += 1
+        body = await request.json()
+        self.queries.append(body["query"])
+        text = self.to_csv(body["query"])
+        self.bytes_served += len(text)
+        return web.Response(text=text, content_type="text/csv")
+
+    async def _start(self, started):
+        app = web.Application()
+        app.router.add_post("/api/v2/query", self.handle_query)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        started.set()
+
+    def start(self):
+        # Serve from a background thread
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start(started))
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
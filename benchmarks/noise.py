@@ -0,0 +1,30 @@
+import numpy as np
+
+# Noise types of the fractional frequency, by power-law exponent of its PSD (S_y ~ f^alpha)
+NOISE_TYPES = {"white_fm": 0, "flicker_fm": -1, "random_walk_fm": -2}
+
+def power_law_noise(n, alpha, seed=None):
+    """
+    Synthetic fractional frequency noise with a power-law PSD, S_y(f) ~ f^alpha.
+    n: number of samples
+    alpha: 0 (white FM), -1 (flicker FM) or -2 (random walk FM), any value in [-2, 0] is accepted
+    Based on Kasdin & Walter, "Discrete simulation of power law noise" (1992).
+    """
+    n = int(n)
+    rng = np.random.default_rng(seed)
+    white = rng.standard_normal(n)
+
+    if alpha == 0:
+        return white
+    if alpha == -2:
+        return np.cumsum(white)
+
+    # Filter coefficients h_k = h_(k-1) (k-1-alpha/2)/k, applied with an FFT convolution
+    k = np.arange(1, n)
+    h = np.empty(n)
+    h[0] = 1
+    np.cumprod((k - 1 - alpha/2)/k, out=h[1:])
+
+    size = 2*n
+    noise = np.fft.irfft(np.fft.rfft(white, size)*np.fft.rfft(h, size), size)[:n]
+    return noise
@@ -0,0 +1,203 @@
+"""
+Benchmarks of the data path, on synthetic power-law noise, against a local InfluxDB stub and on data files.
+
+Examples:
+    pixi run python -m benchmarks.run_benchmarks                      # Run and compare with the baselines
+    pixi run python -m benchmarks.run_benchmarks --save               # Run and save the results as the new baselines
+    pixi run python -m benchmarks.run_benchmarks --sizes 1e4 1e6 1e8  # Other series sizes
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+
+from benchmarks.noise import power_law_noise, NOISE_TYPES
+from benchmarks.influx_stub import InfluxStub
+from data_processing.allan_deviation import get_stab, get_errorbars, noise_id, to_phase
+from data_processing.chunked_adev import chunked_stab
+from data_processing.adev_index import TauSums
+from data_processing.moving_average import moving_average
+from data_processing.utils import resample_data
+from data_processing.sorted_store import SortedStore
+from database.influxdb_handler import InfluxDBHandler
+from database.data_cache import DataCache
+from database.file_sources import RawSource, CSVSource, ParquetSource
+
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines.json")
+NOISE_ID_BUDGET = 0.2 # Maximum relative overhead of the noise identification in get_stab
+
+def measure(function, repeat=1):
+    """
+    Best wall time (s) over `repeat` runs and peak memory (bytes) allocated by a function.
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def processing_benchmarks(sizes, noise_type):
+    # Numerical functions, on series of 1 Hz synthetic noise
+    alpha = NOISE_TYPES[noise_type]
+    for size in sizes:
+        values = power_law_noise(size, alpha, seed=0)
+        ts = np.arange(size, dtype=np.float64)
+        taus, devs, _ = get_stab(ts, values)
+
+        yield "get_stab", size, lambda: get_stab(ts, values)
+        yield "get_stab (alpha given)", size, lambda: get_stab(ts, values, alpha=alpha)
+        yield "chunked_stab", size, lambda: chunked_stab((ts[a:a+2**20], values[a:a+2**20]) for a in range(0, size, 2**20))
+
+        # ADev of a region from the index built once (e.g. when the region is dragged)
+        tau_sums = TauSums(ts, values)
+        yield "TauSums.stab (half region)", size, lambda: tau_sums.stab(size//4, 3*size//4)
+        phase, ms = to_phase(values), np.round(taus).astype(np.int64)
+        yield "noise_id", size, lambda: noise_id(phase, ms)
+        yield "get_errorbars", size, lambda: get_errorbars(values, taus, devs, rate=1, alpha=alpha, d=2, dev_type="allan")
+        yield "moving_average", size, lambda: moving_average(values, 100)
+        yield "moving_average (time)", size, lambda: moving_average(values, 100, time=ts)
+        yield "resample_data", size, lambda: resample_data(ts/2, values)
+
+        # Insertion of a new hour of data in a store already holding the series (cost independent of size)
+        store = SortedStore()
+        store.insert("white_fm", ts.astype(np.int64)*10**9, values)
+        block_time = (size + np.arange(3600))*10**9
+        block_values = np.resize(values, 3600)
+        yield "SortedStore.insert", size, lambda: store.insert("white_fm", block_time, block_values)
+
+def database_benchmarks(sizes, config_dir):
+    # Fetch path, against a local stub serving 1 Hz data (size = number of rows per measurement)
+    for size in sizes:
+        with InfluxStub(measurements={"white_fm": 0}, duration=size, rate=1.0) as stub:
+            config = stub.config()
+            config["influxdb"]["query_cache_mb"] = 0 # Cold fetches (the cached ones are measured apart)
+            config_path = os.path.join(config_dir, "settings.json")
+            with open(config_path, "w") as f:
+                json.dump(config, f)
+
+            handler = InfluxDBHandler(config_path)
+            cached_handler = InfluxDBHandler(config_path)
+            cached_handler.query_cache.max_bytes = 2**31
+            start = stub.t0.to_pydatetime()
+            stop = start + timedelta(seconds=size)
+
+            def smart_fetch():
+                # Cold cache each time
+                DataCache(handler).fetch(start, stop, ["white_fm"], "1", "adev")
+
+            yield "db_to_df", size, lambda: asyncio.run(handler.db_to_df(start, stop, measurement="white_fm"))
+            yield "smart_fetch", size, smart_fetch
+            yield "db_to_df (query cache)", size, lambda: asyncio.run(cached_handler.db_to_df(start, stop, measurement="white_fm"))
+
+def file_benchmarks(sizes, data_dir):
+    # Reads of half of the time range of 1 Hz data files (size = number of rows)
+    for size in sizes:
+        ts = 1.7e9 + np.arange(size, dtype=np.float64)
+        df = pd.DataFrame({"time": ts, "white_fm": power_law_noise(size, NOISE_TYPES["white_fm"], seed=0)})
+        raw_path, csv_path, parquet_path = [os.path.join(data_dir, f"data_{size}.{extension}") for extension in ["bin", "csv", "parquet"]]
+        df.to_records(index=False).tofile(raw_path)
+        df.to_csv(csv_path, index=False)
+        df.to_parquet(parquet_path, index=False, row_group_size=2**16)
+
+        start = pd.Timestamp(ts[size//4], unit="s", tz="UTC").to_pydatetime()
+        stop = start + timedelta(seconds=size//2)
+        sources = [RawSource({"path": raw_path, "columns": ["time", "white_fm"]}),
+                   CSVSource({"path": csv_path}),
+                   ParquetSource({"path": parquet_path})]
+        for source in sources:
+            if isinstance(source, CSVSource):
+                source.index # Built once, on first use
+            yield f"{type(source).__name__} (half range)", size, lambda source=source: asyncio.run(source.db_to_df(start, stop))
+
+def run(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as config_dir:
+        benchmarks = processing_benchmarks(args.sizes, args.noise)
+        if not args.skip_db:
+            benchmarks = itertools.chain(benchmarks, database_benchmarks(args.db_sizes, config_dir), file_benchmarks(args.db_sizes, config_dir))
+
+        # Run each benchmark as soon as it is generated (the stub of the database ones is running)
+        for name, size, function in benchmarks:
+            elapsed, peak = measure(function, args.repeat)
+            key = f"{name} @ {size:.0e}"
+            results[key] = {"time": elapsed, "throughput": size/elapsed, "peak_memory": peak}
+            print(f"{key:<35} {elapsed*1e3:>10.2f} ms {size/elapsed:>12.3e} pts/s {peak/2**20:>10.1f} MB")
+
+    # Overhead of the noise identification at each tau (saved with the get_stab results), relative to the
+    # rest of get_stab: more stable than the difference of the two get_stab timings
+    for size in args.sizes:
+        stab = results[f"get_stab @ {size:.0e}"]
+        stab["noise_id_overhead"] = results[f"noise_id @ {size:.0e}"]["time"]/results[f"get_stab (alpha given) @ {size:.0e}"]["time"]
+        key = f"noise_id overhead @ {size:.0e}"
+        print(f"{key:<35} {stab['noise_id_overhead']:>10.1%} of get_stab (alpha given)")
+    return results
+
+def compare(results, baselines, tolerance):
+    # Report the benchmarks slower (or using more memory) than their baseline
+    regressions = []
+    for key, result in results.items():
+        baseline = baselines.get(key)
+        if baseline is None:
+            continue
+        for metric in ["time", "peak_memory"]:
+            if result[metric] > baseline[metric]*(1 + tolerance):
+                regressions.append(f"{key}: {metric} {result[metric]:.3g} > baseline {baseline[metric]:.3g}")
+    return regressions
+
+def overruns(results):
+    # Report the noise identification overheads above NOISE_ID_BUDGET
+    return [f"{key}: noise_id overhead {result['noise_id_overhead']:.1%} > {NOISE_ID_BUDGET:.0%}"
+            for key, result in results.items() if result.get("noise_id_overhead", 0) > NOISE_ID_BUDGET]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the data path.")
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1e4, 1e5, 1e6], help="Sizes of the synthetic series (up to 1e8)")
+    parser.add_argument("--db-sizes", nargs="+", type=float, default=[1e4, 1e5], help="Number of rows fetched from the InfluxDB stub")
+    parser.add_argument("--noise", default="white_fm", choices=list(NOISE_TYPES), help="Type of synthetic noise")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs (the best time is kept)")
+    parser.add_argument("--skip-db", action="store_true", help="Skip the database and data file benchmarks")
+    parser.add_argument("--save", action="store_true", help="Save the results as the new baselines")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Relative tolerance before reporting a regression")
+    parser.add_argument("--baselines", default=BASELINES, help="Baselines file")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes]
+    args.db_sizes = [int(size) for size in args.db_sizes]
+
+    results = run(args)
+
+    if args.save:
+        baselines = {}
+        if os.path.exists(args.baselines):
+            with open(args.baselines) as f:
+                baselines = json.load(f)
+        baselines.update(results)
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=4)
+        print(f"Baselines saved to '{args.baselines}'.")
+        return
+
+    regressions = overruns(results)
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            regressions += compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print("Regression:", regression)
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Cold-start time of the application: from the launch of the interpreter until the main window is
+shown, and until the modules loaded in the background are ready. Run from the directory of main.py
+(the configuration file is needed).
+
+Examples:
+    pixi run python -m benchmarks.startup                # Check the default time budget
+    pixi run python -m benchmarks.startup --budget 1.5   # Other budget (s)
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+# Started in a new interpreter, reports the time at which the window is shown and ready
+CHILD = """
+import sys, time
+from PyQt5.QtWidgets import QApplication
+app = QApplication(sys.argv)
+import main
+window = main.create_window()
+window.show()
+app.processEvents()
+print("shown", time.time(), flush=True)
+main.warm_up()
+print("ready", time.time(), flush=True)
+"""
+
+def startup_time(env):
+    # Time (s) until the window is shown and until it is ready, in a new interpreter
+    launch = time.time()
+    process = subprocess.run([sys.executable, "-c", CHILD], env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        print(process.stderr)
+        sys.exit("The application failed to start.")
+    times = dict(line.split() for line in process.stdout.splitlines() if line.startswith(("shown", "ready")))
+    return float(times["shown"]) - launch, float(times["ready"]) - launch
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time of the application.")
+    parser.add_argument("--budget", type=float, default=2.0, help="Maximum time (s) until the window is shown")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of launches")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+
+    times = np.array([startup_time(env) for _ in range(args.repeat)])
+    print(f"{'Window shown':<15} first {times[0, 0]:.2f} s, median {np.median(times[:, 0]):.2f} s")
+    print(f"{'Ready':<15} first {times[0, 1]:.2f} s, median {np.median(times[:, 1]):.2f} s")
+
+    # The first launch is the coldest one
+    if times[0, 0] > args.budget:
+        print(f"Startup over budget: {times[0, 0]:.2f} s > {args.budget:.2f} s")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
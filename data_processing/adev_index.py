@@ -0,0 +1,132 @@
+import numpy as np
+
+from data_processing.allan_deviation import get_errorbars, noise_id
+from data_processing.chunked_adev import tau_factors
+from instrumentation.tracer import tracer
+
+class TauSums:
+    """
+    Cumulative sums of the squared second differences of the phase of a frequency series, for
+    each averaging factor of the mode, kept every `step` terms. The overlapping Allan deviation of
+    any range of samples is then given by two lookups per tau, plus the terms at both ends of
+    the range summed from the phase (the same as get_stab on the range, within float tolerance).
+    """
+    def __init__(self, time, values, mode="decade", step=256):
+        self.time = np.asarray(time, dtype=np.float64)
+        self.mode = mode
+        self.step = step
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+
+        # Phase (any constant removed from the frequency cancels in the second differences)
+        self.phase = np.zeros(n + 1)
+        if n:
+            np.cumsum(values - values.mean(), out=self.phase[1:])
+
+        self.ms = tau_factors(n + 1, mode) if n > 2 else np.zeros(0, dtype=np.int64)
+        self.ms = self.ms[n + 1 - 2*self.ms > 1]
+        self.sums = []
+        for m in self.ms:
+            d = self.second_differences(m, 0, n + 1 - 2*m)
+            sums = np.zeros(len(d) + 1)
+            np.cumsum(d*d, out=sums[1:])
+            self.sums.append(sums[::step].copy())
+
+    @property
+    def nbytes(self):
+        return self.time.nbytes + self.phase.nbytes + sum(sums.nbytes for sums in self.sums)
+
+    def second_differences(self, m, a, b):
+        # Terms [a, b) of the second differences of the phase for the factor m
+        d = self.phase[a+2*m:b+2*m] - 2*self.phase[a+m:b+m]
+        d += self.phase[a:b]
+        return d
+
+    def sum_sq(self, j, a, b):
+        # Sum of the squared terms [a, b) of the factor ms[j]
+        m = self.ms[j]
+        k_a, k_b = -(-a//self.step), b//self.step
+        if k_a >= k_b:
+            d = self.second_differences(m, a, b)
+            return np.dot(d, d)
+        d_a = self.second_differences(m, a, k_a*self.step)
+        d_b = self.second_differences(m, k_b*self.step, b)
+        return self.sums[j][k_b] - self.sums[j][k_a] + np.dot(d_a, d_a) + np.dot(d_b, d_b)
+
+    def count(self, start, stop):
+        # Samples [p, q) within [start, stop] (s)
+        return np.searchsorted(self.time, start, side="left"), np.searchsorted(self.time, stop, side="right")
+
+    def stab(self, p, q, scale=1.0):
+        """
+        Taus, deviations and error bars (as get_stab) of the samples [p, q), with the values
+        multiplied by scale. None if there are less than 3 samples.
+        """
+        n = q - p
+        if n < 3:
+            return None
+        rate = (n - 1)/(self.time[q-1] - self.time[p])
+
+        # The factors of the region are the first ones of the index
+        ms = tau_factors(n + 1, self.mode)
+        ns = n + 1 - 2*ms
+        keep = ns > 1
+        ms, ns = ms[keep], ns[keep]
+
+        sum_sq = np.array([self.sum_sq(j, p, p + ns[j]) for j in range(len(ms))])
+        devs = abs(scale)*np.sqrt(np.maximum(sum_sq, 0)/(2.0*ns))/ms
+
+        taus = ms/rate
+        alpha = noise_id(self.phase[p:q+1], ms)
+        err_lo, err_hi = get_errorbars(range(n), taus, devs, rate=rate, alpha=alpha, d=2, dev_type="allan")
+        return taus, devs, [np.array(err_lo), np.array(err_hi)]
+
+class AdevIndex:
+    """
+    TauSums of the valid samples of each measurement of an AlignedStore, built on first use
+    and rebuilt when the measurement changes (e.g. after a fetch).
+    """
+    MODES = ("decade", "octave")
+
+    def __init__(self, store):
+        self.store = store
+        self.tables = {} # (measurement, mode) -> (version, TauSums)
+
+    def clear(self):
+        self.tables = {}
+
+    def drop_stale(self):
+        # Drop the tables of the measurements changed (or removed) since they were built
+        self.tables = {key: entry for key, entry in self.tables.items() if entry[0] == self.store.versions.get(key[0])}
+
+    @property
+    def nbytes(self):
+        return sum(table.nbytes for _, table in self.tables.values())
+
+    def is_current(self, measurement, mode):
+        # Whether the table of a measurement is built and up to date
+        entry = self.tables.get((measurement, mode))
+        return entry is not None and entry[0] == self.store.versions.get(measurement)
+
+    def snapshot(self, measurement):
+        # Version, time and values of the valid samples of a measurement (copies, e.g. to build a table in a thread)
+        return (self.store.versions.get(measurement), *self.store.series(measurement))
+
+    def install(self, measurement, mode, version, table):
+        # Table built from a snapshot, kept if the measurement hasn't changed since
+        if self.store.versions.get(measurement) != version:
+            return False
+        self.tables[(measurement, mode)] = (version, table)
+        return True
+
+    @tracer.timed("processing.adev_index.table")
+    def table(self, measurement, mode):
+        version = self.store.versions.get(measurement)
+        entry = self.tables.get((measurement, mode))
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        _, time, values = self.snapshot(measurement)
+        table = TauSums(time, values, mode)
+        self.tables[(measurement, mode)] = (version, table)
+        return table
@@ -0,0 +1,306 @@
+import itertools
+import numpy as np
+
+from data_processing.utils import to_timestamp
+
+# Versions of the measurements, unique across stores and resets
+_versions = itertools.count(1)
+
+class _Block:
+    """
+    Dense part of the grid: storage columns of contiguous grid samples (measurements x samples),
+    with some headroom on both sides.
+    """
+    def __init__(self, n_rows, k_first, k_last):
+        n_cols = k_last - k_first + 1
+        self.values = np.full((n_rows, n_cols), np.nan)
+        self.mask = np.zeros((n_rows, n_cols), dtype=bool)
+        self.k0 = k_first # Grid index (time/step) of the first storage column
+        self.start = 0 # First used storage column
+        self.stop = n_cols # Last used storage column + 1
+
+    @property
+    def first(self):
+        return self.k0 + self.start
+
+    @property
+    def last(self):
+        return self.k0 + self.stop - 1
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.mask.nbytes
+
+    def add_rows(self, n_rows):
+        values = np.full((n_rows, self.values.shape[1]), np.nan)
+        mask = np.zeros((n_rows, self.values.shape[1]), dtype=bool)
+        values[:len(self.values)] = self.values
+        mask[:len(self.mask)] = self.mask
+        self.values, self.mask = values, mask
+
+    def copy_to(self, block):
+        # Copy the used columns into another block covering them
+        shift = self.k0 - block.k0
+        block.values[:, self.start+shift:self.stop+shift] = self.values[:, self.start:self.stop]
+        block.mask[:, self.start+shift:self.stop+shift] = self.mask[:, self.start:self.stop]
+
+    def reserve(self, k_first, k_last):
+        # Make sure that the grid indices [k_first, k_last] have a storage column
+        first = min(k_first - self.k0, self.start)
+        last = max(k_last - self.k0 + 1, self.stop)
+        n_cols = self.values.shape[1]
+
+        if first < 0 or last > n_cols:
+            # Reallocate with some headroom on both sides, so that repeated
+            # extensions are amortized
+            used = last - first
+            margin = max(used//2, 1024)
+            new_cols = used + 2*margin
+            values = np.full((self.values.shape[0], new_cols), np.nan)
+            mask = np.zeros((self.values.shape[0], new_cols), dtype=bool)
+
+            shift = margin - first
+            values[:, self.start+shift:self.stop+shift] = self.values[:, self.start:self.stop]
+            mask[:, self.start+shift:self.stop+shift] = self.mask[:, self.start:self.stop]
+
+            self.values, self.mask = values, mask
+            self.k0 -= shift
+            self.start += shift
+            self.stop += shift
+            first += shift
+            last += shift
+
+        self.start, self.stop = min(self.start, first), max(self.stop, last)
+
+    def columns(self, start, stop, step):
+        # Storage columns [a, b) of the grid samples within [start, stop] (s, possibly infinite)
+        start = max(start, self.first*step)
+        stop = min(stop, self.last*step)
+        a = int(np.ceil(start/step - 1e-9)) - self.k0
+        b = int(np.floor(stop/step + 1e-9)) - self.k0 + 1
+        return max(a, self.start), max(min(b, self.stop), max(a, self.start))
+
+class AlignedStore:
+    """
+    Measurements aligned on a common, uniform time grid.
+
+    The data is kept in 2-D arrays (measurements x grid samples), with NaN and a
+    False validity mask where a measurement has no data. The grid is aligned on
+    multiples of `step` seconds. It is stored as blocks of contiguous grid samples
+    (see _Block), split where no measurement has data for more than max_gap samples:
+    the gaps between the fetched ranges (or left by evicted ones) take no memory.
+    """
+    def __init__(self, step=1.0, max_gap=1024):
+        self.step = float(step)
+        self.max_gap = max_gap
+        self.names = [] # Row -> measurement
+        self.rows = {} # Measurement -> row
+        self.versions = {} # Measurement -> version, changed each time its data changes
+
+        self.blocks = [] # Sorted by time, separated by more than max_gap samples
+        self._n_rows = 0 # Rows of the storage of the blocks
+
+    def __len__(self):
+        return sum(block.stop - block.start for block in self.blocks)
+
+    @property
+    def nbytes(self):
+        return sum(block.nbytes for block in self.blocks)
+
+    def reset(self, step=None):
+        self.__init__(self.step if step is None else step, self.max_gap)
+
+    @property
+    def time(self):
+        # Timestamps (s) of the grid samples stored
+        return self.region(-np.inf, np.inf)[0]
+
+    @property
+    def values(self):
+        return self.region(-np.inf, np.inf)[1]
+
+    @property
+    def mask(self):
+        return self.region(-np.inf, np.inf)[2]
+
+    def _add_row(self, measurement):
+        row = len(self.names)
+        if row == self._n_rows:
+            # Double the number of rows
+            self._n_rows = max(2*row, 8)
+            for block in self.blocks:
+                block.add_rows(self._n_rows)
+
+        self.names.append(measurement)
+        self.rows[measurement] = row
+        return row
+
+    def _block(self, k_first, k_last):
+        # Block storing the grid indices [k_first, k_last], merging the blocks they bring within max_gap
+        near = [block for block in self.blocks if block.first - self.max_gap <= k_last and block.last + self.max_gap >= k_first]
+        if len(near) == 1:
+            near[0].reserve(k_first, k_last)
+            return near[0]
+
+        block = _Block(self._n_rows, min([k_first] + [other.first for other in near]), max([k_last] + [other.last for other in near]))
+        for other in near:
+            other.copy_to(block)
+        self.blocks = sorted([other for other in self.blocks if not other in near] + [block], key=lambda other: other.first)
+        return block
+
+    def update(self, measurement, time, values):
+        """
+        Add the samples of a measurement. Samples falling in the same grid cell are averaged and
+        replace what was stored in that cell.
+        """
+        time = np.asarray(time, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        keep = ~np.isnan(values)
+        time, values = time[keep], values[keep]
+        if len(time) == 0:
+            return
+
+        row = self.rows.get(measurement)
+        if row is None:
+            row = self._add_row(measurement)
+
+        k = np.round(time/self.step).astype(np.int64)
+        if np.any(np.diff(k) < 0):
+            order = np.argsort(k, kind="stable")
+            k, values = k[order], values[order]
+
+        # One run of samples per block (split at the gaps)
+        breaks = np.nonzero(np.diff(k) > self.max_gap)[0] + 1
+        for a, b in zip([0, *breaks], [*breaks, len(k)]):
+            k_first, k_last = k[a], k[b-1]
+            block = self._block(k_first, k_last)
+
+            # Average per cell
+            cells = k[a:b] - k_first
+            counts = np.bincount(cells)
+            sums = np.bincount(cells, weights=values[a:b])
+            filled = counts > 0
+
+            columns = np.nonzero(filled)[0] + (k_first - block.k0)
+            block.values[row, columns] = sums[filled]/counts[filled]
+            block.mask[row, columns] = True
+        self.versions[measurement] = next(_versions)
+
+    def update_from_df(self, df):
+        # Add the samples of a long dataframe (columns: "_measurement", "_time", "value")
+        if df is None or df.empty:
+            return
+        for measurement, measurement_df in df.groupby("_measurement", sort=False):
+            self.update(measurement, to_timestamp(measurement_df["_time"]), measurement_df["value"].to_numpy())
+
+    def clear_range(self, measurement, start, stop):
+        row = self.rows.get(measurement)
+        if row is None:
+            return
+        for block in self.blocks:
+            a, b = block.columns(start, stop, self.step)
+            block.values[row, a:b] = np.nan
+            block.mask[row, a:b] = False
+        self.versions[measurement] = next(_versions)
+
+    def nbytes_within(self, measurement, start, stop):
+        """
+        Bytes of the valid samples of a measurement within [start, stop] (s), its share of the
+        storage columns (freed once cleared for all the measurements, and trimmed)
+        """
+        row = self.rows.get(measurement)
+        if row is None:
+            return 0
+        cells = 0
+        for block in self.blocks:
+            a, b = block.columns(start, stop, self.step)
+            cells += np.count_nonzero(block.mask[row, a:b])
+        return cells*self._n_rows*9//len(self.names) # float64 values and bool mask
+
+    def derive(self, measurement, inputs, function):
+        """
+        Set a measurement computed from others on the whole grid, valid where all its inputs are.
+        function(input rows, out): writes the values to out (views of the storage, no copies)
+        """
+        row = self.rows.get(measurement)
+        if row is None:
+            row = self._add_row(measurement)
+        rows = [self.rows[name] for name in inputs]
+        for block in self.blocks:
+            values = block.values[row, block.start:block.stop]
+            mask = block.mask[row, block.start:block.stop]
+
+            function([block.values[i, block.start:block.stop] for i in rows], values)
+            np.isfinite(values, out=mask)
+            for i in rows:
+                mask &= block.mask[i, block.start:block.stop]
+            values[~mask] = np.nan
+        self.versions[measurement] = next(_versions)
+
+    def trim(self):
+        # Release the storage columns without valid samples (e.g. after the data was evicted), splitting the blocks at the gaps
+        blocks = []
+        for block in self.blocks:
+            valid = np.nonzero(block.mask[:len(self.names), block.start:block.stop].any(axis=0))[0] + block.start
+            breaks = np.nonzero(np.diff(valid) > self.max_gap)[0] + 1
+            runs = [(valid[a], valid[b-1] + 1) for a, b in zip([0, *breaks], [*breaks, len(valid)]) if b > a]
+            if runs == [(block.start, block.stop)] and block.values.shape[1] <= 2*(block.stop - block.start) + 2048:
+                blocks.append(block)
+                continue
+            for a, b in runs:
+                run = _Block(self._n_rows, block.k0 + a, block.k0 + b - 1)
+                run.values[:] = block.values[:, a:b]
+                run.mask[:] = block.mask[:, a:b]
+                blocks.append(run)
+        self.blocks = blocks
+
+    def series(self, measurement):
+        # Time (s) and values of the valid samples of a measurement (copies)
+        row = self.rows[measurement]
+        time, values = [np.empty(0)], [np.empty(0)]
+        for block in self.blocks:
+            mask = block.mask[row, block.start:block.stop]
+            time.append((block.first + np.nonzero(mask)[0])*self.step)
+            values.append(block.values[row, block.start:block.stop][mask])
+        return np.concatenate(time), np.concatenate(values)
+
+    def region(self, start, stop, measurements=None):
+        """
+        Time, values and mask of the grid samples within [start, stop] (s), without the gaps
+        between the blocks. For all the measurements within a single block, the result is made
+        of views of the storage.
+        """
+        rows = slice(0, len(self.names)) if measurements is None else [self.rows[measurement] for measurement in measurements]
+        parts = [(block, *block.columns(start, stop, self.step)) for block in self.blocks]
+        parts = [(block, a, b) for block, a, b in parts if b > a]
+        if len(parts) == 1:
+            block, a, b = parts[0]
+            return (block.k0 + np.arange(a, b))*self.step, block.values[rows, a:b], block.mask[rows, a:b]
+
+        n_rows = len(self.names) if measurements is None else len(rows)
+        time = np.concatenate([np.empty(0)] + [(block.k0 + np.arange(a, b))*self.step for block, a, b in parts])
+        values = np.concatenate([np.empty((n_rows, 0))] + [block.values[rows, a:b] for block, a, b in parts], axis=1)
+        mask = np.concatenate([np.zeros((n_rows, 0), dtype=bool)] + [block.mask[rows, a:b] for block, a, b in parts], axis=1)
+        return time, values, mask
+
+def regression_slopes(x, y, x_mask, y_mask):
+    """
+    Least-squares slopes of y against each row of x, using the samples valid in both.
+    x: 2-D array (measurements x samples)
+    y: 1-D array (samples)
+    """
+    mask = x_mask & y_mask
+    n = mask.sum(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = np.where(mask, x, 0).sum(axis=1)/n
+        y_mean = np.where(mask, y, 0).sum(axis=1)/n
+
+        dx = np.where(mask, x - x_mean[:, None], 0)
+        dy = np.where(mask, y - y_mean[:, None], 0)
+        return (dx*dy).sum(axis=1)/(dx*dx).sum(axis=1)
+
+def masked_mean(values, mask):
+    # Mean of each row, using only the valid samples
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(mask, values, 0).sum(axis=1)/mask.sum(axis=1)
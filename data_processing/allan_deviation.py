@@ -1,14 +1,138 @@
-import allantools
 import numpy as np
 
-def get_stab(ts, values, mode='decade'):
+from data_processing import kernels
+from instrumentation.tracer import tracer
+
+@tracer.timed("processing.get_stab")
+def get_stab(ts, values, mode='decade', alpha=None):
+    """
+    Taus, overlapping Allan deviations and error bars of a frequency series.
+    alpha: noise type of the error bars (see get_errorbars), identified at each tau if None (see noise_id)
+    """
     rate = 1/np.mean(np.diff(ts))
-    (taus, devs, errs, ns) = allantools.oadev(values, rate=rate, data_type="freq", taus=mode)
+    phase = to_phase(values)
+    if kernels.compiled() is not None and mode in ("decade", "octave", "all"):
+        taus, devs = kernels.oadev(phase, rate, mode)
+    else:
+        import allantools # Slow to import (scipy), loaded on first use
+        (taus, devs, errs, ns) = allantools.oadev(values, rate=rate, data_type="freq", taus=mode)
 
-    err_lo, err_hi = get_errorbars(values,taus,devs,rate=rate,alpha=0,d=2,dev_type="allan")
+    if alpha is None:
+        alpha = noise_id(phase, np.round(taus*rate).astype(np.int64))
+    err_lo, err_hi = get_errorbars(values,taus,devs,rate=rate,alpha=alpha,d=2,dev_type="allan")
     error_bars = [np.array(err_lo),np.array(err_hi)]
     return taus, devs, error_bars
 
+def to_phase(values):
+    # Phase of a frequency series, in samples: cumulative sum of the frequency (mean removed), starting at zero
+    values = np.asarray(values, dtype=np.float64)
+    phase = np.zeros(len(values) + 1)
+    if len(values):
+        np.cumsum(values - values.mean(), out=phase[1:])
+    return phase
+
+def acf_noise_id(x, dmax=2):
+    """
+    Noise type (alpha, integer) of frequency data, by the lag-1 autocorrelation method (Riley), as
+    allantools.autocorr_noise_id but without its Python loops.
+    """
+    # Remove the frequency drift (linear fit)
+    t = np.arange(len(x)) - (len(x) - 1)/2
+    x = x - x.mean() - np.dot(t, x)/np.dot(t, t)*t
+
+    d = 0 # Number of differences
+    while True:
+        x = x - x.mean()
+        norm = np.dot(x, x)
+        if norm == 0:
+            return 0
+        r1 = np.dot(x[:-1], x[1:])/norm
+        rho = r1/(1 + r1)
+        if rho < 0.25 or d >= dmax:
+            return int(np.clip(-np.round(2*rho) - 2*d, -2, 2))
+        x = np.diff(x)
+        d += 1
+
+@tracer.timed("processing.noise_id")
+def noise_id(phase, ms, max_blocks=2**13, min_blocks=30, max_taus=64):
+    """
+    Noise type (alpha, see get_errorbars) at each averaging factor m, from the lag-1 autocorrelation of
+    the frequency averaged over blocks of m samples. The block averages are the differences of the
+    phase every m samples, so each factor only reads its n/m block boundaries.
+    phase: see to_phase (or any array-like, e.g. a memory map)
+    ms: sorted averaging factors
+    max_blocks: maximum number of blocks used per factor (the first ones)
+    min_blocks: minimum number of blocks to identify the noise, the other factors (and the ones
+    skipped when there are more than max_taus, e.g. mode 'all') take the alpha of the nearest
+    identified factor, or 0 if there is none
+    """
+    ms = np.asarray(ms, dtype=np.int64)
+    n = len(phase) - 1
+    blocks = np.minimum(n//np.maximum(ms, 1), max_blocks)
+    identified = np.flatnonzero(blocks >= min_blocks)
+    if len(identified) == 0:
+        return np.zeros(len(ms), dtype=np.int64)
+    if len(identified) > max_taus:
+        identified = identified[np.unique(np.geomspace(1, len(identified), max_taus).astype(np.int64)) - 1]
+
+    alphas = np.array([acf_noise_id(np.diff(phase[:blocks[j]*ms[j]+1:ms[j]])) for j in identified])
+
+    # Nearest identified factor (in log scale)
+    log_m, log_identified = np.log(ms), np.log(ms[identified])
+    right = np.minimum(np.searchsorted(log_identified, log_m), len(identified) - 1)
+    left = np.maximum(right - 1, 0)
+    nearest = np.where(np.abs(log_m - log_identified[left]) <= np.abs(log_identified[right] - log_m), left, right)
+    return alphas[nearest]
+
+@tracer.timed("processing.oadev_batch")
+def oadev_batch(values, rate, mode='decade', block_size=2**22):
+    """
+    Overlapping Allan deviation of several frequency series sampled at the same times, in one pass.
+    values: 2-D array (series x samples)
+    rate: sampling rate in Hz
+    mode: taus ('decade', 'octave', 'all')
+    block_size: maximum number of elements of the temporary arrays
+    Returns the taus, the deviations (series x taus) and the number of terms of each tau.
+    """
+    import allantools
+    values = np.atleast_2d(values)
+    n_series, n = values.shape
+
+    # Frequency to phase, as done by allantools (mean removed, starting at zero)
+    phase = np.zeros((n_series, n+1))
+    np.cumsum(values - values.mean(axis=1, keepdims=True), axis=1, out=phase[:, 1:])
+    phase /= rate
+
+    _, ms, taus = allantools.tau_generator(phase[0], rate, taus=mode)
+    ms = ms.astype(int)
+    devs = np.zeros((n_series, len(ms)))
+    ns = np.maximum(n + 1 - 2*ms, 0)
+
+    compiled = kernels.compiled()
+    if compiled is not None:
+        sum_sq = np.zeros((n_series, len(ms)))
+        for i in range(n_series):
+            compiled.oadev_sum_sq(phase[i], ms, sum_sq[i])
+        devs = np.sqrt(sum_sq/(2.0*np.maximum(ns, 1)))/ms*rate
+        keep = ns > 1
+        return taus[keep], devs[:, keep], ns[keep]
+
+    # Second differences of the phase, by blocks of columns to bound the memory
+    step = max(block_size//n_series, 1)
+    for j, m in enumerate(ms):
+        sum_sq = np.zeros(n_series)
+        for a in range(0, ns[j], step):
+            b = min(a + step, ns[j])
+            d = phase[:, a+2*m:b+2*m] - 2*phase[:, a+m:b+m]
+            d += phase[:, a:b]
+            sum_sq += np.einsum("ij,ij->i", d, d)
+        devs[:, j] = np.sqrt(sum_sq/(2.0*max(ns[j], 1)))/m*rate
+
+    # Remove results with a too small number of terms
+    keep = ns > 1
+    return taus[keep], devs[:, keep], ns[keep]
+
+@tracer.timed("processing.get_errorbars")
 def get_errorbars(time_series, taus, devs, rate=1,alpha=0, d=2, dev_type="adev"):
     """
     Gets errorbars from Allan deviation data. Based on Greenhall equivalent degrees of freedom. Supposes the noise type is known.
@@ -16,9 +140,10 @@ def get_errorbars(time_series, taus, devs, rate=1,alpha=0, d=2, dev_type="adev")
     taus: list of taus
     devs: list of deviations for the given taus
     rate: sampling rate in s
-    alpha: defines the noise type --> (+2:White PM, +1:Flicker PM, 0:White FM, -1:Flicker FM, -2:Random Walk FM)
+    alpha: defines the noise type --> (+2:White PM, +1:Flicker PM, 0:White FM, -1:Flicker FM, -2:Random Walk FM), or one per tau
     d: deviation type (1:First-difference variance, 2:Allan variance, 3:Hadamard variance)
     """
+    import allantools
     overlapping = False
     modified = False
     if dev_type =="modified":
@@ -28,9 +153,15 @@ def get_errorbars(time_series, taus, devs, rate=1,alpha=0, d=2, dev_type="adev")
 
     cis = [] # Confidence interval
     edfs = [] # Greenhall equivalent degrees of freedom
-    for (t, dev) in zip(taus, devs):
-        edf = allantools.edf_greenhall(alpha=alpha, d=d, m=np.round(t*rate,3), N=len(
-            time_series), overlapping=overlapping, modified=modified)
+    alphas = np.broadcast_to(alpha, np.shape(taus))
+    for (t, dev, alpha) in zip(taus, devs, alphas):
+        try:
+            edf = allantools.edf_greenhall(alpha=int(alpha), d=d, m=np.round(t*rate,3), N=len(
+                time_series), overlapping=overlapping, modified=modified)
+        except NotImplementedError:
+            # Case not covered by allantools (e.g. white PM with very few samples): white FM
+            edf = allantools.edf_greenhall(alpha=0, d=d, m=np.round(t*rate,3), N=len(
+                time_series), overlapping=overlapping, modified=modified)
         edfs.append(edf)
         # with the known EDF we get CIs
         (lo, hi) = allantools.confidence_interval(dev=dev,  edf=edf)
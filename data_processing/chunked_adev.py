@@ -0,0 +1,150 @@
+import os
+import tempfile
+import numpy as np
+
+from data_processing.allan_deviation import get_errorbars, noise_id
+from instrumentation.tracer import tracer
+
+def tau_factors(n, mode="decade"):
+    # Averaging factors m of a phase series of n samples, as generated by allantools (tau_generator)
+    if mode == "all":
+        return np.arange(1, n, dtype=np.int64)
+    if mode == "octave":
+        factors = 2.0**np.arange(int(np.floor(np.log2(n))) + 1)
+    elif mode == "decade":
+        factors = np.outer(10.0**np.arange(int(np.floor(np.log10(n))) + 1), [1, 2, 4]).ravel()
+    else:
+        raise ValueError("Unsupported tau mode '{}'.".format(mode))
+    m = np.unique(np.round(factors)).astype(np.int64)
+    return m[(m > 0) & (m < n)]
+
+class ChunkedOADEV:
+    """
+    Overlapping Allan deviation of a frequency series fed in chunks (e.g. a region larger than
+    the memory), with the same results as get_stab within float tolerance.
+
+    The frequency is integrated into phase as the chunks arrive. The sums of squared second
+    differences of the small averaging factors (2m <= carry) are accumulated on the fly, the
+    last `carry` phase samples being carried over to the next chunk. The phase is also spilled
+    to a temporary file, memory mapped at the end to compute the large averaging factors by blocks.
+
+    mode: taus ('decade', 'octave', 'all')
+    spill_dir: directory of the temporary phase file (default: system temporary directory)
+    block_size: maximum number of samples of the temporary arrays
+    """
+    def __init__(self, mode="decade", carry=2**16, spill_dir=None, block_size=2**22):
+        self.mode = mode
+        self.carry = carry
+        self.block_size = block_size
+
+        # Factors accumulated on the fly (the series length is not known in advance)
+        self.small = tau_factors(2*carry + 1, mode)
+        self.small = self.small[2*self.small <= carry]
+        self.sum_sq = np.zeros(len(self.small))
+        self.done = np.zeros(len(self.small), dtype=np.int64) # Global index of the next term of each factor
+
+        self.n = 0 # Number of frequency samples
+        self.offset = None # Removed from the frequency (any constant cancels in the second differences)
+        self.t_first = self.t_last = None
+        self.tail = np.zeros(1) # Last phase samples, starting at global index tail_start
+        self.tail_start = 0
+
+        self.spill = tempfile.NamedTemporaryFile(dir=spill_dir, suffix=".phase", delete=False)
+        self.spill.write(self.tail.tobytes())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if not self.spill.closed:
+            self.spill.close()
+        if os.path.exists(self.spill.name):
+            os.remove(self.spill.name)
+
+    @tracer.timed("processing.chunked_oadev.add")
+    def add(self, time, values):
+        # Next samples of the series (time in s, in increasing order, after the previous chunks)
+        time, values = np.asarray(time, dtype=np.float64), np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        time, values = time[valid], values[valid]
+        if len(values) == 0:
+            return
+
+        if self.offset is None:
+            self.offset = values.mean()
+            self.t_first = time[0]
+        self.t_last = time[-1]
+        self.n += len(values)
+
+        phase = np.cumsum(values - self.offset)
+        phase += self.tail[-1]
+        self.spill.write(phase.tobytes())
+
+        # Terms of the small factors that the new samples complete
+        phase = np.concatenate([self.tail, phase])
+        for j, m in enumerate(self.small):
+            a = self.done[j] - self.tail_start
+            b = len(phase) - 2*m
+            if b <= a:
+                continue
+            d = phase[a+2*m:b+2*m] - 2*phase[a+m:b+m]
+            d += phase[a:b]
+            self.sum_sq[j] += np.dot(d, d)
+            self.done[j] = self.tail_start + b
+
+        # Carry over the last samples
+        keep = min(len(phase), self.carry)
+        self.tail_start += len(phase) - keep
+        self.tail = phase[-keep:].copy()
+
+    @tracer.timed("processing.chunked_oadev.result")
+    def result(self):
+        """
+        Taus, deviations and error bars (as get_stab), or None if there are less than 3 samples.
+        """
+        if self.n < 3:
+            return None
+        self.spill.flush()
+        rate = (self.n - 1)/(self.t_last - self.t_first)
+
+        ms = tau_factors(self.n + 1, self.mode)
+        ns = self.n + 1 - 2*ms
+        keep = ns > 1
+        ms, ns = ms[keep], ns[keep]
+
+        devs = np.zeros(len(ms))
+        small = dict(zip(self.small, self.sum_sq))
+        phase = np.memmap(self.spill.name, dtype=np.float64, mode="r", shape=(self.n + 1,))
+        for j, m in enumerate(ms):
+            if m in small:
+                sum_sq = small[m]
+            else:
+                # Large factor, by blocks from the spilled phase
+                sum_sq = 0.0
+                for a in range(0, ns[j], self.block_size):
+                    b = min(a + self.block_size, ns[j])
+                    d = phase[a+2*m:b+2*m] - 2*phase[a+m:b+m]
+                    d += phase[a:b]
+                    sum_sq += np.dot(d, d)
+            devs[j] = np.sqrt(sum_sq/(2.0*ns[j]))/m
+
+        # Noise type of the error bars, from the block boundaries of the spilled phase
+        alpha = noise_id(phase, ms)
+        del phase
+
+        taus = ms/rate
+        err_lo, err_hi = get_errorbars(range(self.n), taus, devs, rate=rate, alpha=alpha, d=2, dev_type="allan")
+        return taus, devs, [np.array(err_lo), np.array(err_hi)]
+
+def chunked_stab(chunks, mode="decade", scale=1.0, spill_dir=None):
+    """
+    Allan deviation of a series given as chunks (time in s, values), see ChunkedOADEV.
+    scale: factor applied to the values (e.g. coupling coefficient over fractional factor)
+    """
+    with ChunkedOADEV(mode, spill_dir=spill_dir) as adev:
+        for time, values in chunks:
+            adev.add(time, np.asarray(values, dtype=np.float64)*scale)
+        return adev.result()
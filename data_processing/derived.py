@@ -0,0 +1,98 @@
+import ast
+import re
+import numpy as np
+
+# Functions usable in the expressions (the same names in numexpr)
+FUNCTIONS = {
+    "sqrt": np.sqrt, "exp": np.exp, "log": np.log, "log10": np.log10, "abs": np.abs,
+    "sin": np.sin, "cos": np.cos, "tan": np.tan, "arctan2": np.arctan2,
+    }
+_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd)
+_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Constant, ast.Load) + _OPERATORS
+
+_numexpr = None # Module, False if not installed (imported on first use)
+
+# Samples evaluated at once with NumPy (the size of its temporary arrays)
+BLOCK = 2**16
+
+def numexpr_module():
+    global _numexpr
+    if _numexpr is None:
+        try:
+            import numexpr
+            _numexpr = numexpr
+        except ImportError:
+            _numexpr = False
+    return _numexpr or None
+
+class Expression:
+    """
+    Arithmetic expression over measurements, e.g. "beat - 2*ref", with the names that are not
+    identifiers between backquotes (e.g. "`env:T_cell` - `env:T_room`"). Only numbers, measurement
+    names, the arithmetic operators and FUNCTIONS are allowed.
+
+    Evaluated with numexpr if it is installed (compiled), otherwise with NumPy. Both evaluate by
+    blocks, so there are no temporary arrays of the whole length.
+    """
+    def __init__(self, text):
+        self.text = str(text)
+
+        # Backquoted names replaced by identifiers
+        quoted = {}
+        def quote(match):
+            return quoted.setdefault(match.group(1), "_q{}".format(len(quoted)))
+        source = re.sub(r"`([^`]*)`", quote, self.text)
+        names = {identifier: name for name, identifier in quoted.items()}
+
+        try:
+            tree = ast.parse(source.strip(), mode="eval")
+        except SyntaxError as e:
+            raise ValueError("Invalid expression '{}' ({}).".format(self.text, e.msg))
+
+        # Measurements renamed x0, x1, ... (in order of appearance)
+        self.inputs = []
+        for node in ast.walk(tree):
+            if not isinstance(node, _NODES):
+                raise ValueError("'{}' is not allowed in an expression ({}).".format(type(node).__name__, self.text))
+            if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS):
+                raise ValueError("Unknown function in '{}' (available: {}).".format(self.text, ", ".join(FUNCTIONS)))
+            if isinstance(node, ast.Call) and node.keywords:
+                raise ValueError("Keyword arguments are not allowed in an expression ({}).".format(self.text))
+            if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+                raise ValueError("Only numbers are allowed as constants ({}).".format(self.text))
+
+        functions = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+        variables = [node for node in ast.walk(tree) if isinstance(node, ast.Name) and not id(node) in functions]
+        for node in sorted(variables, key=lambda node: (node.lineno, node.col_offset)):
+            name = names.get(node.id, node.id)
+            if not name in self.inputs:
+                self.inputs.append(name)
+            node.id = "x{}".format(self.inputs.index(name))
+        if not self.inputs:
+            raise ValueError("The expression '{}' doesn't use any measurement.".format(self.text))
+
+        self.source = ast.unparse(tree)
+        self.code = compile(tree, "<expression>", "eval")
+
+    def __eq__(self, other):
+        return isinstance(other, Expression) and self.source == other.source and self.inputs == other.inputs
+
+    def evaluate(self, arrays, out=None):
+        """
+        Values of the expression from the arrays of its inputs (sequence, in the order of inputs).
+        out: float64 array the result is written to
+        """
+        variables = {"x{}".format(i): array for i, array in enumerate(arrays)}
+        numexpr = numexpr_module()
+        if numexpr is not None:
+            return numexpr.evaluate(self.source, local_dict=variables, global_dict={}, out=out, casting="unsafe")
+
+        n = max((len(array) for array in variables.values() if np.ndim(array)), default=0)
+        if out is None:
+            out = np.empty(n)
+        namespace = {"__builtins__": {}, **FUNCTIONS}
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for a in range(0, n, BLOCK):
+                block = {name: array[a:a+BLOCK] if np.ndim(array) else array for name, array in variables.items()}
+                out[a:a+BLOCK] = eval(self.code, namespace, block)
+        return out
@@ -0,0 +1,118 @@
+import threading
+import numpy as np
+
+# Backend of the numerical kernels: "auto" (numba if installed, else NumPy), "numba" or "numpy"
+BACKENDS = ("auto", "numba", "numpy")
+
+_setting = "auto"
+_kernels = None # Compiled kernels, False for NumPy (selected on first use, numba is slow to import)
+_lock = threading.Lock()
+
+def set_backend(name="auto"):
+    global _setting, _kernels
+    if not name in BACKENDS:
+        raise ValueError("Unknown kernel backend '{}' ({}).".format(name, ", ".join(BACKENDS)))
+    with _lock:
+        _setting, _kernels = name, None
+
+def compiled():
+    """
+    Compiled kernels, or None to use the NumPy implementations. The kernels are single loops
+    without temporary arrays, and release the GIL (they can run in threads, one per measurement).
+    """
+    global _kernels
+    with _lock:
+        if _kernels is None:
+            _kernels = False
+            if _setting != "numpy":
+                try:
+                    _kernels = _compile()
+                except ImportError:
+                    if _setting == "numba":
+                        raise ImportError("The numba kernel backend needs the numba package.")
+    return _kernels or None
+
+def backend():
+    return "numba" if compiled() is not None else "numpy"
+
+def _compile():
+    import numba
+    from types import SimpleNamespace
+    jit = numba.njit(nogil=True, cache=True)
+
+    @jit
+    def oadev_sum_sq(phase, ms, out):
+        # Sums of the squared second differences of the phase, for each averaging factor
+        n = len(phase)
+        for j in range(len(ms)):
+            m = ms[j]
+            total = 0.0
+            for i in range(n - 2*m):
+                d = phase[i+2*m] - 2*phase[i+m] + phase[i]
+                total += d*d
+            out[j] = total
+
+    @jit
+    def moving_average(values, lo, hi, out):
+        # Mean of the valid samples [lo, hi) of each sample, per row, with running sums
+        for row in range(values.shape[0]):
+            # Remove the mean first, to keep the precision of the running sums on large offsets
+            offset, count = 0.0, 0
+            for i in range(values.shape[1]):
+                if not np.isnan(values[row, i]):
+                    offset += values[row, i]
+                    count += 1
+            offset /= max(count, 1)
+
+            total, count, a, b = 0.0, 0, 0, 0
+            for i in range(values.shape[1]):
+                while b < hi[i]:
+                    if not np.isnan(values[row, b]):
+                        total += values[row, b] - offset
+                        count += 1
+                    b += 1
+                while a < lo[i]:
+                    if not np.isnan(values[row, a]):
+                        total -= values[row, a] - offset
+                        count -= 1
+                    a += 1
+                out[row, i] = total/count + offset if count > 0 else np.nan
+
+    @jit
+    def bin_means(time, values, k0, interval, out, counts):
+        # Mean of the valid samples of each bin [k*interval, (k+1)*interval) (k from k0), missing bins forward-filled
+        for i in range(len(time)):
+            if not np.isnan(values[i]):
+                k = int(np.floor(time[i]/interval)) - k0
+                out[k] += values[i]
+                counts[k] += 1
+        last = np.nan
+        for k in range(len(out)):
+            if counts[k] > 0:
+                last = out[k]/counts[k]
+            out[k] = last
+
+    return SimpleNamespace(oadev_sum_sq=oadev_sum_sq, moving_average=moving_average, bin_means=bin_means)
+
+def oadev(phase, rate, mode="decade"):
+    """
+    Taus and overlapping Allan deviations of a frequency series (as allantools.oadev), with the
+    compiled kernels, from its phase (see allan_deviation.to_phase).
+    """
+    from data_processing.chunked_adev import tau_factors
+    n = len(phase) - 1
+    ms = tau_factors(n + 1, mode)
+    ms = ms[n + 1 - 2*ms > 1]
+    sum_sq = np.zeros(len(ms))
+    compiled().oadev_sum_sq(phase, ms, sum_sq)
+    return ms/rate, np.sqrt(sum_sq/(2.0*(n + 1 - 2*ms)))/ms
+
+def resample(time, values, interval=1.0):
+    # Time bins of interval seconds (aligned on multiples of it) and mean of the values in each, forward-filled
+    time = np.asarray(time, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    k0 = int(np.floor(time.min()/interval))
+    n_bins = int(np.floor(time.max()/interval)) - k0 + 1
+    out = np.zeros(n_bins)
+    compiled().bin_means(time, values, k0, interval, out, np.zeros(n_bins, dtype=np.int64))
+    return (k0 + np.arange(n_bins))*interval, out
@@ -1,13 +1,74 @@
 import numpy as np
-import bottleneck as bn
 
-def moving_average(arr,window):
-    window = np.round(window).astype(int)
-    half_window = np.ceil(window/2).astype(int)
+from data_processing import kernels
+from instrumentation.tracer import tracer
 
+@tracer.timed("processing.moving_average")
+def moving_average(arr, window, time=None, out=None):
+    """
+    Centered moving average, computed in a single pass from cumulative sums. NaN values are ignored.
+
+    arr: values, 1-D array or 2-D array (measurements x samples) sharing the same time axis
+    window: window size, in samples, or in seconds if time is given
+    time: sorted timestamps in seconds (for non-uniform sampling and gaps)
+    out: preallocated output array with the shape of arr
+    """
     if not isinstance(arr, np.ndarray):
         arr = arr.to_numpy()
 
-    arr_moving_avg = bn.move_mean(arr, window=half_window, min_count=1)
-    arr_moving_avg = np.flip(bn.move_mean(np.flip(arr_moving_avg) , window=half_window, min_count=1))
-    return arr_moving_avg
\ No newline at end of file
+    n = arr.shape[-1]
+    if out is None:
+        out = np.empty(arr.shape, dtype=np.float64)
+    if n == 0:
+        return out
+
+    # Limits [lo, hi) of the window centered on each sample
+    if time is None:
+        window = max(int(np.round(window)), 1)
+        lo = np.arange(-((window-1)//2), n - (window-1)//2)
+        hi = np.arange(window//2 + 1, n + window//2 + 1)
+        np.maximum(lo, 0, out=lo)
+        np.minimum(hi, n, out=hi)
+    else:
+        lo = np.searchsorted(time, time - window/2, side="left")
+        hi = np.searchsorted(time, time + window/2, side="right")
+
+    compiled = kernels.compiled()
+    if compiled is not None and out.flags.c_contiguous:
+        compiled.moving_average(arr.reshape(-1, n), lo, hi, out.reshape(-1, n))
+        return out
+
+    # Cumulative sums (with a leading zero) of the values and of the number of valid samples,
+    # computed in place in two buffers
+    shape = arr.shape[:-1] + (n+1,)
+    sum_cs = np.zeros(shape)
+    count_cs = np.zeros(shape)
+    values = sum_cs[..., 1:]
+    invalid = np.isnan(arr)
+    values[...] = arr
+    values[invalid] = 0
+    # Remove the mean first, to keep the precision of the cumulative sum on large offsets
+    count = n - invalid.sum(axis=-1, keepdims=True)
+    offset = values.sum(axis=-1, keepdims=True)/np.maximum(count, 1)
+    values -= offset
+    values[invalid] = 0
+    np.cumsum(values, axis=-1, out=values)
+    np.logical_not(invalid, out=invalid)
+    np.cumsum(invalid, axis=-1, out=count_cs[..., 1:])
+
+    # Differences at the window limits, gathered into two scratch buffers (the one of the counts
+    # first, so that the buffer of their cumulative sum is reused)
+    counts = np.empty(arr.shape)
+    scratch = np.empty(arr.shape)
+    np.take(count_cs, hi, axis=-1, out=counts, mode="clip")
+    np.take(count_cs, lo, axis=-1, out=scratch, mode="clip")
+    counts -= scratch
+    sums = count_cs[..., :n]
+    np.take(sum_cs, hi, axis=-1, out=sums, mode="clip")
+    np.take(sum_cs, lo, axis=-1, out=scratch, mode="clip")
+    sums -= scratch
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        np.divide(sums, counts, out=out)
+    out += offset
+    return out
@@ -0,0 +1,156 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from data_processing import kernels
+from data_processing.allan_deviation import get_stab, get_errorbars, oadev_batch, noise_id, to_phase
+from data_processing.aligned_store import regression_slopes, masked_mean
+from data_processing.adev_index import AdevIndex
+
+# Extra curves of the budget mode
+BUDGET_QUADRATURE = "Budget: quadrature sum"
+BUDGET_RESIDUAL = "Budget: residual"
+
+def table_scale(table_df, measurement_list):
+    # Coupling coefficient over fractional factor of each measurement
+    table = table_df.set_index("Name").loc[measurement_list]
+    return table["Coeff_"].astype(float).to_numpy()/table["Fractional_"].astype(float).to_numpy()
+
+def store_region(store, start, stop, measurement_list):
+    # Use all the data of the measurements the region doesn't contain any of (the others keep the region)
+    time, values, mask = store.region(start, stop, measurement_list)
+    empty = ~mask.any(axis=1)
+    if empty.any():
+        time, values, mask = store.region(-np.inf, np.inf, measurement_list)
+        mask = mask & (empty[:, None] | ((time >= start) & (time <= stop)))
+    return time, values, mask
+
+def _get_stab(args):
+    return get_stab(*args)
+
+def iter_adev(store, table_df, measurement_list, start, stop, mode, workers=1, index=None):
+    """
+    Allan deviation of each measurement within [start, stop] (timestamps in s), with the table
+    coefficients applied. Yields (measurement, (taus, devs, error_bars)) in the order of measurement_list.
+    workers: number of processes, or threads with the compiled kernels (1 computes in the current thread)
+    index: AdevIndex of the store, used for its modes (lookups instead of a pass over the region)
+    """
+    measurement_list = [measurement for measurement in measurement_list if measurement in store.rows]
+    if not measurement_list:
+        return
+
+    if index is not None and mode in AdevIndex.MODES:
+        yield from iter_indexed_adev(index, table_df, measurement_list, start, stop, mode)
+        return
+
+    time, values, mask = store_region(store, start, stop, measurement_list)
+    values = values*table_scale(table_df, measurement_list)[:, None]
+
+    series = [(time[mask[i]], values[i][mask[i]], mode) for i in range(len(measurement_list))]
+
+    if workers > 1:
+        # The compiled kernels release the GIL, threads avoid copying the series to other processes
+        pool = ThreadPoolExecutor if kernels.compiled() is not None else ProcessPoolExecutor
+        with pool(max_workers=workers) as executor:
+            yield from zip(measurement_list, executor.map(_get_stab, series))
+    else:
+        yield from zip(measurement_list, map(_get_stab, series))
+
+def iter_indexed_adev(index, table_df, measurement_list, start, stop, mode):
+    tables = [index.table(measurement, mode) for measurement in measurement_list]
+    ranges = [table.count(start, stop) for table in tables]
+
+    # Use all the data of the measurements the region doesn't contain any of
+    ranges = [(p, q) if q > p else (0, len(table.time)) for table, (p, q) in zip(tables, ranges)]
+
+    for measurement, table, (p, q), scale in zip(measurement_list, tables, ranges, table_scale(table_df, measurement_list)):
+        result = table.stab(p, q, scale)
+        if result is not None:
+            yield measurement, result
+
+def decimation_factor(n, mode, max_samples):
+    # Smallest block size leaving at most max_samples blocks, on the taus of the mode
+    ratio = n/max_samples
+    if ratio <= 1:
+        return 1
+    # Powers of 10 (decade) or 2 (octave), so that the taus are among the ones of the full resolution
+    if mode == "decade":
+        return 10**int(np.ceil(np.log10(ratio)))
+    if mode == "octave":
+        return 2**int(np.ceil(np.log2(ratio)))
+    return int(np.ceil(ratio))
+
+def iter_coarse_adev(store, table_df, measurement_list, start, stop, mode, max_samples=2**14):
+    """
+    Quick estimate of the Allan deviation of each measurement within [start, stop] (s), from block
+    averages of at most max_samples blocks: only the taus longer than a block, with wider error bars
+    (and about 10 taus per decade in the "all" mode). Yields (measurement, (taus, devs, error_bars))
+    as iter_adev.
+    """
+    measurement_list = [measurement for measurement in measurement_list if measurement in store.rows]
+    if not measurement_list:
+        return
+
+    time, values, mask = store_region(store, start, stop, measurement_list)
+    scales = table_scale(table_df, measurement_list)
+    for i, measurement in enumerate(measurement_list):
+        series_time, series_values = time[mask[i]], values[i][mask[i]]*scales[i]
+        k = decimation_factor(len(series_values), mode, max_samples)
+        n = len(series_values)//k*k
+        if n//k < 3:
+            continue
+        yield measurement, get_stab(series_time[:n:k], series_values[:n].reshape(-1, k).mean(axis=1), "log10" if mode == "all" else mode)
+
+def compute_adev(store, table_df, measurement_list, start, stop, mode, workers=1, index=None):
+    return dict(iter_adev(store, table_df, measurement_list, start, stop, mode, workers, index))
+
+def compute_budget(store, table_df, main_measurement, contributions, start, stop, mode):
+    """
+    Stability budget of the main measurement: ADev of each contribution (coupled with the table
+    coefficients), of the main measurement, of their quadrature sum and of the residual of the main
+    measurement once all the contributions are removed. Only the samples where all of them are
+    valid are used. Returns a dictionary {title: (taus, devs, error_bars)}, or None.
+    """
+    contributions = [name for name in contributions if name in store.rows and name != main_measurement]
+    if not main_measurement in store.rows:
+        print("Budget: no data for the main measurement '{}'.".format(main_measurement))
+        return None
+    measurement_list = contributions + [main_measurement]
+
+    # Samples where all the measurements are valid
+    time, values, mask = store_region(store, start, stop, measurement_list)
+    common = mask.all(axis=0)
+    if common.sum() < 3:
+        print("Budget: not enough common samples.")
+        return None
+    values = values[:, common]*table_scale(table_df, measurement_list)[:, None]
+    rate = 1/np.mean(np.diff(time[common]))
+
+    # Residual of the main measurement, once all the coupled contributions are removed
+    residual = values[-1] - values[:-1].sum(axis=0)
+
+    # All the deviations in one batched call
+    taus, devs, _ = oadev_batch(np.vstack([values, residual]), rate, mode)
+    quadrature = np.sqrt(np.sum(devs[:len(contributions)]**2, axis=0))
+
+    titles = measurement_list + [BUDGET_RESIDUAL, BUDGET_QUADRATURE]
+    all_devs = list(devs) + [quadrature]
+
+    # Noise type of each series (the quadrature sum is compared with the main measurement, it takes its noise type)
+    ms = np.round(taus*rate).astype(np.int64)
+    alphas = [noise_id(to_phase(series), ms) for series in list(values) + [residual]]
+    alphas.append(alphas[len(contributions)])
+
+    results = {}
+    for title, title_devs, alpha in zip(titles, all_devs, alphas):
+        error_bars = [np.array(err) for err in get_errorbars(residual, taus, title_devs, rate=rate, alpha=alpha, d=2, dev_type="allan")]
+        results[title] = (taus, title_devs, error_bars)
+    return results
+
+def coupling_coefficient(store, measurement, main_measurement, start, stop):
+    # Using linear regression to find correlation (samples aligned in time)
+    _, values, mask = store_region(store, start, stop, [measurement, main_measurement])
+    return regression_slopes(values[:1], values[1], mask[:1], mask[1])[0]
+
+def fractional_factor(store, measurement, start, stop):
+    _, values, mask = store_region(store, start, stop, [measurement])
+    return masked_mean(values, mask)[0]
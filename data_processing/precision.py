@@ -0,0 +1,54 @@
+import numpy as np
+
+class Precision:
+    """
+    Storage precision of the values of a measurement.
+
+    dtype: "float64", "float32", "int16" or "int32". Integers are scaled (value = offset + scale*integer)
+    and NaN is stored as the smallest integer. With a scale equal to the resolution of the data
+    (e.g. the LSB of an ADC), the values are stored exactly.
+    """
+    def __init__(self, dtype="float64", scale=1.0, offset=0.0):
+        self.dtype = np.dtype(dtype)
+        self.scale = float(scale)
+        self.offset = float(offset)
+        self.scaled = self.dtype.kind == "i"
+        if not (self.scaled or self.dtype.kind == "f"):
+            raise ValueError("Unsupported storage precision '{}'.".format(dtype))
+
+    @classmethod
+    def from_setting(cls, setting):
+        # "float32", or {"dtype": "int16", "scale": 0.001, "offset": 0}
+        if isinstance(setting, Precision):
+            return setting
+        if isinstance(setting, str):
+            return cls(setting)
+        return cls(**setting)
+
+    def encode(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if not self.scaled:
+            return values.astype(self.dtype, copy=False)
+
+        info = np.iinfo(self.dtype)
+        data = np.rint((values - self.offset)/self.scale)
+        nan = np.isnan(data)
+        if np.any((data[~nan] <= info.min) | (data[~nan] > info.max)):
+            print("Values out of the {} storage range (scale {}, offset {}), clipped.".format(self.dtype, self.scale, self.offset))
+            np.clip(data, info.min + 1, info.max, out=data)
+        data[nan] = info.min
+        return data.astype(self.dtype)
+
+    def decode(self, data):
+        # Floating point values (float64 for the scaled integers)
+        if not self.scaled:
+            return data
+        values = self.offset + self.scale*data
+        values[data == np.iinfo(self.dtype).min] = np.nan
+        return values
+
+    def quantize(self, values):
+        # Values as they are stored (float64)
+        return np.asarray(self.decode(self.encode(values)), dtype=np.float64)
+
+FLOAT64 = Precision()
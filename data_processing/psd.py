@@ -0,0 +1,77 @@
+import os
+from collections import OrderedDict
+import numpy as np
+
+from instrumentation.tracer import tracer
+
+@tracer.timed("processing.welch_psd")
+def welch_psd(values, rate, segment_length=2**14, workers=None, block_size=2**22):
+    """
+    One-sided power spectral density of a series by Welch's method (Hann window, 50% overlap,
+    mean of each segment removed), as scipy.signal.welch. The segments are transformed by blocks of
+    at most block_size samples, each block with a multi-threaded FFT, so the memory used doesn't
+    depend on the length of the series.
+
+    rate: sampling rate in Hz
+    segment_length: number of samples per segment (within [2, length of the series])
+    workers: number of FFT threads (default: number of CPUs)
+    Returns the frequencies (Hz) and the PSD (units²/Hz), or None if there are less than 2 samples.
+    """
+    import scipy.fft # Slow to import, loaded on first use
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n < 2:
+        return None
+    length = max(min(int(segment_length), n), 2)
+    window = 0.5 - 0.5*np.cos(2*np.pi*np.arange(length)/length) # Periodic Hann window
+
+    # Overlapping segments as views of the series
+    segments = np.lib.stride_tricks.sliding_window_view(values, length)[::length - length//2]
+    per_block = max(block_size//length, 1)
+    total = np.zeros(length//2 + 1)
+    for a in range(0, len(segments), per_block):
+        block = segments[a:a+per_block] - segments[a:a+per_block].mean(axis=1, keepdims=True)
+        block *= window
+        spectrum = scipy.fft.rfft(block, axis=1, workers=workers or os.cpu_count())
+        total += (spectrum.real**2 + spectrum.imag**2).sum(axis=0)
+
+    psd = total/(len(segments)*rate*np.dot(window, window))
+    # One-sided: the power of the negative frequencies is added (not for the DC and Nyquist bins)
+    psd[1:length - length//2] *= 2
+    return np.fft.rfftfreq(length, 1/rate), psd
+
+def log_average(freqs, psd, points_per_decade=20):
+    """
+    PSD averaged over logarithmic frequency bins (points_per_decade bins per decade, the frequency
+    of each bin being the geometric mean of its frequencies). The zero frequency is dropped.
+    """
+    keep = freqs > 0
+    log_freqs, psd = np.log10(freqs[keep]), psd[keep]
+    _, bins, counts = np.unique(np.floor(log_freqs*points_per_decade), return_inverse=True, return_counts=True)
+    return 10**(np.bincount(bins, weights=log_freqs)/counts), np.bincount(bins, weights=psd)/counts
+
+class PsdCache:
+    """
+    Spectra of the measurements of an AlignedStore, per (measurement, region, segment length), the
+    least recently used ones being dropped beyond max_entries. The entries are tied to the version
+    of the measurement, so a spectrum is not reused once its data has changed (e.g. after a fetch).
+    """
+    def __init__(self, store, max_entries=64):
+        self.store = store
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # (measurement, version, start, stop, segment_length) -> (freqs, psd)
+
+    def key(self, measurement, start, stop, segment_length):
+        return (measurement, self.store.versions.get(measurement), start, stop, segment_length)
+
+    def get(self, key):
+        result = self.entries.get(key)
+        if result is not None:
+            self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
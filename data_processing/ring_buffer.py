@@ -0,0 +1,89 @@
+import numpy as np
+
+class RingBuffer:
+    """
+    Fixed-capacity buffer of (time, value) samples with in-place writes.
+
+    Every sample is stored twice (at i and i+capacity), so the most recent
+    `capacity` samples are always one contiguous slice of the storage and can be
+    handed to the plots as views, without copying.
+    """
+    def __init__(self, capacity, dtype=np.float64):
+        self.capacity = int(capacity)
+        self._x = np.empty(2*self.capacity, dtype=np.float64)
+        self._y = np.empty(2*self.capacity, dtype=dtype)
+        self._head = 0 # Next write position, in [0, capacity)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        return self._x.nbytes + self._y.nbytes
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
+
+    def _start(self):
+        start = self._head - self._size
+        return start if start >= 0 else start + self.capacity
+
+    def view(self):
+        # Contiguous views of the buffered samples (oldest first)
+        start = self._start()
+        stop = start + self._size
+        return self._x[start:stop], self._y[start:stop]
+
+    def truncate(self, size):
+        # Drop the newest samples, keeping the first `size` ones
+        size = max(0, min(int(size), self._size))
+        self._head = (self._head - (self._size - size)) % self.capacity
+        self._size = size
+
+    def extend(self, x, y):
+        n = len(x)
+        if n == 0:
+            return
+
+        # Only the last `capacity` samples can be kept
+        if n >= self.capacity:
+            x = x[-self.capacity:]
+            y = y[-self.capacity:]
+            self._x[:self.capacity] = x
+            self._x[self.capacity:] = x
+            self._y[:self.capacity] = y
+            self._y[self.capacity:] = y
+            self._head = 0
+            self._size = self.capacity
+            return
+
+        # Write in (at most) two pieces, each one mirrored
+        k1 = min(n, self.capacity - self._head)
+        for buf, data in ((self._x, x), (self._y, y)):
+            buf[self._head:self._head+k1] = data[:k1]
+            buf[self._head+self.capacity:self._head+self.capacity+k1] = data[:k1]
+            buf[:n-k1] = data[k1:]
+            buf[self.capacity:self.capacity+n-k1] = data[k1:]
+
+        self._head = (self._head + n) % self.capacity
+        self._size = min(self._size + n, self.capacity)
+
+    def write(self, x, y):
+        """
+        Write a sorted series into the buffer.
+
+        Samples already buffered from x[0] onwards are overwritten in place and the
+        rest is appended. A series starting before the buffered data replaces it.
+        """
+        if len(x) == 0:
+            return
+
+        buffered_x, _ = self.view()
+        pos = np.searchsorted(buffered_x, x[0])
+        if pos == 0:
+            self.clear()
+        else:
+            self.truncate(pos)
+        self.extend(x, y)
@@ -0,0 +1,234 @@
+import bisect
+import itertools
+import re
+import numpy as np
+import pandas as pd
+
+from data_processing.utils import to_nanoseconds
+from data_processing.precision import Precision, FLOAT64
+
+# Versions of the measurements, unique across stores and resets
+_versions = itertools.count(1)
+
+def natural_key(name):
+    # Sorting key of a measurement name, with the numbers compared by value ("m2" before "m10")
+    return tuple(int(part) if part.isdigit() else part.lower() for part in re.split("([0-9]+)", name))
+
+class Chunk:
+    """
+    Sorted block of samples of a measurement, in compact form.
+
+    The time is stored as the first timestamp (ns) plus integer deltas, in units of their greatest
+    common divisor and in the smallest unsigned type that fits. The values are stored encoded
+    (see Precision).
+    """
+    def __init__(self, time, data):
+        self.t0 = int(time[0])
+        deltas = time - self.t0
+        self.unit = int(np.gcd.reduce(deltas)) or 1
+        deltas //= self.unit
+        for dtype in [np.uint16, np.uint32, np.uint64]:
+            if deltas[-1] <= np.iinfo(dtype).max:
+                break
+        self.deltas = deltas.astype(dtype)
+        self.data = data
+
+    def __len__(self):
+        return len(self.deltas)
+
+    @property
+    def nbytes(self):
+        return self.deltas.nbytes + self.data.nbytes
+
+    @property
+    def first(self):
+        return self.t0 + int(self.deltas[0])*self.unit
+
+    @property
+    def last(self):
+        return self.t0 + int(self.deltas[-1])*self.unit
+
+    def time(self):
+        return self.t0 + self.deltas.astype(np.int64)*self.unit
+
+    def search(self, t, side="left"):
+        # Index of a timestamp (ns), as np.searchsorted
+        t = int(t) - self.t0
+        k = -(-t//self.unit) if side == "left" else t//self.unit
+        if k < 0:
+            return 0
+        if k > self.deltas[-1]:
+            return len(self.deltas)
+        return int(np.searchsorted(self.deltas, k, side=side))
+
+    def slice(self, a, b):
+        # Part of the chunk (views)
+        chunk = Chunk.__new__(Chunk)
+        chunk.t0, chunk.unit = self.t0, self.unit
+        chunk.deltas, chunk.data = self.deltas[a:b], self.data[a:b]
+        return chunk
+
+    def owned(self):
+        # Chunk not sharing its storage (e.g. a slice copied, so the rest of the original can be freed)
+        if self.deltas.base is None and self.data.base is None:
+            return self
+        chunk = Chunk.__new__(Chunk)
+        chunk.t0, chunk.unit = self.t0, self.unit
+        chunk.deltas, chunk.data = self.deltas.copy(), self.data.copy()
+        return chunk
+
+class SortedStore:
+    """
+    Time series of several measurements, each one kept sorted by time.
+
+    A measurement is stored as a list of sorted, non-overlapping chunks (see Chunk).
+    A new block is inserted between the chunks and replaces the samples already stored in its
+    time range, so adding data only costs O(new samples), whatever the amount already stored.
+    The chunks are concatenated once, when the series is read.
+    The measurement names are kept in natural order.
+
+    precision: storage precision per measurement {name: setting}, with an optional "default"
+    (see Precision.from_setting)
+    """
+    def __init__(self, precision=None):
+        self.precision = {name: Precision.from_setting(setting) for name, setting in (precision or {}).items()}
+        self.names = [] # Measurements, in natural order
+        self._keys = [] # Natural sorting keys of the names
+        self._chunks = {} # Measurement -> [Chunk, ...]
+        self._starts = {} # Measurement -> first time of each chunk
+        self._stops = {} # Measurement -> last time of each chunk
+        self.versions = {} # Measurement -> version, changed each time its data changes
+
+    def __len__(self):
+        return sum(len(chunk) for chunks in self._chunks.values() for chunk in chunks)
+
+    def __contains__(self, measurement):
+        return measurement in self._chunks
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    @property
+    def nbytes(self):
+        return sum(chunk.nbytes for chunks in self._chunks.values() for chunk in chunks)
+
+    def clear(self):
+        self.__init__(self.precision)
+
+    def precision_of(self, measurement):
+        return self.precision.get(measurement, self.precision.get("default", FLOAT64))
+
+    def _add_name(self, measurement):
+        key = natural_key(measurement)
+        index = bisect.bisect(self._keys, key)
+        self._keys.insert(index, key)
+        self.names.insert(index, measurement)
+        self._chunks[measurement] = []
+        self._starts[measurement] = []
+        self._stops[measurement] = []
+
+    def insert(self, measurement, time, values, start=None, stop=None):
+        """
+        Add a block of samples of a measurement, replacing the samples stored within [start, stop].
+        time: timestamps (ns, int64)
+        start, stop: range replaced (ns), by default the range of the block
+        """
+        time = np.asarray(time, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(time) > 1 and np.any(np.diff(time) < 0):
+            order = np.argsort(time, kind="stable")
+            time, values = time[order], values[order]
+
+        if len(time) == 0 and (start is None or stop is None):
+            return
+        start = time[0] if start is None else start
+        stop = time[-1] if stop is None else stop
+
+        if not measurement in self._chunks:
+            self._add_name(measurement)
+        chunks, starts, stops = self._chunks[measurement], self._starts[measurement], self._stops[measurement]
+
+        # Chunks overlapping [start, stop]: only their parts outside the range are kept (as views)
+        i = bisect.bisect_left(stops, start)
+        j = bisect.bisect_right(starts, stop)
+        new_chunks = []
+        if i < j:
+            a = chunks[i].search(start, side="left")
+            if a > 0:
+                new_chunks.append(chunks[i].slice(0, a))
+        if len(time):
+            new_chunks.append(Chunk(time, self.precision_of(measurement).encode(values)))
+        if i < j:
+            b = chunks[j-1].search(stop, side="right")
+            if b < len(chunks[j-1]):
+                new_chunks.append(chunks[j-1].slice(b, len(chunks[j-1])))
+
+        chunks[i:j] = new_chunks
+        starts[i:j] = [chunk.first for chunk in new_chunks]
+        stops[i:j] = [chunk.last for chunk in new_chunks]
+        self.versions[measurement] = next(_versions)
+
+    def insert_df(self, df, start=None, stop=None):
+        # Add the samples of a long dataframe (columns: "_measurement", "_time", "value")
+        if df is None or df.empty:
+            return
+        for measurement, measurement_df in df.groupby("_measurement", sort=False):
+            self.insert(measurement, to_nanoseconds(measurement_df["_time"]), measurement_df["value"].to_numpy(), start, stop)
+
+    def remove(self, measurement, start, stop):
+        # Remove the samples of a measurement within [start, stop] (ns), releasing their memory
+        if measurement in self._chunks:
+            self.insert(measurement, [], [], start, stop)
+            self._chunks[measurement][:] = [chunk.owned() for chunk in self._chunks[measurement]]
+
+    def nbytes_within(self, measurement, start, stop):
+        # Bytes of the samples of a measurement within [start, stop] (ns)
+        chunks, starts, stops = self._chunks.get(measurement, []), self._starts.get(measurement, []), self._stops.get(measurement, [])
+        nbytes = 0
+        for chunk in chunks[bisect.bisect_left(stops, start):bisect.bisect_right(starts, stop)]:
+            n = chunk.search(stop, side="right") - chunk.search(start, side="left")
+            nbytes += n*(chunk.deltas.itemsize + chunk.data.itemsize)
+        return nbytes
+
+    def series(self, measurement):
+        """
+        Time (ns) and values of a measurement, as contiguous arrays.
+        The values are float32 for a float32 precision, float64 otherwise.
+        """
+        chunks = self._chunks.get(measurement)
+        if not chunks:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        if len(chunks) > 1:
+            # Merge the chunks, so the next reads don't have to
+            chunks[:] = [Chunk(np.concatenate([chunk.time() for chunk in chunks]), np.concatenate([chunk.data for chunk in chunks]))]
+            self._starts[measurement][:] = [chunks[0].first]
+            self._stops[measurement][:] = [chunks[0].last]
+        return chunks[0].time(), self.precision_of(measurement).decode(chunks[0].data)
+
+    def limits(self, measurement):
+        # First and last timestamps (ns) of a measurement, or None
+        starts, stops = self._starts.get(measurement), self._stops.get(measurement)
+        if not starts:
+            return None
+        return starts[0], stops[-1]
+
+    def frame(self, tz="Europe/Paris"):
+        # Long dataframe (columns: "_time", "_measurement", "value"), sorted by measurement then time
+        frames = []
+        for measurement in self.names:
+            time, values = self.series(measurement)
+            frames.append(pd.DataFrame({
+                "_time": pd.to_datetime(time, utc=True).tz_convert(tz),
+                "_measurement": measurement,
+                "value": values,
+                }))
+        if not frames:
+            return pd.DataFrame(columns=["_time", "_measurement", "value"])
+        return pd.concat(frames, ignore_index=True)
+
+    @classmethod
+    def from_frame(cls, df, precision=None):
+        store = cls(precision)
+        store.insert_df(df)
+        return store
@@ -1,5 +1,42 @@
+import numpy as np
 import pandas as pd
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from datemath import datemath
 
+from data_processing import kernels
+from instrumentation.tracer import tracer
+
+def string_to_date(date_str):
+    # From string to local timezone
+    dt = datetime.fromisoformat(date_str).replace(tzinfo=ZoneInfo("Europe/Paris"))
+    # From local datetime to UTC
+    dt = dt.astimezone(ZoneInfo("UTC"))
+    return dt
+
+def date_math(param):
+    # Natural language date (e.g. "now-1h") to string in local time
+    if any([val in param for val in ['y', 'Y', 'M', 'm', 'd', 'D', 'w', 'h', 'H', 's', 'S', 'now']]):
+        param = str(
+            datemath(param)
+                .astimezone(ZoneInfo("Europe/Paris")) # From UTC to Paris
+                .strftime("%Y-%m-%dT%H:%M:%S") # From datetime to string
+            )
+    return param
+
+@tracer.timed("processing.to_timestamp")
+def to_timestamp(dt):
+    # Vectorized conversion of datetimes to Unix timestamps (s)
+    dt = pd.to_datetime(dt, utc=True)
+    return np.asarray((dt - pd.Timestamp(0, tz="UTC"))/pd.Timedelta(seconds=1), dtype=np.float64)
+
+def to_nanoseconds(dt):
+    # Vectorized conversion of datetimes to Unix timestamps (ns, int64)
+    if isinstance(getattr(dt, "dtype", None), pd.DatetimeTZDtype) and dt.dtype.unit == "ns":
+        return pd.DatetimeIndex(dt).asi8 # Stored as UTC timestamps, whatever the time zone (no copy)
+    return pd.DatetimeIndex(pd.to_datetime(dt, utc=True)).as_unit("ns").asi8
+
+@tracer.timed("processing.resample_data")
 def resample_data(time, values, interval='1s'):
     """
     Resample data based on time and values arrays, applying a moving average.
@@ -12,6 +49,9 @@ def resample_data(time, values, interval='1s'):
     Returns:
         pd.DataFrame: Resampled data with columns ['time', 'values'].
     """
+    if kernels.compiled() is not None and len(time):
+        return kernels.resample(time, values, pd.Timedelta(interval).total_seconds())
+
     # Convert time array to DatetimeIndex (assuming time is in seconds since epoch)
     time_index = pd.to_datetime(time, unit='s')
 
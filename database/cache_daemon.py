@@ -0,0 +1,419 @@
+"""
+Local cache daemon, shared by the instances of the application running on the same machine.
+
+The daemon fetches the data from the database once (only the ranges that no instance has requested
+yet) and keeps it in shared memory segments, one per measurement and fetched range, which the
+instances map read-only (the dataframes they get are views of the mappings).
+The requests go through a local socket, authenticated with a random key of the user (see authkey).
+
+It is started by the first instance that needs it (see connect), or manually:
+    pixi run python -m database.cache_daemon --port 8765
+"""
+import argparse
+import asyncio
+import bisect
+import itertools
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.connection import Listener, Client
+import numpy as np
+import pandas as pd
+
+from data_processing.sorted_store import natural_key
+from data_processing.utils import to_nanoseconds
+from database.coverage import Coverage
+from database.multi_source import create_handler, SEPARATOR, WILDCARD
+from utils.file_tools import load_config
+
+DEFAULT_PORT = 8765
+DEFAULT_MAX_MB = 1024
+KEY_PATH = os.path.join(os.path.expanduser("~"), ".stabilityfusion", "cache_daemon.key")
+
+# Segments created by this process (when the daemon runs in the same process as a client)
+_created = set()
+
+def attach(name):
+    # Map a segment created by the daemon, which remains its owner
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    segment = shared_memory.SharedMemory(name=name)
+    if name not in _created:
+        resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+def is_group(name):
+    # All the measurements (None), or all the ones of a source ("<source>:*", see MultiSourceHandler)
+    return name is None or name.endswith(WILDCARD)
+
+def groups_of(name):
+    # Groups of measurements a request name belongs to
+    if name is None:
+        return []
+    source = [name.partition(SEPARATOR)[0] + SEPARATOR + WILDCARD] if SEPARATOR in name and not is_group(name) else []
+    return [None] + source
+
+def in_group(measurement, group):
+    return group is None or measurement.startswith(group[:-len(WILDCARD)])
+
+def authkey(path=KEY_PATH):
+    """
+    Key authenticating the connections to the daemon (the requests are unpickled, so only the
+    processes of the user may connect): random, created on first use in a file only the user can
+    read, and refused if other users can access it.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not os.path.exists(path):
+        # Written aside, then linked in place at once (another instance may create it concurrently)
+        fd, temp_path = tempfile.mkstemp(dir=directory) # Readable by the user only
+        with os.fdopen(fd, "wb") as f:
+            f.write(secrets.token_bytes(32))
+        try:
+            os.link(temp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(temp_path)
+
+    if os.name == "posix" and os.stat(path).st_mode & 0o077:
+        raise PermissionError("The key of the cache daemon '{}' is accessible to other users (chmod 600 it).".format(path))
+    with open(path, "rb") as f:
+        key = f.read()
+    if len(key) < 16:
+        raise ValueError("The key of the cache daemon '{}' is too short.".format(path))
+    return key
+
+class CacheDaemon:
+    """
+    Serves the data fetched by an InfluxDBHandler (or MultiSourceHandler) to several clients (see DaemonHandler).
+
+    The data is cached per measurement and avg_window, as one shared memory segment (time (ns,
+    int64) then values (float64)) per fetched range, kept until it is evicted. The ranges fetched for
+    all the measurements (None) or all the ones of a source ("<source>:*") cover their measurements,
+    so a measurement is not fetched again after its group. Requests arriving during a fetch wait for
+    it, and only fetch what it didn't.
+
+    max_bytes: memory of the segments, the least recently used ones are evicted beyond it (0 for no
+    limit). The clients keep the evicted segments they still use mapped, until they are done with them.
+    """
+    def __init__(self, handler, address=("127.0.0.1", DEFAULT_PORT), key=None, max_bytes=DEFAULT_MAX_MB*2**20):
+        self.handler = handler
+        key = authkey() if key is None else key
+        if not key:
+            raise ValueError("The cache daemon needs an authentication key.")
+        self.listener = Listener(address, authkey=key)
+        self.address = self.listener.address
+        self.max_bytes = max_bytes
+
+        self.ranges = {} # (measurement, avg_window) -> sorted [start, stop, segment name, size] (ns)
+        self.coverage = {} # (measurement or group, avg_window) -> Coverage
+        self.segments = {} # Segment name -> (SharedMemory, (measurement, avg_window))
+        self.last_access = {} # Segment name -> access counter
+        self.nbytes = 0
+        self.fetches = 0 # Number of fetches from the database
+
+        self._clock = itertools.count()
+        self._lock = threading.RLock() # State of the cache
+        self._fetch_lock = threading.Lock() # One database fetch at a time (InfluxDBHandler is not thread safe)
+        self._thread = None
+
+    def serve_forever(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except OSError: # Listener closed
+                break
+            except Exception as e: # e.g. wrong authentication key
+                print("Cache daemon: connection refused ({}).".format(e))
+                continue
+            threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+
+    def start(self):
+        # Serve from a background thread
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.listener.close()
+        with self._lock:
+            for name in list(self.segments):
+                self.evict(name)
+
+    def handle(self, connection):
+        with connection:
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    break
+
+                try:
+                    if request["op"] == "fetch":
+                        connection.send(self.fetch(request["start"], request["stop"], request["avg_window"], request["measurement"]))
+                except Exception as e:
+                    connection.send({"error": repr(e)})
+
+    def coverage_of(self, name, avg_window):
+        return self.coverage.setdefault((name, avg_window), Coverage())
+
+    def missing(self, name, avg_window, start, stop):
+        # Ranges of [start, stop] (ns) not fetched for a measurement or group, nor for the groups containing it
+        gaps = self.coverage_of(name, avg_window).missing(start, stop)
+        for group in groups_of(name):
+            gaps = [gap for a, b in gaps for gap in self.coverage_of(group, avg_window).missing(a, b)]
+        return gaps
+
+    def fetch(self, start, stop, avg_window=None, measurement=None):
+        # Data within [start, stop] (ns), fetched from the database if no client has requested it yet
+        names = [measurement] if measurement is None or isinstance(measurement, str) else list(measurement)
+        with self._lock:
+            complete = not any(self.missing(name, avg_window, start, stop) for name in names)
+
+        if not complete:
+            with self._fetch_lock:
+                # What the previous fetches didn't get
+                with self._lock:
+                    gaps = {name: self.missing(name, avg_window, start, stop) for name in names}
+                fetched = [name for name in names if gaps[name]]
+                if fetched:
+                    fetch_start = min(gaps[name][0][0] for name in fetched)
+                    fetch_stop = max(gaps[name][-1][1] for name in fetched)
+                    request = None if None in fetched else (fetched[0] if len(fetched) == 1 else fetched)
+                    df = asyncio.run(self.handler.db_to_df(pd.Timestamp(fetch_start, tz="UTC"), pd.Timestamp(fetch_stop, tz="UTC"), avg_window=avg_window, measurement=request))
+                    self.fetches += 1
+                    if hasattr(self.handler, "clear_cache"):
+                        self.handler.clear_cache() # Its results duplicate the segments
+                    with self._lock:
+                        self.insert(df, avg_window, fetch_start, fetch_stop, {name: gaps[name] for name in fetched})
+
+        with self._lock:
+            reply = self.publish(names, avg_window, start, stop)
+            self.enforce(keep={name for _, slices in reply["measurements"] for name, _, _, _ in slices})
+        return reply
+
+    def insert(self, df, avg_window, start, stop, gaps):
+        """
+        Add the samples of a fetched dataframe, each measurement in the ranges of [start, stop] it had
+        no data for, then mark the ranges fetched for each request name (gaps: name -> ranges).
+        """
+        if df is not None and not df.empty:
+            for measurement, measurement_df in df.groupby("_measurement", sort=False):
+                time = to_nanoseconds(measurement_df["_time"])
+                values = measurement_df["value"].to_numpy(dtype=np.float64)
+                if len(time) > 1 and np.any(np.diff(time) < 0):
+                    order = np.argsort(time, kind="stable")
+                    time, values = time[order], values[order]
+
+                for a, b in self.missing(measurement, avg_window, start, stop):
+                    p, q = np.searchsorted(time, a, side="left"), np.searchsorted(time, b, side="right")
+                    if q > p:
+                        self.add_segment(measurement, avg_window, a, b, time[p:q], values[p:q])
+                    self.coverage_of(measurement, avg_window).add(a, b, avg_window)
+
+        for name, name_gaps in gaps.items():
+            for a, b in name_gaps:
+                self.coverage_of(name, avg_window).add(a, b, avg_window)
+
+    def add_segment(self, measurement, avg_window, start, stop, time, values):
+        size = len(time)
+        segment = shared_memory.SharedMemory(create=True, size=16*size)
+        segment_time = np.ndarray(size, dtype=np.int64, buffer=segment.buf)
+        segment_values = np.ndarray(size, dtype=np.float64, buffer=segment.buf, offset=8*size)
+        segment_time[:] = time
+        segment_values[:] = values
+        del segment_time, segment_values # The segment can't be closed while arrays use it
+
+        key = (measurement, avg_window)
+        bisect.insort(self.ranges.setdefault(key, []), [start, stop, segment.name, size])
+        self.segments[segment.name] = (segment, key)
+        self.last_access[segment.name] = next(self._clock)
+        self.nbytes += 16*size
+        _created.add(segment.name)
+
+    def publish(self, names, avg_window, start, stop):
+        """
+        Segments of the samples within [start, stop] (ns), per measurement:
+        {"measurements": [(measurement, [(segment name, size, first, last + 1), ...]), ...]}
+        """
+        measurements = []
+        for name in names:
+            if is_group(name):
+                measurements += sorted((measurement for measurement, window in self.ranges if window == avg_window and in_group(measurement, name)), key=natural_key)
+            else:
+                measurements.append(name)
+
+        parts = []
+        tick = next(self._clock)
+        for measurement in dict.fromkeys(measurements):
+            slices = []
+            last = None
+            for range_start, range_stop, name, size in self.ranges.get((measurement, avg_window), []):
+                if range_stop < start or range_start > stop:
+                    continue
+                time = np.ndarray(size, dtype=np.int64, buffer=self.segments[name][0].buf)
+                p, q = np.searchsorted(time, start, side="left"), np.searchsorted(time, stop, side="right")
+                if last is not None:
+                    p = max(p, np.searchsorted(time, last, side="right")) # The sample at the limit of two ranges
+                if q > p:
+                    slices.append((name, size, int(p), int(q)))
+                    last = int(time[q-1])
+                    self.last_access[name] = tick
+                del time
+            if slices:
+                parts.append((measurement, slices))
+        return {"measurements": parts}
+
+    def enforce(self, keep=()):
+        # Evict the least recently used segments (except keep) until the memory is within max_bytes
+        if not self.max_bytes or self.nbytes <= self.max_bytes:
+            return
+        for name in sorted(self.segments, key=self.last_access.get):
+            if self.nbytes <= self.max_bytes:
+                break
+            if not name in keep:
+                self.evict(name)
+
+    def evict(self, name):
+        # Free a segment, its range is fetched again when requested (by the measurement and its groups)
+        segment, key = self.segments.pop(name)
+        measurement, avg_window = key
+        ranges = self.ranges[key]
+        entry = next(entry for entry in ranges if entry[2] == name)
+        ranges.remove(entry)
+        start, stop, _, size = entry
+        for coverage_name in [measurement] + groups_of(measurement):
+            self.coverage_of(coverage_name, avg_window).remove(start, stop)
+
+        self.last_access.pop(name, None)
+        self.nbytes -= 16*size
+        _created.discard(name)
+        segment.close()
+        segment.unlink()
+
+class DaemonHandler:
+    """
+    Gets the data through the cache daemon, with the db_to_df interface of InfluxDBHandler.
+
+    The dataframes are read-only views of the segments of the daemon (no copy when a request is
+    answered by a single segment). A segment stays mapped while arrays use it.
+    """
+    def __init__(self, address, authkey):
+        self.address = address
+        self.connection = Client(address, authkey=authkey)
+        self._lock = threading.Lock()
+        self._mapping_lock = threading.Lock() # The GUI and the prefetcher use the handler concurrently
+        self._mappings = {} # Segment name -> weak reference to the array of its mapping
+        self._unused = [] # Mappings no longer used by any array, to close
+
+    def request(self, request):
+        with self._lock:
+            self.connection.send(request)
+            reply = self.connection.recv()
+        if "error" in reply:
+            raise RuntimeError("Cache daemon: " + reply["error"])
+        return reply
+
+    def segment(self, name, size):
+        # Time and values of a segment, read-only views of its mapping
+        array = self._mappings.get(name, lambda: None)()
+        if array is None:
+            mapping = attach(name)
+            array = np.ndarray(16*size, dtype=np.uint8, buffer=mapping.buf)
+            array.flags.writeable = False
+            self._mappings[name] = weakref.ref(array)
+            # Closed later: when the array is finalized, its buffer is still exported
+            weakref.finalize(array, self._unused.append, mapping)
+        return array[:8*size].view(np.int64), array[8*size:].view(np.float64)
+
+    def close_unused(self):
+        with self._mapping_lock:
+            unused, self._unused[:] = list(self._unused), []
+            for mapping in unused:
+                try:
+                    mapping.close()
+                except BufferError: # Still exported
+                    self._unused.append(mapping)
+            self._mappings = {name: array for name, array in self._mappings.items() if array() is not None}
+
+    async def db_to_df(self, start, stop, avg_window=None, measurement=None):
+        self.close_unused()
+        request = {"op": "fetch", "start": pd.Timestamp(start).value, "stop": pd.Timestamp(stop).value,
+                   "avg_window": avg_window, "measurement": measurement}
+        for attempt in range(3):
+            reply = self.request(request)
+            try:
+                with self._mapping_lock:
+                    parts = [(measurement, self.segment(name, size), p, q) for measurement, slices in reply["measurements"] for name, size, p, q in slices]
+                break
+            except FileNotFoundError: # Evicted in the meantime
+                continue
+        else:
+            raise RuntimeError("Cache daemon: the segments were evicted before they could be read.")
+        if not parts:
+            return None
+
+        if len(parts) == 1:
+            # Views of the mapping
+            _, (time, values), p, q = parts[0]
+            time, values = time[p:q], values[p:q]
+        else:
+            time = np.concatenate([time[p:q] for _, (time, _), p, q in parts])
+            values = np.concatenate([values[p:q] for _, (_, values), p, q in parts])
+
+        return pd.DataFrame({
+            "_time": pd.DatetimeIndex(time, dtype="datetime64[ns, Europe/Paris]", copy=False), # From the UTC timestamps
+            "_measurement": np.repeat([part[0] for part in parts], [part[3] - part[2] for part in parts]),
+            "value": values,
+            }, copy=False)
+
+    def close(self):
+        self.connection.close()
+        self.close_unused()
+
+def connect(config_path="config/settings.json", port=DEFAULT_PORT, timeout=10):
+    """
+    Handler getting the data through the cache daemon listening on a local port, started if needed.
+    """
+    key = authkey()
+    address = ("127.0.0.1", port)
+    try:
+        return DaemonHandler(address, key)
+    except ConnectionRefusedError:
+        pass
+
+    # Start the daemon, independently of this instance
+    subprocess.Popen([sys.executable, "-m", "database.cache_daemon", "--config", config_path, "--port", str(port)], start_new_session=True)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return DaemonHandler(address, key)
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Local cache daemon shared by the instances of the application.")
+    parser.add_argument("--config", default="config/settings.json", help="Configuration file")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Local port")
+    parser.add_argument("--max-mb", type=float, default=None, help="Memory of the cached data (MB, default: cache_daemon_mb of the configuration)")
+    args = parser.parse_args()
+
+    max_mb = args.max_mb if args.max_mb is not None else float(load_config(args.config).get("app_settings", {}).get("cache_daemon_mb", DEFAULT_MAX_MB))
+    daemon = CacheDaemon(create_handler(args.config), ("127.0.0.1", args.port), max_bytes=int(max_mb*2**20))
+    print("Cache daemon listening on {}:{}.".format(*daemon.address))
+    try:
+        daemon.serve_forever()
+    finally:
+        daemon.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import numpy as np
+
+from data_processing.utils import to_nanoseconds
+
+class Coverage:
+    """
+    Time ranges fetched for a measurement, as sorted and non-overlapping intervals
+    [start, stop] (ns), each one with the averaging window it was fetched with.
+    """
+    def __init__(self, intervals=None):
+        self.intervals = sorted([int(start), int(stop), str(avg_window)] for start, stop, avg_window in (intervals or []))
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def add(self, start, stop, avg_window):
+        # Mark [start, stop] as fetched with avg_window (replacing what was covered there)
+        start, stop, avg_window = int(start), int(stop), str(avg_window)
+        intervals = []
+        for a, b, window in self.intervals:
+            # Keep the parts outside [start, stop]
+            if a < start:
+                intervals.append([a, min(b, start), window])
+            if b > stop:
+                intervals.append([max(a, stop), b, window])
+        intervals.append([start, stop, avg_window])
+        intervals.sort()
+
+        # Merge the touching intervals of the same window
+        self.intervals = intervals[:1]
+        for a, b, window in intervals[1:]:
+            last = self.intervals[-1]
+            if a <= last[1] and window == last[2]:
+                last[1] = max(last[1], b)
+            else:
+                self.intervals.append([a, b, window])
+
+    def remove(self, start, stop):
+        # Mark [start, stop] as not fetched (e.g. evicted from the cache)
+        start, stop = int(start), int(stop)
+        intervals = []
+        for a, b, window in self.intervals:
+            if b < start or a > stop:
+                intervals.append([a, b, window])
+                continue
+            # Keep the parts outside [start, stop]
+            if a < start:
+                intervals.append([a, start, window])
+            if b > stop:
+                intervals.append([stop, b, window])
+        self.intervals = intervals
+
+    def missing(self, start, stop, avg_window=None):
+        """
+        Intervals of [start, stop] (ns) not fetched yet, or fetched with another avg_window.
+        avg_window: None to accept any window
+        """
+        missing = []
+        current = int(start)
+        for a, b, window in self.intervals:
+            if avg_window is not None and window != str(avg_window):
+                continue
+            if b < current:
+                continue
+            if a > stop:
+                break
+            if a > current:
+                missing.append((current, a))
+            current = max(current, b)
+        if current < stop:
+            missing.append((current, int(stop)))
+        return missing
+
+    def covers(self, start, stop, avg_window=None):
+        return not self.missing(start, stop, avg_window)
+
+    def plot_data(self):
+        # Timestamps (s) and values (1 where fetched, NaN between the intervals) for a plot
+        x = np.array([[a, b, b] for a, b, _ in self.intervals], dtype=np.float64).ravel()/1e9
+        y = np.tile([1, 1, np.nan], len(self.intervals))
+        return x, y
+
+    def to_list(self):
+        return [list(interval) for interval in self.intervals]
+
+    @classmethod
+    def from_avail_df(cls, df):
+        # Legacy availability (one row per second, columns "time", "cached", "avg_window")
+        coverage = cls()
+        df = df.sort_values(by="time")
+        time = to_nanoseconds(df["time"])
+        cached = df["cached"].to_numpy(dtype=bool)
+        windows = df["avg_window"].astype(str).to_numpy()
+
+        # Runs of cached seconds with the same window
+        change = np.ones(len(df), dtype=bool)
+        change[1:] = (cached[1:] != cached[:-1]) | (windows[1:] != windows[:-1])
+        starts = np.nonzero(change)[0]
+        stops = np.append(starts[1:], len(df)) - 1
+        for a, b in zip(starts, stops):
+            if cached[a]:
+                coverage.add(time[a], time[b], windows[a])
+        return coverage
@@ -0,0 +1,299 @@
+import functools
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from tqdm import tqdm
+import asyncio
+
+from data_processing.aligned_store import AlignedStore
+from data_processing.adev_index import AdevIndex
+from data_processing.derived import Expression
+from database.coverage import Coverage
+from database.memory_budget import MemoryBudget
+from data_processing.sorted_store import SortedStore
+from data_processing.utils import to_timestamp, to_nanoseconds
+from instrumentation.tracer import tracer
+
+class DataCache:
+    """
+    Data fetched from the database, per mode ("temporal" or "adev").
+
+    The data of each mode is kept sorted per measurement (see SortedStore). Keeps track of
+    the time ranges already fetched for each measurement (see Coverage), so that only the
+    missing data is requested, from the loaded preset bundle when it has it or else from the
+    database. The "adev" data is also kept aligned on a common time grid (see AlignedStore), with
+    an index of its tau statistics for the ADev of any region (see AdevIndex).
+
+    precision: storage precision of the cached values, per measurement (see SortedStore). The
+    aligned grid used by the ADev computations stays float64, filled with the stored values.
+    max_bytes: memory budget, the least recently used ranges being evicted beyond it (see
+    MemoryBudget), 0 for no limit
+
+    Derived measurements (expressions over the others, see set_derived) are fetched as their
+    inputs, and evaluated lazily: when fetched in "adev" mode (as a row of the aligned store) or read
+    (see series), and again only once their inputs or expression have changed.
+    """
+    def __init__(self, handler, precision=None, max_bytes=0):
+        self.handler = handler
+        self.precision = precision
+        self.data = {"temporal": SortedStore(precision), "adev": SortedStore(precision)}
+        self.coverage = {} # Mode -> measurement -> Coverage
+        self.bundle = None # Preset bundle the data is read from (see PresetBundle)
+        self.adev_store = AlignedStore()
+        self.adev_index = AdevIndex(self.adev_store)
+        self.budget = MemoryBudget(self, max_bytes)
+
+        self.derived = {} # Name -> Expression
+        self.derived_versions = {} # Name -> version of its inputs on the aligned store
+        self.derived_series = {} # (mode, name) -> (version of its inputs, time, values)
+
+        # Called with the measurement name when its "adev" availability changes
+        self.availability_updated = None
+        # Called before each fetch (e.g. to preempt the prefetch, see plan_prefetch)
+        self.fetch_started = None
+
+    def clear(self):
+        self.data = {"temporal": SortedStore(self.precision), "adev": SortedStore(self.precision)}
+        self.coverage = {}
+        self.bundle = None
+        self.adev_store.reset()
+        self.adev_index.clear()
+        self.budget.clear()
+        self.derived_series = {}
+        if hasattr(self.handler, "clear_cache"):
+            self.handler.clear_cache() # Results of the queries of the handler (see QueryCache)
+
+    def set_derived(self, table_df):
+        # Derived measurements of a table (the rows with an "Expression"), the invalid ones are ignored
+        derived = {}
+        if "Expression" in table_df:
+            for name, text in zip(table_df["Name"], table_df["Expression"]):
+                if isinstance(text, str) and text.strip():
+                    try:
+                        derived[name] = Expression(text)
+                    except ValueError as e:
+                        print("Derived measurement '{}' ignored: {}".format(name, e))
+
+        # Without cycles (e.g. a = b + 1, b = a - 1)
+        def cyclic(name, path=()):
+            return name in path or any(cyclic(operand, path + (name,)) for operand in derived[name].inputs if operand in derived)
+        for name in [name for name in derived if cyclic(name)]:
+            print("Derived measurement '{}' ignored: it depends on itself.".format(name))
+            del derived[name]
+
+        self.derived = derived
+        self.derived_series = {key: cached for key, cached in self.derived_series.items() if key[1] in derived}
+
+    def inputs_of(self, measurement_list):
+        # Measurements to fetch for a list, with the derived ones replaced by their inputs (recursively)
+        inputs = []
+        for measurement in measurement_list:
+            for name in (self.inputs_of(self.derived[measurement].inputs) if measurement in self.derived else [measurement]):
+                if not name in inputs:
+                    inputs.append(name)
+        return inputs
+
+    def version(self, versions, measurement):
+        # Version of a measurement in a store (its versions), for a derived one of its expression and inputs
+        expression = self.derived.get(measurement)
+        if expression is None:
+            return versions.get(measurement)
+        return (expression.source, tuple(self.version(versions, operand) for operand in expression.inputs))
+
+    def derive(self, measurement):
+        # Values of a derived measurement on the aligned grid (see AlignedStore.derive), if its inputs are there
+        expression = self.derived[measurement]
+        for operand in expression.inputs:
+            if operand in self.derived:
+                self.derive(operand)
+
+        store = self.adev_store
+        if not all(operand in store.rows for operand in expression.inputs):
+            return
+        version = self.version(store.versions, measurement)
+        if measurement in store.rows and self.derived_versions.get(measurement) == version:
+            return
+        with tracer.span("cache.derive"):
+            store.derive(measurement, expression.inputs, expression.evaluate)
+        self.derived_versions[measurement] = version
+
+    def series(self, mode, measurement):
+        """
+        Time (ns) and values of a measurement (see SortedStore.series). A derived measurement is
+        evaluated on the timestamps common to its inputs.
+        """
+        expression = self.derived.get(measurement)
+        if expression is None:
+            return self.data[mode].series(measurement)
+
+        version = self.version(self.data[mode].versions, measurement)
+        cached = self.derived_series.get((mode, measurement))
+        if cached is not None and cached[0] == version:
+            return cached[1:]
+
+        with tracer.span("cache.derive"):
+            inputs = [self.series(mode, operand) for operand in expression.inputs]
+            times = [time for time, _ in inputs]
+            if all(np.array_equal(time, times[0]) for time in times[1:]):
+                time, arrays = times[0], [values for _, values in inputs]
+            else:
+                time = functools.reduce(np.intersect1d, times)
+                arrays = [values[np.searchsorted(input_time, time)] for input_time, values in inputs]
+            values = expression.evaluate(arrays) if len(time) else np.empty(0)
+
+        self.derived_series[(mode, measurement)] = (version, time, values)
+        return time, values
+
+    def load(self, mode, df):
+        # Replace the data of a mode (e.g. from a preset dataframe)
+        self.data[mode] = SortedStore.from_frame(df, self.precision)
+        if mode == "adev":
+            self.adev_store.reset()
+            self.adev_index.clear()
+            self.update_aligned_store()
+
+    def load_bundle(self, bundle):
+        # Read the data from a preset bundle, lazily (only the fetched measurements and ranges)
+        self.clear()
+        self.bundle = bundle
+
+    def update_aligned_store(self, df=None):
+        # Add the "adev" data of a dataframe (default: all the cached data) to the aligned store, as stored
+        store = self.data["adev"]
+        if df is None:
+            for measurement in store.names:
+                time, values = store.series(measurement)
+                self.adev_store.update(measurement, time/1e9, values)
+            return
+
+        if df.empty:
+            return
+        for measurement, measurement_df in df.groupby("_measurement", sort=False):
+            values = store.precision_of(measurement).quantize(measurement_df["value"].to_numpy())
+            self.adev_store.update(measurement, to_timestamp(measurement_df["_time"]), values)
+
+    @tracer.timed("cache.fetch")
+    def fetch(self, start: datetime, end: datetime, measurement_list, avg_window, mode):
+        if self.fetch_started:
+            self.fetch_started()
+        store = self.data[mode]
+
+        # Create dictionary per mode and measurement
+        if not mode in self.coverage.keys():
+            self.coverage[mode] = {}
+
+        # The aligned store uses the initial tau as grid step, rebuild it if it has changed
+        if mode == "adev":
+            step = float(avg_window) if avg_window != "" else 1.0
+            if self.adev_store.step != step:
+                self.adev_store.reset(step)
+                self.adev_index.clear()
+                self.update_aligned_store()
+
+        # If the mode is adev, the data must also have been fetched with the same avg_window
+        window = avg_window if mode == "adev" else None
+        start_ns, end_ns = pd.Timestamp(start).value, pd.Timestamp(end).value
+        avg_window_fetch = int(avg_window) if not avg_window == "" else None
+
+        # The inputs of the derived measurements
+        derived = [measurement for measurement in measurement_list if measurement in self.derived]
+        measurement_list = self.inputs_of(measurement_list)
+
+        # All the measurements of each source on their own (see MultiSourceHandler)
+        if hasattr(self.handler, "expand"):
+            measurement_list = self.handler.expand(measurement_list)
+
+        self.budget.touch(mode, ["All" if measurement is None else measurement for measurement in measurement_list], start_ns, end_ns)
+
+        # Ranges not cached yet (from the first to the last missing range of each measurement)
+        fetches = [] # (measurement, label, coverage, fetch_start, fetch_stop)
+        for measurement in measurement_list:
+            measurement_label = "All" if measurement is None else measurement # Assign name "All" for dictionary when fetching all the measurements
+            coverage = self.coverage[mode].setdefault(measurement_label, Coverage())
+            missing = coverage.missing(start_ns, end_ns, window)
+
+            tracer.count("cache.hits" if not missing else "cache.misses")
+            if missing:
+                fetch_start = pd.Timestamp(missing[0][0], tz="UTC") - timedelta(seconds=5)
+                fetch_stop = pd.Timestamp(missing[-1][1], tz="UTC") + timedelta(seconds=5)
+                fetches.append((measurement, measurement_label, coverage, fetch_start, fetch_stop))
+
+        # From the preset bundle if it has the whole range, otherwise from the database (all the measurements concurrently)
+        from_bundle = [self.bundle is not None and self.bundle.covers(mode, label, fetch_start.value, fetch_stop.value, window)
+                       for _, label, _, fetch_start, fetch_stop in fetches]
+        db_fetches = [(measurement, fetch_start, fetch_stop) for (measurement, _, _, fetch_start, fetch_stop), bundled in zip(fetches, from_bundle) if not bundled]
+        db_results = iter(asyncio.run(self.fetch_db(db_fetches, avg_window_fetch)) if db_fetches else [])
+
+        for (measurement, measurement_label, coverage, fetch_start, fetch_stop), bundled in (pbar := tqdm(list(zip(fetches, from_bundle)))):
+            pbar.set_description("Inserting '{}' data.".format(measurement_label))
+            new_df = self.bundle.read(mode, measurement, fetch_start.value, fetch_stop.value) if bundled else next(db_results)
+            if isinstance(new_df, Exception):
+                # Not marked as cached, it will be requested again
+                print("Fetching '{}' data failed ({}).".format(measurement_label, new_df))
+                continue
+
+            self.insert_range(mode, measurement, coverage, new_df, fetch_start, fetch_stop, avg_window)
+
+        # If the mode is "adev", notify the availability change
+        if mode == "adev" and self.availability_updated:
+            for measurement in measurement_list:
+                self.availability_updated(measurement)
+
+        if mode == "adev":
+            for measurement in derived:
+                self.derive(measurement)
+
+        # Within the memory budget (the fetched range is kept)
+        self.budget.enforce(fetching=[(mode, start_ns, end_ns)])
+        return store
+
+    def insert_range(self, mode, measurement, coverage, new_df, start, stop, avg_window):
+        # Insert the new data, it replaces the data of the fetched range (e.g. if the avg_window has changed)
+        with tracer.span("cache.insert"):
+            self.data[mode].insert_df(new_df, start.value, stop.value)
+
+        # Add new data to the aligned store
+        if mode == "adev" and new_df is not None:
+            with tracer.span("cache.aligned_store"):
+                self.adev_store.clear_range(measurement, start.timestamp(), stop.timestamp())
+                self.update_aligned_store(new_df)
+
+        # Mark the region as cached
+        coverage.add(start.value, stop.value, avg_window)
+
+    def fill(self, mode, measurement, new_df, start, stop, avg_window):
+        """
+        Insert data fetched apart (e.g. prefetched, see plan_prefetch) for [start, stop], only where
+        nothing is cached yet: the cached data is kept, even if fetched with another avg_window.
+        """
+        measurement_label = "All" if measurement is None else measurement
+        coverage = self.coverage.setdefault(mode, {}).setdefault(measurement_label, Coverage())
+        time = to_nanoseconds(new_df["_time"]) if new_df is not None else None
+        for a, b in coverage.missing(start.value, stop.value):
+            part = new_df[(time >= a) & (time <= b)] if new_df is not None else None
+            self.insert_range(mode, measurement, coverage, part, pd.Timestamp(a, tz="UTC"), pd.Timestamp(b, tz="UTC"), avg_window)
+
+        if mode == "adev" and self.availability_updated:
+            self.availability_updated(measurement_label)
+        self.budget.enforce(fetching=[(mode, start.value, stop.value)])
+
+    async def fetch_db(self, fetches, avg_window):
+        # Data of each (measurement, start, stop) from the database, concurrently (the exception if the fetch failed)
+        tasks = [self.handler.db_to_df(fetch_start, fetch_stop, measurement=measurement, avg_window=avg_window) for measurement, fetch_start, fetch_stop in fetches]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+def iter_db_chunks(handler, start: datetime, stop: datetime, measurement, avg_window=None, chunk_duration=timedelta(hours=6)):
+    """
+    Time (s) and values of a measurement within [start, stop], fetched from the database by chunks
+    of chunk_duration, without keeping them (e.g. for chunked_stab).
+    """
+    current_start = start
+    while current_start < stop:
+        current_stop = min(current_start + chunk_duration, stop)
+        df = asyncio.run(handler.db_to_df(current_start, current_stop, avg_window=avg_window, measurement=measurement))
+        current_start = current_stop
+        if df is None:
+            continue
+
+        df = df[df["_measurement"] == measurement].sort_values(by="_time")
+        yield to_timestamp(df["_time"]), df["value"].to_numpy(dtype=float)
@@ -0,0 +1,311 @@
+import asyncio
+import io
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from data_processing.utils import to_nanoseconds
+from instrumentation.tracer import tracer
+
+# Nanoseconds per unit of the numeric time columns
+TIME_UNITS = {"s": 10**9, "ms": 10**6, "us": 10**3, "ns": 1}
+
+def to_ns(time, unit="s"):
+    # Timestamps (ns, int64) of a numeric time array in the given unit
+    time = np.asarray(time)
+    if time.dtype.kind == "M":
+        return time.astype("datetime64[ns]").astype(np.int64)
+    if time.dtype.kind in "iu":
+        return time.astype(np.int64)*TIME_UNITS[unit]
+    return np.round(time*TIME_UNITS[unit]).astype(np.int64)
+
+def from_ns(time_ns, unit="s", dtype=np.float64):
+    # Bound (ns) in the unit and type of a numeric time column
+    if np.dtype(dtype).kind in "iu":
+        return time_ns//TIME_UNITS[unit]
+    return time_ns/TIME_UNITS[unit]
+
+def window_average(time, values, avg_window):
+    """
+    Averages of the samples over consecutive windows of avg_window seconds, aligned on multiples of
+    avg_window and timestamped at their end (as timedMovingAverage(every: avg_window, period: avg_window)).
+    time: sorted timestamps (ns)
+    """
+    if len(time) == 0:
+        return time, values
+    window = int(avg_window)*10**9
+    k = time//window
+    first = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+    counts = np.diff(np.r_[first, len(k)])
+    return (k[first] + 1)*window, np.add.reduceat(values, first)/counts
+
+class FileSource(ABC):
+    """
+    Measurements read from a file, with the db_to_df interface of InfluxDBHandler (e.g. as a source
+    of MultiSourceHandler). The files hold sorted timestamps, and a read of a time range only
+    touches the part of the file holding it.
+
+    Subclasses implement `measurements` (names in the file) and `read(measurements, start, stop)`,
+    which gives the (measurement, time (ns), values) of the samples within [start, stop) (ns).
+    """
+    def __init__(self, config):
+        self.path = config["path"]
+        self.time_column = config.get("time_column", "time")
+        self.time_unit = config.get("time_unit", "s") # Of the numeric time columns
+        if not self.time_unit in TIME_UNITS:
+            raise ValueError("Unsupported time unit '{}' ({}).".format(self.time_unit, ", ".join(TIME_UNITS)))
+
+    @property
+    @abstractmethod
+    def measurements(self):
+        pass
+
+    @abstractmethod
+    def read(self, measurements, start, stop):
+        pass
+
+    def to_df(self, series, avg_window=None):
+        # Long dataframe of the (measurement, time, values) read, as returned by InfluxDBHandler.db_to_df
+        df_list = []
+        for measurement, time, values in series:
+            values = np.asarray(values, dtype=np.float64)
+            valid = ~np.isnan(values)
+            time, values = time[valid], values[valid]
+            if avg_window:
+                time, values = window_average(time, values, avg_window)
+            if len(time):
+                df_list.append(pd.DataFrame({"_measurement": measurement, "_time": time, "value": values}))
+
+        if not df_list:
+            return None
+        df = pd.concat(df_list, ignore_index=True)
+        df["_time"] = pd.to_datetime(df["_time"], utc=True).dt.tz_convert("Europe/Paris")
+        return df
+
+    @tracer.timed("files.db_to_df")
+    async def db_to_df(self, start: datetime, stop: datetime, avg_window=None, measurement=None):
+        if measurement is None:
+            measurement = self.measurements
+        elif isinstance(measurement, str):
+            measurement = [measurement]
+        measurement = [name for name in measurement if name in self.measurements]
+        if not measurement:
+            return None
+
+        # Read in a thread (the loaders release the GIL), so that the sources are read concurrently
+        start_ns, stop_ns = pd.Timestamp(start).value, pd.Timestamp(stop).value
+        series = await asyncio.to_thread(self.read, measurement, start_ns, stop_ns)
+        tracer.count("files.rows", sum(len(time) for _, time, _ in series))
+        return self.to_df(series, avg_window)
+
+class RawSource(FileSource):
+    """
+    Raw binary file of fixed-size records (e.g. counter or phase meter logs), memory mapped: only
+    the pages of the time range are read, found by binary search on the time field.
+
+    columns: names of the record fields, in order (the time one and the measurements)
+    dtype: type of the fields (numpy notation, e.g. "<f8"), or one per field as a list
+    header: number of bytes before the first record
+    """
+    def __init__(self, config):
+        super().__init__(config)
+        columns = config["columns"]
+        dtypes = config.get("dtype", "<f8")
+        if isinstance(dtypes, str):
+            dtypes = [dtypes]*len(columns)
+        self.records = np.memmap(self.path, dtype=np.dtype(list(zip(columns, dtypes))), mode="r", offset=config.get("header", 0))
+
+    @property
+    def measurements(self):
+        return [name for name in self.records.dtype.names if name != self.time_column]
+
+    def read(self, measurements, start, stop):
+        time = self.records[self.time_column]
+        a, b = np.searchsorted(time, [from_ns(start, self.time_unit, time.dtype), from_ns(stop, self.time_unit, time.dtype)])
+        tracer.count("files.bytes (read)", int((b - a)*self.records.dtype.itemsize))
+        records = np.array(self.records[a:b]) # Copy of the range only
+        time = to_ns(records[self.time_column], self.time_unit)
+        return [(measurement, time, records[measurement]) for measurement in measurements]
+
+class HDF5Source(FileSource):
+    """
+    HDF5 file (needs h5py) holding a 1-D time dataset and one 1-D dataset per measurement, of the
+    same length, in the group `group`. Only the chunks of the time range are read, found by binary
+    search on the time dataset.
+    """
+    def __init__(self, config):
+        super().__init__(config)
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("HDF5 sources need the h5py package.")
+        self.file = h5py.File(self.path, "r")
+        self.group = self.file[config.get("group", "/")]
+        self.time = self.group[self.time_column]
+
+    @property
+    def measurements(self):
+        return [name for name, dataset in self.group.items()
+                if name != self.time_column and getattr(dataset, "shape", None) == self.time.shape]
+
+    def bisect(self, value):
+        # First index of the time dataset with a time >= value, reading log2(n) elements
+        a, b = 0, len(self.time)
+        while a < b:
+            middle = (a + b)//2
+            if self.time[middle] < value:
+                a = middle + 1
+            else:
+                b = middle
+        return a
+
+    def read(self, measurements, start, stop):
+        a = self.bisect(from_ns(start, self.time_unit, self.time.dtype))
+        b = self.bisect(from_ns(stop, self.time_unit, self.time.dtype))
+        time = to_ns(self.time[a:b], self.time_unit)
+        series = [(measurement, time, self.group[measurement][a:b]) for measurement in measurements]
+        tracer.count("files.bytes (read)", int(time.nbytes*(len(series) + 1)))
+        return series
+
+class ParquetSource(FileSource):
+    """
+    Parquet file (or directory of files), either long (columns "_measurement", "_time", "value", as
+    the preset bundles) or wide (a time column and one column per measurement). Only the row groups
+    whose time statistics overlap the range are read, with the requested columns only.
+    """
+    def __init__(self, config):
+        super().__init__(config)
+        import pyarrow.dataset as ds
+        self.dataset = ds.dataset(self.path, format="parquet")
+        self.long = "_measurement" in self.dataset.schema.names
+        if self.long:
+            self.time_column = "_time"
+        self._measurements = None
+
+    @property
+    def measurements(self):
+        if self._measurements is None:
+            if self.long:
+                names = self.dataset.to_table(columns=["_measurement"]).column("_measurement")
+                self._measurements = [str(name) for name in pd.unique(names.to_pandas().astype(str))]
+            else:
+                self._measurements = [name for name in self.dataset.schema.names if name != self.time_column]
+        return self._measurements
+
+    def bound(self, time_ns):
+        # Bound (ns) as a scalar of the type of the time column (for the row group statistics)
+        import pyarrow as pa
+        time_type = self.dataset.schema.field(self.time_column).type
+        if pa.types.is_timestamp(time_type):
+            return pa.scalar(time_ns//TIME_UNITS[time_type.unit], pa.int64()).cast(time_type)
+        return pa.scalar(from_ns(time_ns, self.time_unit, time_type.to_pandas_dtype()), time_type)
+
+    def read(self, measurements, start, stop):
+        import pyarrow.dataset as ds
+        condition = (ds.field(self.time_column) >= self.bound(start)) & (ds.field(self.time_column) < self.bound(stop))
+        if self.long:
+            condition &= ds.field("_measurement").isin(measurements)
+            table = self.dataset.to_table(columns=["_measurement", "_time", "value"], filter=condition)
+        else:
+            table = self.dataset.to_table(columns=[self.time_column] + list(measurements), filter=condition)
+        tracer.count("files.bytes (read)", int(table.nbytes))
+
+        time = to_ns(table.column(self.time_column).to_numpy(), self.time_unit)
+        if not self.long:
+            return [(measurement, time, table.column(measurement).to_numpy(zero_copy_only=False)) for measurement in measurements]
+
+        names = table.column("_measurement").to_pandas().astype(str).to_numpy()
+        values = table.column("value").to_numpy(zero_copy_only=False)
+        series = []
+        for measurement in measurements:
+            selected = names == measurement
+            order = np.argsort(time[selected], kind="stable")
+            series.append((measurement, time[selected][order], values[selected][order]))
+        return series
+
+class CSVSource(FileSource):
+    """
+    CSV file with a header line, a time column (numeric, or dates) and one column per measurement.
+
+    The file is indexed on first use: the time of the line starting after each `index_step` bytes
+    is kept, so that a read of a time range only parses the bytes holding it, with the
+    multi-threaded parser of pyarrow.
+    """
+    def __init__(self, config):
+        super().__init__(config)
+        self.delimiter = config.get("delimiter", ",")
+        self.index_step = int(config.get("index_step", 2**22))
+        with open(self.path, "rb") as f:
+            self.header = f.readline()
+            self.data_offset = f.tell()
+        self.columns = [name.strip().strip('"') for name in self.header.decode().split(self.delimiter)]
+        self.size = os.path.getsize(self.path)
+        self._index = None
+
+    @property
+    def measurements(self):
+        return [name for name in self.columns if name != self.time_column]
+
+    def line_time(self, line):
+        # Time (ns) of a data line
+        field = line.decode().split(self.delimiter)[self.columns.index(self.time_column)].strip().strip('"')
+        try:
+            return int(to_ns(np.float64(field), self.time_unit))
+        except ValueError:
+            timestamp = pd.Timestamp(field)
+            return (timestamp if timestamp.tz is not None else timestamp.tz_localize("UTC")).value
+
+    @property
+    def index(self):
+        # Offsets of line starts and their times, every index_step bytes (only these lines are read)
+        if self._index is None:
+            offsets, times = [], []
+            with open(self.path, "rb") as f:
+                for position in range(self.data_offset, self.size, self.index_step):
+                    f.seek(position)
+                    if position != self.data_offset:
+                        f.readline() # End of the current line
+                    offset = f.tell()
+                    line = f.readline()
+                    if line.strip():
+                        offsets.append(offset)
+                        times.append(self.line_time(line))
+            self._index = (np.array(offsets + [self.size], dtype=np.int64), np.array(times, dtype=np.int64))
+        return self._index
+
+    def read(self, measurements, start, stop):
+        from pyarrow import csv
+        offsets, times = self.index
+        if len(times) == 0:
+            return [(measurement, np.zeros(0, dtype=np.int64), np.zeros(0)) for measurement in measurements]
+
+        # Bytes from the last indexed line before start to the first indexed line at or after stop
+        a = offsets[max(np.searchsorted(times, start, side="right") - 1, 0)]
+        b = offsets[np.searchsorted(times, stop, side="left")]
+        with open(self.path, "rb") as f:
+            f.seek(a)
+            data = f.read(b - a)
+        tracer.count("files.bytes (read)", len(data))
+
+        table = csv.read_csv(io.BytesIO(self.header + data),
+                             read_options=csv.ReadOptions(use_threads=True),
+                             parse_options=csv.ParseOptions(delimiter=self.delimiter),
+                             convert_options=csv.ConvertOptions(include_columns=[self.time_column] + list(measurements)))
+        time_column = table.column(self.time_column).to_numpy()
+        if time_column.dtype.kind in "Miuf":
+            time = to_ns(time_column, self.time_unit)
+        else: # Dates not recognized by the parser
+            time = to_nanoseconds(time_column)
+        keep = (time >= start) & (time < stop)
+        return [(measurement, time[keep], table.column(measurement).to_numpy(zero_copy_only=False)[keep]) for measurement in measurements]
+
+SOURCE_TYPES = {"raw": RawSource, "hdf5": HDF5Source, "parquet": ParquetSource, "csv": CSVSource}
+
+def open_source(config):
+    # File source of a source configuration (its "type" is one of SOURCE_TYPES)
+    source_type = config.get("type")
+    if not source_type in SOURCE_TYPES:
+        raise ValueError("Unknown source type '{}' ({}).".format(source_type, ", ".join(["influxdb"] + list(SOURCE_TYPES))))
+    return SOURCE_TYPES[source_type](config)
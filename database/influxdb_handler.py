@@ -1,43 +1,112 @@
 import pandas as pd
 from pathlib import Path
 from datetime import datetime, timedelta
-from influxdb_client import InfluxDBClient
-from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
 from tqdm.asyncio import tqdm
 import asyncio
+import threading
 
+from database.query_cache import QueryCache
 from utils.file_tools import load_config
+from instrumentation.tracer import tracer
 
 class InfluxDBHandler:
-    def __init__(self, config_path="config/settings.json"):
-        # Load configuration
+    # Delay after which the data of a range is considered complete (points can be written late)
+    SETTLE_TIME = timedelta(minutes=1)
+
+    def __init__(self, config_path="config/settings.json", source=None):
+        # Load configuration (or use the given source, see MultiSourceHandler)
         self.config_path = Path(config_path)
-        config = load_config(self.config_path)["influxdb"]
+        config = source if source is not None else load_config(self.config_path)["influxdb"]
 
         self.url    = config["url"]
         self.token  = config["token"]
         self.org    = config["org"]
         self.bucket = config["bucket"]
-
-        write_client = InfluxDBClient(url=self.url, token=self.token, org=self.org)
-        self.query_api = write_client.query_api()
-        self.semaphore = None
-
-    async def fetch_block(self, query, client):
-        async with self.semaphore: # Limit concurrent tasks (currently to 3)
-            block_df = await client.query_api().query_data_frame(query, org=self.org)
+        self.max_concurrency = int(config.get("max_concurrency", 3)) # Concurrent queries to the server
+
+        # Results of the block queries, and the identical queries in flight (answered by a single request)
+        self.query_cache = QueryCache(int(float(config.get("query_cache_mb", 256))*2**20), float(config.get("live_cache_seconds", 10)))
+
+        # The clients are created on first use (influxdb_client is slow to import)
+        self._query_api = None
+        self._loop_state = threading.local() # Per thread (e.g. the GUI and the prefetcher), see loop_state
+
+    @property
+    def query_api(self):
+        if self._query_api is None:
+            from influxdb_client import InfluxDBClient
+            write_client = InfluxDBClient(url=self.url, token=self.token, org=self.org)
+            self._query_api = write_client.query_api()
+        return self._query_api
+
+    def loop_state(self):
+        # Semaphore and queries in flight of the event loop running in this thread (reset with the loop)
+        loop = asyncio.get_running_loop()
+        state = self._loop_state
+        if getattr(state, "loop", None) is not loop:
+            state.loop = loop
+            state.semaphore = asyncio.Semaphore(self.max_concurrency)
+            state.in_flight = {} # Normalized query -> task
+        return state
+
+    def get_semaphore(self):
+        # Limit of concurrent queries, shared by the requests running in the same event loop
+        return self.loop_state().semaphore
+
+    def clear_cache(self):
+        self.query_cache.clear()
+
+    def cache_nbytes(self):
+        return self.query_cache.nbytes
+
+    def get_in_flight(self):
+        # Queries in flight in the running event loop (their tasks can't be awaited from another one)
+        return self.loop_state().in_flight
+
+    async def query_block(self, query, client):
+        async with self.get_semaphore(): # Limit concurrent tasks (max_concurrency)
+            with tracer.span("influxdb.query"): # Request and CSV parsing
+                block_df = await client.query_api().query_data_frame(query, org=self.org)
 
         if isinstance(block_df, list):
             block_df = pd.concat(block_df, ignore_index=True, sort=False)
 
+        tracer.count("influxdb.queries")
+        tracer.count("influxdb.rows", len(block_df))
+        tracer.count("influxdb.bytes (parsed)", int(block_df.memory_usage(index=False).sum()))
+        return block_df
+
+    async def fetch_block(self, query, client, stop):
+        # From the cache, or from the request of an identical query in flight, or else requested
+        key = QueryCache.key(query)
+        block_df = self.query_cache.get(key)
+        if block_df is not None:
+            tracer.count("influxdb.query cache hits")
+        else:
+            in_flight = self.get_in_flight()
+            if key in in_flight:
+                tracer.count("influxdb.coalesced queries")
+                block_df = await in_flight[key]
+            else:
+                in_flight[key] = asyncio.ensure_future(self.query_block(query, client))
+                try:
+                    block_df = await in_flight[key]
+                finally:
+                    del in_flight[key]
+                self.query_cache.put(key, block_df, immutable=stop < pd.Timestamp.now(tz="UTC") - self.SETTLE_TIME)
+
         return block_df if not block_df.empty else None
 
+    @tracer.timed("influxdb.db_to_df")
     async def db_to_df(self, start: datetime, stop: datetime, avg_window=None, measurement=None):
-        # Divide request in 1h blocks
+        # Divide request in 1h blocks, aligned on the hours so that overlapping requests share their blocks (see query_cache)
         block_duration = timedelta(hours=1)
-        total_duration = stop - start
-        num_blocks = (total_duration // block_duration) + 1
-        current_start = start
+        boundaries = [start]
+        boundary = pd.Timestamp(start).floor(block_duration).to_pydatetime() + block_duration
+        while boundary < stop:
+            boundaries.append(boundary)
+            boundary += block_duration
+        boundaries.append(stop)
 
         # Define measurements to be fetched
         measurement_query = None
@@ -49,12 +118,13 @@ class InfluxDBHandler:
             """.format(str(measurement).replace("\n","").replace("\'","\""))
 
         queries = []
-        for _ in range(num_blocks):
-            current_stop = min(current_start + block_duration, stop)
+        for current_start, current_stop in zip(boundaries[:-1], boundaries[1:]):
+            block_stop = pd.Timestamp(current_stop)
+            if block_stop.tzinfo is None:
+                block_stop = block_stop.tz_localize("UTC")
 
             start_str = current_start.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
             stop_str = current_stop.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-            current_start = current_stop
 
             if start_str == stop_str:
                 continue
@@ -82,13 +152,12 @@ class InfluxDBHandler:
             """
 
             # Create a task for the current block
-            queries.append(query)
-
-        self.semaphore = asyncio.Semaphore(3)
+            queries.append((query, block_stop))
 
         # Run all tasks concurrently
+        from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
         async with InfluxDBClientAsync(url=self.url, token=self.token, org=self.org) as client:
-            tasks = [self.fetch_block(query, client) for query in queries]
+            tasks = [self.fetch_block(query, client, block_stop) for query, block_stop in queries]
             df_list = await tqdm.gather(*tasks, desc="Fetching data")
             # df_list = await asyncio.gather(*tasks)
 
@@ -99,16 +168,11 @@ class InfluxDBHandler:
         if len(df_list) == 0:
             return None
 
-        # Reset state of semaphore, it must be create in the same thread
-        self.semaphore = None
-
-        if not df_list:
-            return None
-
         #  Post-process the DataFrame
-        self.db_df = pd.concat(df_list, ignore_index=True)
-        self.db_df = self.db_df.drop(columns=["result", "table", "_start", "_stop"], errors="ignore")
-        self.db_df["_time"] = pd.to_datetime(self.db_df["_time"].values, utc=True)
-        self.db_df["_time"] = self.db_df["_time"].dt.tz_convert("Europe/Paris")
+        with tracer.span("influxdb.postprocess"):
+            db_df = pd.concat(df_list, ignore_index=True)
+            db_df = db_df.drop(columns=["result", "table", "_start", "_stop"], errors="ignore")
+            db_df["_time"] = pd.to_datetime(db_df["_time"].values, utc=True)
+            db_df["_time"] = db_df["_time"].dt.tz_convert("Europe/Paris")
 
-        return self.db_df
+        return db_df
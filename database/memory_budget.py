@@ -0,0 +1,132 @@
+import itertools
+from datetime import timedelta
+
+from database.multi_source import WILDCARD
+from instrumentation.tracer import tracer
+
+class MemoryBudget:
+    """
+    Memory used by the data of a DataCache, per mode and measurement, and eviction of the least
+    recently used blocks of block_duration (by fetch) beyond max_bytes. The evicted blocks are
+    marked as not cached in the coverage, so they are fetched again when needed. The pinned ranges
+    (e.g. the ADev region) and the range being fetched are never evicted.
+
+    Other memory (e.g. the plot buffers) can be reported in `sources`: it counts in the budget, but
+    is not evicted.
+    max_bytes: 0 for no limit (accounting only)
+    """
+    def __init__(self, cache, max_bytes=0, block_duration=timedelta(hours=1)):
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.block = int(block_duration.total_seconds()*1e9)
+        self.last_access = {} # (mode, measurement label, block start (ns)) -> access counter
+        self.pinned = {} # Name -> (mode, start, stop) (ns)
+        self.sources = {} # Name -> function returning the number of bytes
+        self._clock = itertools.count()
+
+    def clear(self):
+        self.last_access = {}
+
+    def touch(self, mode, measurement_labels, start, stop):
+        # Access to [start, stop] (ns) of some measurements (labels of the coverage)
+        tick = next(self._clock)
+        for label in measurement_labels:
+            for k in range(int(start)//self.block, int(stop)//self.block + 1):
+                self.last_access[(mode, label, k*self.block)] = tick
+
+    def usage(self):
+        # Bytes per part of the memory
+        usage = {mode: store.nbytes for mode, store in self.cache.data.items()}
+        usage["adev (aligned)"] = self.cache.adev_store.nbytes
+        usage["adev (index)"] = self.cache.adev_index.nbytes
+        usage["derived"] = sum(time.nbytes + values.nbytes for _, time, values in self.cache.derived_series.values())
+        for name, nbytes in self.sources.items():
+            usage[name] = nbytes()
+        return usage
+
+    def total(self):
+        return sum(self.usage().values())
+
+    def blocks(self):
+        # Cached blocks (mode, measurement label, start, stop), aligned on block_duration
+        for mode, coverages in self.cache.coverage.items():
+            for label, coverage in coverages.items():
+                for a, b, _ in coverage.intervals:
+                    for k in range(a//self.block, b//self.block + 1):
+                        start, stop = max(a, k*self.block), min(b, (k + 1)*self.block)
+                        if start < stop:
+                            yield mode, label, start, stop
+
+    def is_pinned(self, mode, start, stop, fetching=()):
+        return any(pinned_mode == mode and a <= stop and b >= start for pinned_mode, a, b in list(self.pinned.values()) + list(fetching))
+
+    def measurements_of(self, mode, label):
+        # Measurements of a coverage label ("All", "<source>:*" or a measurement)
+        names = self.cache.data[mode].names
+        if label == "All":
+            return list(names)
+        if label.endswith(WILDCARD):
+            return [name for name in names if name.startswith(label[:-len(WILDCARD)])]
+        return [label]
+
+    def enforce(self, fetching=()):
+        """
+        Evict the least recently used blocks (the ones never accessed, e.g. prefetched, first)
+        until the memory they free covers the excess over max_bytes.
+        fetching: (mode, start, stop) (ns) ranges being fetched, kept as the pinned ones
+        Returns the number of evicted blocks.
+        """
+        # The index tables of data changed since are never used again
+        self.cache.adev_index.drop_stale()
+        if self.max_bytes <= 0:
+            return 0
+        excess = self.total() - self.max_bytes
+        if excess <= 0:
+            return 0
+
+        # The results of the queries and the index tables (built again when needed) duplicate the
+        # cached data, they are dropped first
+        if hasattr(self.cache.handler, "clear_cache"):
+            self.cache.handler.clear_cache()
+        self.cache.adev_index.clear()
+        excess = self.total() - self.max_bytes
+
+        candidates = [block for block in self.blocks() if not self.is_pinned(block[0], block[2], block[3], fetching)]
+        # The blocks accessed together are evicted by time, all the measurements at once, so that
+        # the aligned grid frees their columns
+        def order(block):
+            return self.last_access.get((block[0], block[1], block[2] - block[2] % self.block), -1), block[2], block[0]
+        candidates.sort(key=order)
+
+        evicted = 0
+        updated = set()
+        for _, group in itertools.groupby(candidates, key=order):
+            if excess <= 0:
+                break
+            for mode, label, start, stop in group:
+                excess -= self.evict(mode, label, start, stop)
+                evicted += 1
+                if mode == "adev":
+                    updated.add(label)
+        if updated:
+            self.cache.adev_store.trim()
+
+        tracer.count("cache.evicted blocks", evicted)
+        if self.cache.availability_updated:
+            for label in updated:
+                self.cache.availability_updated(label)
+        return evicted
+
+    def evict(self, mode, label, start, stop):
+        # Returns the number of bytes freed (estimated before the removal)
+        freed = 0
+        with tracer.span("cache.evict"):
+            for measurement in self.measurements_of(mode, label):
+                freed += self.cache.data[mode].nbytes_within(measurement, start, stop)
+                self.cache.data[mode].remove(measurement, start, stop)
+                if mode == "adev":
+                    freed += self.cache.adev_store.nbytes_within(measurement, start/1e9, stop/1e9)
+                    self.cache.adev_store.clear_range(measurement, start/1e9, stop/1e9)
+            self.cache.coverage[mode][label].remove(start, stop)
+            self.last_access.pop((mode, label, start - start % self.block), None)
+        return freed
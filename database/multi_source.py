@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime
+import pandas as pd
+
+from database.influxdb_handler import InfluxDBHandler
+from database.file_sources import open_source
+from utils.file_tools import load_config
+
+# Measurement names of a multi-source configuration are "<source>:<measurement>", and
+# "<source>:*" stands for all the measurements of a source
+SEPARATOR = ":"
+WILDCARD = "*"
+
+def split_name(name):
+    # Source and measurement of a namespaced measurement name
+    source, _, measurement = name.partition(SEPARATOR)
+    return source, measurement
+
+class MultiSourceHandler:
+    """
+    Fetches the data of several sources (InfluxDB servers and/or buckets, data files) with the
+    db_to_df interface of InfluxDBHandler, as one set of namespaced measurements.
+
+    The sources are listed in the configuration file, the InfluxDB ones with their own limit of
+    concurrent queries, the files with a "type" (see file_sources.SOURCE_TYPES):
+        "sources": [
+            {"name": "laser", "url": "...", "token": "...", "org": "...", "bucket": "...", "max_concurrency": 3},
+            {"name": "counter", "type": "raw", "path": "...", "columns": ["time", "frequency"]}
+        ]
+    """
+    def __init__(self, config_path="config/settings.json"):
+        self.config_path = config_path
+        sources = load_config(config_path)["sources"]
+        self.handlers = {source["name"]: create_source(config_path, source) for source in sources}
+        for name in self.handlers:
+            if SEPARATOR in name:
+                raise ValueError("Source name '{}' can't contain '{}'.".format(name, SEPARATOR))
+
+    def clear_cache(self):
+        for handler in self.handlers.values():
+            if hasattr(handler, "clear_cache"):
+                handler.clear_cache()
+
+    def cache_nbytes(self):
+        return sum(handler.cache_nbytes() for handler in self.handlers.values() if hasattr(handler, "cache_nbytes"))
+
+    def expand(self, measurement_list):
+        # "All the measurements" (None) as one request per source, so that each source is cached on its own
+        expanded = []
+        for measurement in measurement_list:
+            if measurement is None:
+                expanded += [source + SEPARATOR + WILDCARD for source in self.handlers]
+            else:
+                expanded.append(measurement)
+        return expanded
+
+    def requests(self, measurement):
+        # Source -> measurements to fetch from it (None for all)
+        if measurement is None:
+            return {source: None for source in self.handlers}
+        if isinstance(measurement, str):
+            measurement = [measurement]
+
+        requests = {}
+        for name in measurement:
+            source, source_measurement = split_name(name)
+            if not source in self.handlers:
+                raise KeyError("Unknown source '{}' (measurement '{}').".format(source, name))
+            if source_measurement == WILDCARD:
+                requests[source] = None
+            elif requests.get(source, []) is not None:
+                requests.setdefault(source, []).append(source_measurement)
+        return requests
+
+    async def db_to_df(self, start: datetime, stop: datetime, avg_window=None, measurement=None):
+        # Query the sources concurrently, each one within its own concurrency limit
+        requests = self.requests(measurement)
+        tasks = [self.handlers[source].db_to_df(start, stop, avg_window=avg_window, measurement=names) for source, names in requests.items()]
+        df_list = await asyncio.gather(*tasks)
+
+        # Namespace the measurements
+        for source, df in zip(requests, df_list):
+            if df is not None:
+                df["_measurement"] = source + SEPARATOR + df["_measurement"].astype(str)
+
+        df_list = [df for df in df_list if df is not None]
+        if not df_list:
+            return None
+        return pd.concat(df_list, ignore_index=True)
+
+def create_source(config_path, source):
+    # Handler of a source of a multi-source configuration
+    if source.get("type", "influxdb") == "influxdb":
+        return InfluxDBHandler(config_path, source)
+    return open_source(source)
+
+def create_handler(config_path="config/settings.json"):
+    # Handler of the sources of a configuration file: several ("sources") or a single one ("influxdb")
+    if "sources" in load_config(config_path):
+        return MultiSourceHandler(config_path)
+    return InfluxDBHandler(config_path)
@@ -0,0 +1,42 @@
+import pandas as pd
+from datetime import timedelta
+
+from database.coverage import Coverage
+from database.multi_source import WILDCARD
+
+def plan_prefetch(cache, requests, max_rows, chunk_duration=timedelta(hours=1)):
+    """
+    Chunks (mode, measurement, start, stop, avg_window) of the requested ranges not cached yet in a
+    DataCache, in the order of the requests and until about max_rows rows (estimated from the
+    avg_window). The chunks are aligned on chunk_duration (the blocks of InfluxDBHandler.db_to_df),
+    the latest first (users usually step backward in time).
+
+    requests: (mode, measurement_list, start, stop, avg_window), as DataCache.fetch
+    """
+    chunks, rows = [], 0
+    for mode, measurement_list, start, stop, avg_window in requests:
+        if hasattr(cache.handler, "expand"):
+            measurement_list = cache.handler.expand(measurement_list)
+        window = avg_window if mode == "adev" else None
+        period = float(avg_window) if avg_window != "" else 1.0
+
+        for measurement in measurement_list:
+            measurement_label = "All" if measurement is None else measurement
+            coverage = cache.coverage.get(mode, {}).get(measurement_label, Coverage())
+
+            # Rows per second (all the measurements of the fetch)
+            n_series = max(len(cache.data["temporal"].names), 1) if measurement is None or measurement.endswith(WILDCARD) else 1
+            rate = n_series/period
+
+            for a, b in reversed(coverage.missing(pd.Timestamp(start).value, pd.Timestamp(stop).value, window)):
+                chunk_stop = pd.Timestamp(b, tz="UTC")
+                while chunk_stop.value > a:
+                    chunk_start = max(chunk_stop.ceil(chunk_duration) - chunk_duration, pd.Timestamp(a, tz="UTC"))
+                    bundled = cache.bundle is not None and cache.bundle.covers(mode, measurement_label, chunk_start.value, chunk_stop.value, window)
+                    if not bundled:
+                        rows += (chunk_stop - chunk_start).total_seconds()*rate
+                        if rows > max_rows:
+                            return chunks
+                        chunks.append((mode, measurement, chunk_start, chunk_stop, avg_window))
+                    chunk_stop = chunk_start
+    return chunks
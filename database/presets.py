@@ -0,0 +1,118 @@
+import os
+import numpy as np
+import pandas as pd
+
+from database.coverage import Coverage
+from database.multi_source import SEPARATOR, WILDCARD
+from utils.file_tools import json_file_to_dict, dict_to_json_file
+
+def read_table(preset_name, presets_dir="presets"):
+    # Table of measurements of a preset
+    table_df = pd.read_json(f"{presets_dir}/{preset_name}.json", dtype=str)
+
+    # Convert plot visibility columns to boolean
+    for col in ["Plot_temp", "Plot_adev"]:
+        table_df[col] = table_df[col].map({'True': np.bool_(True), 'False': np.bool_(False)})
+
+    # Expressions of the derived measurements (none in the presets saved before them)
+    table_df["Expression"] = table_df["Expression"].fillna("") if "Expression" in table_df else ""
+
+    return table_df
+
+def read_tree(preset_name, presets_dir="presets"):
+    # Saved state of the parameter tree of a preset
+    return json_file_to_dict(f"{presets_dir}/{preset_name}_tree.json")
+
+def tree_value(state, *path, default=None):
+    # Value of a parameter in a saved parameter tree state, e.g. tree_value(state, "Data acquisition", "Start")
+    try:
+        for name in path:
+            state = state["children"][name]
+        return state["value"]
+    except KeyError:
+        return default
+
+# Version of the format of the cached data saved with the presets
+BUNDLE_VERSION = 1
+
+def bundle_dir(preset_name, presets_dir="presets"):
+    return f"{presets_dir}/cache/{preset_name}"
+
+def save_bundle(cache, preset_name, presets_dir="presets"):
+    """
+    Save the cached data of a preset as a bundle: one zstd-compressed Parquet file per mode
+    (sorted by measurement then time, so that reading a measurement and a range only needs a few
+    row groups), and a manifest with the format version and the fetched ranges (intervals).
+    """
+    directory = bundle_dir(preset_name, presets_dir)
+    os.makedirs(directory, exist_ok=True)
+
+    manifest = {"version": BUNDLE_VERSION, "modes": {}}
+    for mode, store in cache.data.items():
+        if store.empty:
+            continue
+        filename = mode + ".parquet"
+        df = store.frame(tz="UTC")
+        df["_measurement"] = df["_measurement"].astype("category")
+        df.to_parquet(os.path.join(directory, filename), compression="zstd", index=False, row_group_size=2**16)
+
+        manifest["modes"][mode] = {
+            "file": filename,
+            "measurements": store.names,
+            "coverage": {label: coverage.to_list() for label, coverage in cache.coverage.get(mode, {}).items()},
+            }
+    dict_to_json_file(manifest, os.path.join(directory, "manifest.json"))
+
+class PresetBundle:
+    """
+    Cached data saved with a preset (see save_bundle), read on demand.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest = json_file_to_dict(os.path.join(directory, "manifest.json"))
+        if self.manifest.get("version", 0) > BUNDLE_VERSION:
+            raise ValueError("Preset cache '{}' has a newer format (version {}).".format(directory, self.manifest["version"]))
+
+        self.coverage = {
+            mode: {label: Coverage(intervals) for label, intervals in content["coverage"].items()}
+            for mode, content in self.manifest["modes"].items()
+            }
+
+    @classmethod
+    def open(cls, preset_name, presets_dir="presets"):
+        # Bundle of a preset, or None if it doesn't have one
+        directory = bundle_dir(preset_name, presets_dir)
+        if not os.path.exists(os.path.join(directory, "manifest.json")):
+            return None
+        return cls(directory)
+
+    def covers(self, mode, measurement_label, start, stop, avg_window=None):
+        coverage = self.coverage.get(mode, {}).get(measurement_label)
+        return coverage is not None and coverage.covers(start, stop, avg_window)
+
+    def read(self, mode, measurement, start, stop):
+        # Data of a measurement (None for all, "<source>:*" for all the ones of a source) within [start, stop] (ns), as fetched from the database
+        filters = [("_time", ">=", pd.Timestamp(start, tz="UTC")), ("_time", "<=", pd.Timestamp(stop, tz="UTC"))]
+        if measurement is not None and measurement.endswith(SEPARATOR + WILDCARD):
+            prefix = measurement[:-len(WILDCARD)]
+            filters.append(("_measurement", "in", [name for name in self.manifest["modes"][mode]["measurements"] if name.startswith(prefix)]))
+        elif measurement is not None:
+            filters.append(("_measurement", "==", measurement))
+
+        filename = os.path.join(self.directory, self.manifest["modes"][mode]["file"])
+        df = pd.read_parquet(filename, filters=filters)
+        if df.empty:
+            return None
+        df["_measurement"] = df["_measurement"].astype(str)
+        df["_time"] = df["_time"].dt.tz_convert("Europe/Paris")
+        return df
+
+    def iter_read(self, mode, measurement, start, stop, batch_size=2**20):
+        # Time (s) and values of a measurement within [start, stop] (ns), by batches (only the row groups needed are read)
+        import pyarrow.dataset as ds
+        filename = os.path.join(self.directory, self.manifest["modes"][mode]["file"])
+        condition = (ds.field("_measurement") == measurement) & (ds.field("_time") >= pd.Timestamp(start, tz="UTC")) & (ds.field("_time") <= pd.Timestamp(stop, tz="UTC"))
+        for batch in ds.dataset(filename).to_batches(columns=["_time", "value"], filter=condition, batch_size=batch_size):
+            if batch.num_rows:
+                time = batch.column("_time").cast("int64").to_numpy()/1e9
+                yield time, batch.column("value").to_numpy(zero_copy_only=False)
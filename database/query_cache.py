@@ -0,0 +1,58 @@
+import threading
+import time
+from collections import OrderedDict
+
+class QueryCache:
+    """
+    Results (dataframes) of Flux queries, keyed by the normalized query text, within a memory
+    budget: the least recently used results are dropped first. The results of ranges entirely in
+    the past don't change and are kept until dropped, the others (still receiving data) expire
+    after live_ttl seconds. Thread-safe (e.g. shared by the GUI and the prefetcher).
+    """
+    def __init__(self, max_bytes=256*2**20, live_ttl=10.0):
+        self.max_bytes = max_bytes
+        self.live_ttl = live_ttl
+        self.entries = OrderedDict() # Key -> (result, nbytes, expiry or None)
+        self.nbytes = 0
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def key(query):
+        # Query text without the formatting (indentation, line breaks)
+        return " ".join(query.split())
+
+    def get(self, key):
+        # Cached result, or None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            result, _, expiry = entry
+            if expiry is not None and time.monotonic() > expiry:
+                self.pop(key)
+                return None
+            self.entries.move_to_end(key)
+            return result
+
+    def put(self, key, result, immutable=False):
+        nbytes = int(result.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        with self.lock:
+            self.pop(key)
+            while self.entries and self.nbytes + nbytes > self.max_bytes:
+                self.pop(next(iter(self.entries)))
+
+            self.entries[key] = (result, nbytes, None if immutable else time.monotonic() + self.live_ttl)
+            self.nbytes += nbytes
+
+    def pop(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.nbytes -= entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.nbytes = 0
@@ -0,0 +1,106 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+class Tracer:
+    """
+    Lightweight timing spans and counters of the hot paths.
+
+    Each span updates the statistics of its name (count, total, max, last duration) and is
+    kept in a bounded event buffer, which can be saved in the Chrome trace format
+    (chrome://tracing, https://ui.perfetto.dev) for offline analysis.
+    """
+    def __init__(self, max_events=100000):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._counters = {}
+        self._events = deque(maxlen=max_events)
+        self._t0 = time.perf_counter_ns()
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+            self._events.clear()
+
+    def _record(self, name, start, stop, args):
+        duration = (stop - start)/1e9
+        with self._lock:
+            stats = self._spans.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0})
+            stats["count"] += 1
+            stats["total"] += duration
+            stats["max"] = max(stats["max"], duration)
+            stats["last"] = duration
+            self._events.append((name, start, stop, threading.get_ident(), args))
+
+    @contextmanager
+    def span(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self._record(name, start, time.perf_counter_ns(), args)
+
+    def timed(self, name):
+        # Decorator recording a span for each call (functions and coroutines)
+        def decorator(function):
+            if inspect.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return await function(*args, **kwargs)
+            else:
+                @functools.wraps(function)
+                def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def stats(self):
+        # Snapshot of the span statistics and of the counters
+        with self._lock:
+            spans = {name: dict(stats) for name, stats in self._spans.items()}
+            counters = dict(self._counters)
+        return spans, counters
+
+    def save_chrome_trace(self, filename):
+        with self._lock:
+            events = list(self._events)
+            counters = dict(self._counters)
+
+        pid = os.getpid()
+        trace = [
+            {
+                "name": name,
+                "ph": "X", # Complete event
+                "ts": (start - self._t0)/1e3, # us
+                "dur": (stop - start)/1e3,
+                "pid": pid,
+                "tid": tid,
+                "args": {key: str(value) for key, value in args.items()},
+            }
+            for name, start, stop, tid, args in events
+        ]
+        trace.append({"name": "counters", "ph": "C", "ts": (time.perf_counter_ns() - self._t0)/1e3, "pid": pid, "args": counters})
+
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+# Shared instance
+tracer = Tracer()
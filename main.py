@@ -1,8 +1,26 @@
 from PyQt5.QtWidgets import QApplication, QDesktopWidget
 from ui.main_window import MainWindow
-from database.influxdb_handler import InfluxDBHandler
+from database.multi_source import create_handler
+from utils.file_tools import load_config
+import threading
 import sys
 
+def warm_up():
+    # Import the modules loaded on first use (slow to import), before they are needed
+    import allantools
+    import influxdb_client.client.influxdb_client_async
+
+def create_window():
+    # Start database handles (the connection is opened on first use)
+    app_settings = load_config("config/settings.json").get("app_settings", {})
+    if app_settings.get("cache_daemon") == "True":
+        # Data shared with the other instances, through the local cache daemon
+        from database.cache_daemon import connect, DEFAULT_PORT
+        influxdb = connect(port=int(app_settings.get("cache_daemon_port", DEFAULT_PORT)))
+    else:
+        influxdb = create_handler()
+    return MainWindow(influxdb)
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
 
@@ -11,9 +29,7 @@ if __name__ == "__main__":
     screen_count = desktop.screenCount()
     print("Screen count: ", screen_count)
 
-    # Start database handles
-    influxdb = InfluxDBHandler()
-    window = MainWindow(influxdb)
+    window = create_window()
     if screen_count > 1:
         screen_rect = desktop.screenGeometry(1) # Open on left screen
         window.move(screen_rect.left(),screen_rect.top())
@@ -26,4 +42,7 @@ if __name__ == "__main__":
         window.show()
     #
 
+    # Load the slow modules in the background, once the window is shown
+    threading.Thread(target=warm_up, daemon=True).start()
+
     sys.exit(app.exec_())
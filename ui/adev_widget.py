@@ -2,6 +2,8 @@ import pyqtgraph as pg
 import numpy as np
 from PyQt5.QtCore import pyqtSignal
 
+from instrumentation.tracer import tracer
+
 class AllanDeviationWidget(pg.GraphicsLayoutWidget):
     update_table = pyqtSignal(object)
 
@@ -21,6 +23,7 @@ class AllanDeviationWidget(pg.GraphicsLayoutWidget):
 
         self.plots = {}
 
+    @tracer.timed("ui.adev.updateWidget")
     def updateWidget(self, taus, devs, error_bars, title, color):
         taus_log10 = np.log10(taus)
         devs_log10 = np.log10(devs)
@@ -69,6 +72,14 @@ class AllanDeviationWidget(pg.GraphicsLayoutWidget):
 
         self.updateErrorBarVisibility(self.plots[title])
 
+    def removeWidget(self, title):
+        plot = self.plots.pop(title, None)
+        if plot is None:
+            return
+
+        for item in [plot["data"], plot["error_bars"], plot["fill_between"], *plot["fill_between"].curves]:
+            self.adev_widget.removeItem(item)
+
     def updateErrorBarVisibility(self, plot):
         """Update the visibility of the error bars based on the visibility of the curve."""
 
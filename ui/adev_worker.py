@@ -0,0 +1,36 @@
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from data_processing.adev_index import AdevIndex, TauSums
+from data_processing.allan_deviation import get_stab
+
+class AdevWorker(QThread):
+    """
+    Refines the Allan deviation in the background, one measurement at a time.
+
+    For the modes of AdevIndex, builds the index table of each measurement (the ADev of any
+    region is then immediate): jobs are (measurement, version, time, values) of all its valid
+    samples, and the results (version, TauSums). Otherwise computes the ADev of the region: jobs
+    are (measurement, None, time, values) of the region, and the results as get_stab.
+    """
+    result_ready = pyqtSignal(int, str, str, object) # Generation, mode, measurement, result
+
+    def __init__(self, generation, mode, jobs):
+        super().__init__()
+        self.generation = generation
+        self.mode = mode
+        self.jobs = jobs
+        self.cancelled = False
+
+    def cancel(self):
+        # Stop after the current measurement
+        self.cancelled = True
+
+    def run(self):
+        for measurement, version, time, values in self.jobs:
+            if self.cancelled:
+                return
+            if self.mode in AdevIndex.MODES:
+                result = (version, TauSums(time, values, self.mode))
+            else:
+                result = get_stab(time, values, self.mode)
+            self.result_ready.emit(self.generation, self.mode, measurement, result)
@@ -1,39 +1,82 @@
 from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QSplitter, QWidget, QSizePolicy, QScrollArea, QInputDialog
+from PyQt5.QtCore import QTimer
 import pyqtgraph as pg
 from pyqtgraph.dockarea import *
 import numpy as np
-
 import pandas as pd
-pd.set_option("compute.use_numexpr", False)
 
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 import copy
 import os
-from scipy.stats import linregress
 from tqdm import tqdm
-from datemath import datemath
-import re
-import asyncio
 
 from ui.parameter_tree import ParameterTreeWidget
 from ui.temporal_widget import TemporalWidget
 from ui.adev_widget import AllanDeviationWidget
 from ui.table_widget import DataTableWidget
+from ui.performance_widget import PerformanceWidget
+from ui.adev_worker import AdevWorker
+from ui.psd_widget import PsdWidget
+from ui.psd_worker import PsdWorker
+from ui.prefetch_worker import PrefetchWorker
 from database.influxdb_handler import InfluxDBHandler
+from database.data_cache import DataCache
+from database.presets import read_table, read_tree, save_bundle, PresetBundle
+from database.coverage import Coverage
+from database.prefetch import plan_prefetch
 from data_processing.moving_average import moving_average
-from data_processing.allan_deviation import get_stab
-from data_processing.utils import resample_data
+from data_processing.pipeline import iter_adev, iter_coarse_adev, compute_budget, coupling_coefficient, fractional_factor, store_region, table_scale, BUDGET_QUADRATURE, BUDGET_RESIDUAL
+from data_processing.adev_index import AdevIndex
+from data_processing.psd import PsdCache, log_average
+from data_processing.derived import Expression
+from data_processing import kernels
+from data_processing.utils import resample_data, string_to_date, date_math
 from utils.file_tools import *
+from instrumentation.tracer import tracer
 
 class MainWindow(QMainWindow):
     def __init__(self, influxdb: InfluxDBHandler):
         super().__init__()
 
         self.influxdb = influxdb
-        self.influxdb_data_temp = None
-        self.influxdb_data_adev = None
-        self.data_avail_dct = {}
+
+        # Optional settings of the application
+        app_settings = load_config("config/settings.json").get("app_settings", {})
+        self.trace_file = app_settings.get("trace_file")
+        kernels.set_backend(app_settings.get("kernels", "auto"))
+
+        # Fetched data and its availability, within the memory budget (0: no limit)
+        max_bytes = int(float(app_settings.get("memory_budget_mb", 0))*2**20)
+        self.cache = DataCache(influxdb, precision=app_settings.get("storage_precision"), max_bytes=max_bytes)
+
+        # Extra curves of the budget mode
+        self.budget_titles = [BUDGET_QUADRATURE, BUDGET_RESIDUAL]
+
+        # Background refinement of the progressive ADev (see update_adev_progressive)
+        self.adev_workers = []
+        self.adev_generation = 0 # Incremented by each ADev request, older results are dropped
+        self.adev_request = None # (measurement_list, start, stop, mode) being refined
+        self.adev_building = {} # (measurement, mode) -> version of the index table being built
+
+        # Spectra of the ADev region, computed in the background (see update_psd_plot)
+        self.psd_cache = PsdCache(self.cache.adev_store)
+        self.psd_workers = []
+        self.psd_generation = 0 # Incremented by each PSD request, older results are only cached
+
+        # Data fetched in the background when the application is idle (see start_prefetch)
+        self.prefetch_rows = int(float(app_settings.get("prefetch_rows", 1e6))) # Row budget per idle period, 0 disables it
+        self.prefetch_workers = []
+        self.prefetch_generation = 0 # Incremented by each user fetch, older prefetched data is dropped
+        self.temporal_request = None # (start, stop, avg_window) of the last data acquisition
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(int(float(app_settings.get("prefetch_idle_seconds", 2))*1000))
+        self.prefetch_timer.timeout.connect(self.start_prefetch)
+
+        # Reusable output buffers for the moving average (one per measurement)
+        self.avg_buffers = {}
+        self.plot_dtype = np.dtype(app_settings.get("plot_precision", "float64"))
 
         self.setWindowTitle("StabilityFusion - by: Carlos RIVERA")
 
@@ -48,7 +91,7 @@ class MainWindow(QMainWindow):
 
         # Temporal traces
         dock_temp_plot = Dock("Temporal traces", size=(200, 400))
-        self.temp_widget = TemporalWidget()
+        self.temp_widget = TemporalWidget(buffer_size=int(app_settings.get("plot_buffer_size", 200000)), dtype=self.plot_dtype)
         dock_temp_plot.addWidget(self.temp_widget)
 
         # Allan deviation
@@ -56,10 +99,15 @@ class MainWindow(QMainWindow):
         self.adev_widget = AllanDeviationWidget()
         dock_adev_plot.addWidget(self.adev_widget)
 
+        # Power spectral density (of the ADev region)
+        dock_psd_plot = Dock("Power spectral density", size=(200, 400))
+        self.psd_widget = PsdWidget()
+        dock_psd_plot.addWidget(self.psd_widget)
+
         # Column headers
         columns = [
             "Main", "Name", "Description", "Coeff_",
-            "Fractional_", "Plot_temp", "Plot_adev"
+            "Fractional_", "Plot_temp", "Plot_adev", "Expression"
         ]
 
         # Create an empty dataframe with only column headers
@@ -70,24 +118,42 @@ class MainWindow(QMainWindow):
         self.data_table_widget.dataframe_updated.connect(self.handle_dataframe_update)
         dock_table.addWidget(self.data_table_widget)
 
+        # Performance (timing of the data path)
+        dock_performance = Dock("Performance", size=(200, 100))
+        self.performance_widget = PerformanceWidget(budget=self.cache.budget)
+        dock_performance.addWidget(self.performance_widget)
+
         # Combine docks
         area.addDock(dock_params,'left')
         area.addDock(dock_temp_plot,'right')
         area.addDock(dock_adev_plot,'right')
+        area.addDock(dock_psd_plot,'above',dock_adev_plot)
+        dock_adev_plot.raiseDock()
         area.addDock(dock_table,'bottom')
+        area.addDock(dock_performance,'above',dock_table)
+        dock_table.raiseDock()
 
         # Connect signals
         self.adev_widget.update_table.connect(self.update_adev_visibility)
         self.temp_widget.region_updated.connect(self.link_regions)
+        self.cache.availability_updated = self.update_availability_plot
+        self.cache.fetch_started = self.preempt_prefetch
+
+        # Memory counted in the budget, besides the cached data
+        self.cache.budget.sources["plot buffers"] = self.plot_buffers_nbytes
+        self.cache.budget.sources["spectra"] = lambda: sum(freqs.nbytes + psd.nbytes for freqs, psd in self.psd_cache.entries.values())
+        if hasattr(influxdb, "cache_nbytes"):
+            self.cache.budget.sources["query cache"] = influxdb.cache_nbytes
         self.data_table_widget.auto_value_request.connect(self.compute_auto_value)
         self.param_tree.param.sigTreeStateChanged.connect(self.param_change)
 
-        # Populate presets combobox
-        self.populate_presets()
+        # Populate presets combobox (once the window is shown)
+        QTimer.singleShot(0, self.populate_presets)
 
     def param_change(self, params, changes):
         if self.param_tree.params_changing:
             return
+        self.prefetch_timer.start() # Restarted by each user action
 
         param = changes[0][0]
         data = changes[0][2]
@@ -104,9 +170,9 @@ class MainWindow(QMainWindow):
                 self.update_adev_plot()
 
         if param.name() == 'Clear data':
-            self.influxdb_data_temp = None
-            self.influxdb_data_adev = None
-            self.data_avail_dct = {}
+            self.preempt_prefetch()
+            self.cache.clear()
+            self.avg_buffers = {}
 
         # Data processing
         if param.name() == 'Moving Average':
@@ -122,8 +188,11 @@ class MainWindow(QMainWindow):
             if param.name() in ["Start", "Stop", "Region size"]:
                 self.link_regions(param)
 
+        if param.parent().name() == 'Power spectral density':
+            self.update_psd_plot()
+
         # Allan deviation plot settings
-        if param.name() == "Error bars":
+        if param.name() in ["Error bars", "Budget"]:
             self.update_adev_plot()
 
         # Global settings
@@ -141,8 +210,18 @@ class MainWindow(QMainWindow):
                 [plots[key][plot_content].setVisible(False) for key in plots.keys()]
                 self.table_df[table_col] = False
 
+            # Render the temporal plots shown
+            if plot_type == "Temporal":
+                self.temp_widget.flush()
+
             self.update_table()
 
+        if param.parent().name() == 'Derived measurement':
+            if param.name() == 'Add':
+                self.add_derived()
+            if param.name() == 'Remove':
+                self.remove_derived()
+
         if param.parent().name() == 'Global coefficient' and param.name() == 'Apply':
             coeff_type = self.param_tree.param.child('Global settings','Global coefficient','Type').value()
             col_name = 'Coeff_' if coeff_type == 'Coupling' else 'Fractional_'
@@ -166,152 +245,34 @@ class MainWindow(QMainWindow):
             if param.name() == 'Remove':
                 self.remove_preset()
 
-    def string_to_date(self, date_str):
-        # From string to local timezone
-        dt = datetime.fromisoformat(date_str).replace(tzinfo=ZoneInfo("Europe/Paris"))
-        # From local datetime to UTC
-        dt = dt.astimezone(ZoneInfo("UTC"))
-        return dt
-
-    def date_math(self, param):
-        if any([val in param for val in ['y', 'Y', 'M', 'm', 'd', 'D', 'w', 'h', 'H', 's', 'S', 'now']]):
-            param = str(
-                datemath(param)
-                    .astimezone(ZoneInfo("Europe/Paris")) # From UTC to Paris
-                    .strftime("%Y-%m-%dT%H:%M:%S") # From datetime to string
-                )
-        return param
-
-    def smart_fetch(self, start: datetime, end: datetime, measurement_list, avg_window, mode, main_df):
-        # Helper functions
-        def extend_limits(start,end):
-            # Extend the range and round to the nearest hour
-            adjusted_start = (start - pd.Timedelta(minutes=60)).replace(minute=0, second=0, microsecond=0)
-            adjusted_end = (end + pd.Timedelta(minutes=60)).replace(minute=0, second=0, microsecond=0)
-            return adjusted_start, adjusted_end
-
-        def create_avail_df(start,end):
-            df = pd.DataFrame(
-                {
-                    'time': pd.date_range(start=start, end=end, freq='1s'),
-                    'cached': False,
-                    'avg_window': ""
-                })
-            return df
-
-        def extend_avail_df(start, end, existing_df):
-            # Create the new DataFrame
-            new_df = create_avail_df(start, end)
-
-            # Filter out rows from new_df where 'time' already exists in existing_df
-            new_df = new_df[~new_df['time'].isin(existing_df['time'])]
-
-            # Concatenate and return the updated DataFrame
-            updated_df = pd.concat([existing_df, new_df], ignore_index=True)
-            updated_df = updated_df.sort_values(by='time').reset_index(drop=True)
-
-            return updated_df
-
-        def range_between_df(start,end,df):
-            return all(create_avail_df(start, end)['time'].between(df['time'].min(),df['time'].max()))
-
-        # Create dictionary per mode and measurement
-        if not mode in self.data_avail_dct.keys():
-            self.data_avail_dct[mode] = {}
-
-        for measurement in (pbar := tqdm(measurement_list)):
-            # Add measurement to the dictionary if it doesn't exist
-            measurement_label = "All" if measurement is None else measurement # Assign name "All" for dictionary when fetching all the measurements
-            if not measurement_label in self.data_avail_dct[mode].keys():
-                adjusted_start, adjusted_end = extend_limits(start,end)
-                self.data_avail_dct[mode][measurement_label] = create_avail_df(adjusted_start,adjusted_end)
-
-            # Define dataframes shorter name
-            df_avail = self.data_avail_dct[mode][measurement_label].sort_values(by='time')
-
-            # Is the requested range within the dataframe limits? if not, extend the dataframe.
-            extend_start, extend_end = start, end
-            if not range_between_df(extend_start, extend_end, df_avail):
-                extend_start, extend_end = extend_limits(extend_start,extend_end)
-                df_avail = extend_avail_df(extend_start, extend_end, df_avail)
-
-            # Is the requested range marked as cached?
-            # If the mode is adev, check also if the avg_window size has changed
-            if mode == "adev":
-                not_cached = df_avail.query("time >= @start and time <= @end and (cached == False or avg_window != @avg_window)")
-                avg_window_changed = any(df_avail.query("time >= @start and time <= @end and avg_window != @avg_window"))
-            else:
-                not_cached = df_avail.query("time >= @start and time <= @end and cached == False")
-                avg_window_changed = False
-
-
-            pbar.set_description("Using cached data for '{}'.".format(measurement_label))
-            if not not_cached.empty:
-                pbar.set_description("Fetching '{}' data.".format(measurement_label))
-
-                # Fetch missing data
-                fetch_start = not_cached['time'].iloc[0] - timedelta(seconds=5)
-                fetch_stop = not_cached['time'].iloc[-1] + timedelta(seconds=5)
-
-                avg_window_fetch = int(avg_window) if not avg_window == "" else None
-
-                new_df = asyncio.run(self.influxdb.db_to_df(fetch_start, fetch_stop, measurement=measurement, avg_window=avg_window_fetch))
-
-                # If the avg_window has changed for the region, drop old data
-                if avg_window_changed and not (main_df is None):
-                    rows_to_drop = main_df.query("_measurement == @measurement and _time >= @fetch_start and _time <= @fetch_stop").index
-                    if not rows_to_drop.empty:
-                        main_df.drop(rows_to_drop, inplace=True)
-
-                main_df = pd.concat([main_df, new_df], ignore_index=True).sort_values(by='_time')
-
-                # Mark the region as saved
-                df_avail.loc[df_avail.query("time>=@fetch_start and time<=@fetch_stop")["time"].index,['cached','avg_window']] = [True, str(avg_window)]
-
-            # Save changes to dictionary
-            self.data_avail_dct[mode][measurement_label] = df_avail
-
-            # If the mode is "adev", plot availability
-            if mode == "adev":
-                self.update_availability_plot(measurement)
-
-        return main_df
-
     def get_param_dt_limits(self):
         start = self.param_tree.param.child("Data acquisition", "Start").value()
         stop = self.param_tree.param.child("Data acquisition", "Stop").value()
 
         # Process natural language date information
-        start = self.date_math(start)
-        stop = self.date_math(stop)
+        start = date_math(start)
+        stop = date_math(stop)
         #
 
         # String to datetime
-        start = self.string_to_date(start)
-        stop = self.string_to_date(stop)
+        start = string_to_date(start)
+        stop = string_to_date(stop)
         #
         return start, stop
 
     def get_temporal_data(self):
-        influx_df = self.influxdb_data_temp
-
         start, stop = self.get_param_dt_limits()
 
         # Calculate moving average window
         avg_window = max(int((stop.timestamp()-start.timestamp())/1000), 1)
         #
         measurement_list = [None] # Fetch all available measurements
-        influx_df = self.smart_fetch(start, stop, measurement_list, avg_window, "temporal", influx_df)
-
-        # Sort by measurement name (Natural sorting function)
-        def natural_sort(series):
-            convert = lambda text: int(text) if text.isdigit() else text.lower()
-            alphanum_key = lambda key: [convert(c) for c in re.split('([0-9]+)', key)]
-            return series.map(lambda x: tuple(alphanum_key(x)))
-        influx_df = influx_df.sort_values(by="_measurement", key=natural_sort)
+        self.cache.budget.pinned["Acquisition range"] = ("temporal", pd.Timestamp(start).value, pd.Timestamp(stop).value)
+        store = self.cache.fetch(start, stop, measurement_list, avg_window, "temporal")
+        self.temporal_request = (start, stop, avg_window)
 
-        # Populate table measurements
-        measurements = influx_df["_measurement"].unique()
+        # Populate table measurements (in natural order)
+        measurements = store.names
 
         for i, measurement in enumerate(measurements):
             # Check if row exists
@@ -326,10 +287,9 @@ class MainWindow(QMainWindow):
                 "1", # Fractional_
                 True, # Plot_temp
                 True if i == 0 else False, # Plot_adev (first one is visible)
+                "", # Expression (derived measurements only)
                 ]
 
-        self.influxdb_data_temp = influx_df
-
     def autoset_region(self):
         # Available data (temporal plot)
         start, stop = self.get_param_dt_limits()
@@ -341,7 +301,7 @@ class MainWindow(QMainWindow):
         start_param = self.param_tree.param.child("Data processing", "Allan deviation", "Start")
 
         # Only auto-set if the region is currently outside the limits of the fetched data
-        region = list(self.temp_widget.plots.values())[0]['region'].getRegion()
+        region = self.temp_widget.region
         region_start = region[0]
         region_stop = region[1]
 
@@ -381,6 +341,7 @@ class MainWindow(QMainWindow):
     def link_regions(self, sender):
         if self.param_tree.params_changing:
             return
+        self.prefetch_timer.start()
 
         self.param_tree.params_changing = True
 
@@ -397,9 +358,8 @@ class MainWindow(QMainWindow):
 
             new_region = [value.timestamp() for value in [start,stop]]
 
-        # Update all regions
-        for key, plot in self.temp_widget.plots.items():
-            plot["region"].setRegion(new_region)
+        # Update the shared region (only the visible plots are redrawn)
+        self.temp_widget.set_region(new_region, sender)
 
         # Update parameter tree
         start, stop = [datetime.fromtimestamp(value) for value in new_region]
@@ -413,24 +373,18 @@ class MainWindow(QMainWindow):
         if self.param_tree.param.child("Data processing", "Allan deviation", "Auto calculate").value():
             self.update_adev_plot()
 
+    @tracer.timed("ui.update_temporal_plot")
     def update_temporal_plot(self):
         moving_avg_window = self.param_tree.param.child("Data processing", "Moving Average").value()
-        df = self.influxdb_data_temp
+        store = self.cache.data["temporal"]
         first_plot = None
 
-        measurements = df["_measurement"].unique()
-
-        for measurement in measurements:
-            measurement_df = df[df["_measurement"] == measurement]
-
-            time = pd.to_datetime(measurement_df["_time"]).to_numpy()
-            time = np.array([ts.timestamp() for ts in time])
-            value = measurement_df["value"].to_numpy()
-
-            # Sort by timestamp
-            arg_sort = np.argsort(time)
-            time = time[arg_sort]
-            value = value[arg_sort]
+        for measurement in store.names + list(self.cache.derived):
+            # Sorted by timestamp
+            time, value = self.cache.series("temporal", measurement)
+            if len(time) < 2:
+                continue # Derived measurement without its inputs
+            time = time/1e9
 
             # Resample data to 1s
             if np.mean(np.diff(time)) < 1:
@@ -440,8 +394,8 @@ class MainWindow(QMainWindow):
                 resample_value = value
 
             ## Temporal
-            # Apply moving average
-            avg_value = moving_average(resample_value, moving_avg_window)
+            # Apply moving average (window in seconds)
+            avg_value = moving_average(resample_value, moving_avg_window, time=resample_time, out=self.avg_buffer(measurement, len(resample_value)))
             #
 
             plot = self.temp_widget.updateWidget(resample_time,avg_value,measurement)
@@ -449,16 +403,25 @@ class MainWindow(QMainWindow):
             # Link x-axis
             plot["widget"].setXLink(self.temp_widget.coverage_widget)
 
-    def update_availability_plot(self, measurement):
-        df_avail = self.data_avail_dct['adev'][measurement]
+    def plot_buffers_nbytes(self):
+        return sum(plot["buffer"].nbytes for plot in self.temp_widget.plots.values()) + sum(buffer.nbytes for buffer in self.avg_buffers.values())
+
+    def avg_buffer(self, measurement, size):
+        # Grow the buffer geometrically, so it is reallocated only a few times
+        buffer = self.avg_buffers.get(measurement)
+        if buffer is None or len(buffer) < size:
+            buffer = np.empty(max(size, 2*len(buffer) if buffer is not None else size), dtype=self.plot_dtype)
+            self.avg_buffers[measurement] = buffer
+        return buffer[:size]
 
-        x = (df_avail['time'].astype('int64')/1e9).to_numpy()
-        y = df_avail['cached'].to_numpy()
+    def update_availability_plot(self, measurement):
+        x, y = self.cache.coverage['adev'][measurement].plot_data()
         self.temp_widget.update_availability_plot(x, y, measurement)
 
+    @tracer.timed("ui.update_adev_plot")
     def update_adev_plot(self, measurement=None):
-        start = self.string_to_date(self.param_tree.param.child("Data processing", "Allan deviation", "Start").value())
-        stop = self.string_to_date(self.param_tree.param.child("Data processing", "Allan deviation", "Stop").value())
+        start = string_to_date(self.param_tree.param.child("Data processing", "Allan deviation", "Start").value())
+        stop = string_to_date(self.param_tree.param.child("Data processing", "Allan deviation", "Stop").value())
 
         # Fetch and calculate only visible
         measurement_list = self.table_df.query(f"Plot_adev == True")['Name'].to_list() if measurement is None else measurement
@@ -467,55 +430,251 @@ class MainWindow(QMainWindow):
             measurement_list = [measurement_list]
 
         avg_window = self.param_tree.param.child('Data processing', 'Allan deviation', 'Initial tau (s)').value()
-        df = self.influxdb_data_adev
 
-        df = self.smart_fetch(start, stop, measurement_list, avg_window, "adev", df)
-        self.influxdb_data_adev = df
+        self.cancel_adev_refinement()
+        self.cache.budget.pinned["ADev region"] = ("adev", pd.Timestamp(start).value, pd.Timestamp(stop).value)
+        self.cache.fetch(start, stop, measurement_list, avg_window, "adev")
 
         # Use timestamp
         start = start.timestamp()
         stop = stop.timestamp()
 
-        for measurement in (pbar := tqdm(measurement_list)):
-            pbar.set_description("Calculating ADev for '{}'.".format(measurement))
+        self.update_psd_plot(measurement_list, start, stop)
+
+        # Calculate Allan deviation
+        mode = self.param_tree.param.child("Data processing", "Allan deviation", "Mode").value().lower()
 
-            measurement_df = df[df["_measurement"] == measurement]
+        # Plot settings
+        self.adev_widget.error_bar_mode = self.param_tree.param.child("Allan deviation plot settings", "Error bars").value()
 
-            ## Allan deviation
-            time = pd.to_datetime(measurement_df["_time"]).to_numpy()
-            time = np.array([ts.timestamp() for ts in time])
-            value = measurement_df["value"].to_numpy()
+        # Budget mode computes all the contributions at once
+        if self.param_tree.param.child("Allan deviation plot settings", "Budget").value():
+            self.update_budget_plot(start, stop, avg_window, mode)
+            return
 
-            # Sort by timestamp
-            arg_sort = np.argsort(time)
-            time = time[arg_sort]
-            value = value[arg_sort]
+        for title in self.budget_titles:
+            self.adev_widget.removeWidget(title)
 
-            region = np.where((time > start) & (time < stop))
-            if np.size(region) == 0:
-                region = np.arange(len(time))
+        if self.param_tree.param.child("Data processing", "Allan deviation", "Progressive").value():
+            self.update_adev_progressive(measurement_list, start, stop, mode)
+            return
 
-            if self.temp_widget.color_dct.get(measurement):
-                color = self.temp_widget.color_dct[measurement]
+        adev_results = iter_adev(self.cache.adev_store, self.table_df, measurement_list, start, stop, mode, index=self.cache.adev_index)
+        for measurement, result in (pbar := tqdm(adev_results, total=len(measurement_list))):
+            pbar.set_description("Calculating ADev for '{}'.".format(measurement))
+            self.plot_adev(measurement, result)
+
+    def plot_adev(self, measurement, result):
+        taus, devs, error_bars = result
+        if self.temp_widget.color_dct.get(measurement):
+            color = self.temp_widget.color_dct[measurement]
+        else:
+            color=None
+
+        self.adev_widget.updateWidget(taus, devs, error_bars, measurement, color)
+
+    def update_adev_progressive(self, measurement_list, start, stop, mode):
+        """
+        Plot the ADev at once, then refine it in the background: exact for the measurements whose
+        index is ready, otherwise a coarse estimate from block averages (long taus only), replaced
+        when the index table of the measurement is built (or its ADev computed, in the "all" mode).
+        """
+        store, index = self.cache.adev_store, self.cache.adev_index
+        measurement_list = [measurement for measurement in measurement_list if measurement in store.rows]
+        self.adev_request = (measurement_list, start, stop, mode)
+
+        ready = [measurement for measurement in measurement_list if mode in AdevIndex.MODES and index.is_current(measurement, mode)]
+        for measurement, result in iter_adev(store, self.table_df, ready, start, stop, mode, index=index):
+            self.plot_adev(measurement, result)
+
+        pending = [measurement for measurement in measurement_list if not measurement in ready]
+        for measurement, result in iter_coarse_adev(store, self.table_df, pending, start, stop, mode):
+            self.plot_adev(measurement, result)
+
+        if mode in AdevIndex.MODES:
+            # Index tables of all the samples (the ones already being built are not started again)
+            pending = [measurement for measurement in pending if self.adev_building.get((measurement, mode)) != store.versions.get(measurement)]
+            jobs = [(measurement, *index.snapshot(measurement)) for measurement in pending]
+            for measurement, version, _, _ in jobs:
+                self.adev_building[(measurement, mode)] = version
+        else:
+            # ADev of the region
+            time, values, mask = store_region(store, start, stop, pending)
+            values = values*table_scale(self.table_df, pending)[:, None]
+            jobs = [(measurement, None, time[mask[i]], values[i][mask[i]]) for i, measurement in enumerate(pending)]
+
+        if not jobs:
+            return
+        worker = AdevWorker(self.adev_generation, mode, jobs)
+        worker.result_ready.connect(self.refine_adev)
+        worker.finished.connect(lambda worker=worker: self.adev_workers.remove(worker))
+        self.adev_workers.append(worker)
+        worker.start()
+
+    def refine_adev(self, generation, mode, measurement, result):
+        if mode in AdevIndex.MODES:
+            # The index table is kept even if the region has moved since
+            version, table = result
+            if self.adev_building.get((measurement, mode)) == version:
+                del self.adev_building[(measurement, mode)]
+            if not self.cache.adev_index.install(measurement, mode, version, table):
+                return # Data changed while building
+
+            if self.adev_request is None:
+                return
+            measurement_list, start, stop, request_mode = self.adev_request
+            if request_mode == mode and measurement in measurement_list:
+                for measurement, result in iter_adev(self.cache.adev_store, self.table_df, [measurement], start, stop, mode, index=self.cache.adev_index):
+                    self.plot_adev(measurement, result)
+
+        elif generation == self.adev_generation:
+            self.plot_adev(measurement, result)
+
+    def cancel_adev_refinement(self):
+        # Drop the results of the previous request (the index tables being built are still kept)
+        self.adev_generation += 1
+        self.adev_request = None
+        for worker in self.adev_workers:
+            if not worker.mode in AdevIndex.MODES:
+                worker.cancel()
+
+    def update_psd_plot(self, measurement_list=None, start=None, stop=None):
+        """
+        Welch spectra of the valid samples of the visible measurements within the ADev region (the
+        same samples as the ADev), from the cache or else computed in the background.
+        """
+        params = self.param_tree.param.child("Data processing", "Power spectral density")
+        if not params.child("Enabled").value():
+            return
+
+        if measurement_list is None:
+            measurement_list = self.table_df.query("Plot_adev == True")['Name'].to_list()
+            start = string_to_date(self.param_tree.param.child("Data processing", "Allan deviation", "Start").value()).timestamp()
+            stop = string_to_date(self.param_tree.param.child("Data processing", "Allan deviation", "Stop").value()).timestamp()
+
+        self.cancel_psd()
+        store = self.cache.adev_store
+        measurement_list = [measurement for measurement in measurement_list if measurement in store.rows]
+        if not measurement_list:
+            return
+        segment_length = int(params.child("Segment length").value())
+
+        _, values, mask = store_region(store, start, stop, measurement_list)
+        jobs = []
+        for i, measurement in enumerate(measurement_list):
+            key = self.psd_cache.key(measurement, start, stop, segment_length)
+            result = self.psd_cache.get(key)
+            if result is not None:
+                self.plot_psd(measurement, result)
             else:
-                color=None
+                jobs.append((key, values[i][mask[i]], 1/store.step, segment_length))
 
-            # Apply coupling coefficient
-            coeff = self.table_df.loc[self.table_df['Name'] == measurement]["Coeff_"].iloc[0]
-            value = value*float(coeff)
+        if not jobs:
+            return
+        worker = PsdWorker(self.psd_generation, jobs)
+        worker.result_ready.connect(self.psd_ready)
+        worker.finished.connect(lambda worker=worker: self.psd_workers.remove(worker))
+        self.psd_workers.append(worker)
+        worker.start()
+
+    def psd_ready(self, generation, key, result):
+        if result is None:
+            return # Less than 2 samples
+        self.psd_cache.put(key, result)
+        if generation == self.psd_generation:
+            self.plot_psd(key[0], result)
+
+    def plot_psd(self, measurement, result):
+        # Spectrum of the values coupled with the table coefficients, as the ADev
+        freqs, psd = result
+        psd = psd*table_scale(self.table_df, [measurement])[0]**2
+
+        params = self.param_tree.param.child("Data processing", "Power spectral density")
+        if params.child("Log averaging").value():
+            freqs, psd = log_average(freqs, psd, params.child("Points per decade").value())
+        self.psd_widget.updateWidget(freqs, psd, measurement, self.temp_widget.color_dct.get(measurement))
+
+    def cancel_psd(self):
+        # The spectra being computed are still cached, but not plotted
+        self.psd_generation += 1
+        for worker in self.psd_workers:
+            worker.cancel()
+
+    def start_prefetch(self):
+        """
+        When the application is idle, fetch in the background what is likely requested next: the
+        time range before the acquisition range (users step backward in time), and the ADev data of
+        the measurements plotted in the temporal view but not yet in the ADev one. Within a budget
+        of prefetch_rows rows, one request at a time, preempted by any user fetch.
+        """
+        if self.prefetch_rows <= 0 or self.temporal_request is None:
+            return
+        if any(not worker.cancelled for worker in self.prefetch_workers):
+            return # Already prefetching (the budget is per idle period)
+        if self.adev_workers or self.psd_workers or self.prefetch_workers:
+            self.prefetch_timer.start() # Wait for the background computations
+            return
+
+        start, stop, avg_window = self.temporal_request
+        requests = [("temporal", [None], start - (stop - start), start, avg_window)]
+
+        adev_params = self.param_tree.param.child("Data processing", "Allan deviation")
+        likely = self.table_df.query("Plot_temp == True and Plot_adev == False")["Name"].to_list()
+        if likely:
+            adev_start = string_to_date(adev_params.child("Start").value())
+            adev_stop = string_to_date(adev_params.child("Stop").value())
+            requests.append(("adev", likely, adev_start, adev_stop, adev_params.child("Initial tau (s)").value()))
+
+        # Only with free memory (the prefetched data is evicted first, see MemoryBudget)
+        budget = self.cache.budget
+        if budget.max_bytes and budget.total() > 0.8*budget.max_bytes:
+            return
 
-            # Apply fractional factor
-            factor = self.table_df.loc[self.table_df['Name'] == measurement]["Fractional_"].iloc[0]
-            value = value/float(factor)
+        chunks = plan_prefetch(self.cache, requests, self.prefetch_rows)
+        if not chunks:
+            return
+        worker = PrefetchWorker(self.prefetch_generation, self.influxdb, chunks)
+        worker.chunk_ready.connect(self.prefetch_ready)
+        worker.finished.connect(lambda worker=worker: self.prefetch_workers.remove(worker))
+        self.prefetch_workers.append(worker)
+        worker.start(PrefetchWorker.LowPriority)
+
+    def prefetch_ready(self, generation, chunk, df):
+        # Data of a prefetched chunk, dropped if a user fetch has preempted the prefetch since
+        if generation != self.prefetch_generation:
+            return
+        mode, measurement, start, stop, avg_window = chunk
+        with tracer.span("cache.prefetch"):
+            self.cache.fill(mode, measurement, df, start, stop, avg_window)
+        tracer.count("cache.prefetched rows", 0 if df is None else len(df))
+
+    def preempt_prefetch(self):
+        # User fetches have priority: the prefetch is stopped, with its request in progress
+        self.prefetch_generation += 1
+        for worker in self.prefetch_workers:
+            worker.cancel()
+
+    def update_budget_plot(self, start, stop, avg_window, mode):
+        # Contributions are all the visible measurements, coupled to the main one
+        main_measurement = self.param_tree.param.child('Global settings', 'Main measurement').value()
+        contributions = self.table_df.query("Plot_adev == True")["Name"].to_list()
 
-            # Calculate Allan deviation
-            mode = self.param_tree.param.child("Data processing", "Allan deviation", "Mode").value().lower()
+        # Only fetches what is missing
+        start_dt, stop_dt = [datetime.fromtimestamp(value, ZoneInfo("UTC")) for value in [start, stop]]
+        self.cache.fetch(start_dt, stop_dt, contributions + [main_measurement], avg_window, "adev")
 
-            # Plot settings
-            self.adev_widget.error_bar_mode = self.param_tree.param.child("Allan deviation plot settings", "Error bars").value()
+        results = compute_budget(self.cache.adev_store, self.table_df, main_measurement, contributions, start, stop, mode)
+        if results is None:
+            return
 
-            taus, devs, error_bars = get_stab(time[region], value[region], mode)
-            self.adev_widget.updateWidget(taus, devs, error_bars, measurement, color)
+        for title, (taus, devs, error_bars) in results.items():
+            if title in self.budget_titles:
+                color = "w" if title == BUDGET_QUADRATURE else "#aaaaaa"
+            elif title in contributions:
+                color = self.temp_widget.color_dct.get(title)
+            else:
+                continue # Main measurement not visible
+            self.adev_widget.updateWidget(taus, devs, error_bars, title, color)
 
     def zoom_region(self):
         start = self.param_to_datetime(self.param_tree.param.child("Data processing", "Allan deviation", "Start")).timestamp()
@@ -527,6 +686,7 @@ class MainWindow(QMainWindow):
             plot["widget"].setAutoVisible(y=True)
 
     def handle_dataframe_update(self, row, col):
+        self.prefetch_timer.start()
         column_title = self.table_df.columns[col]
         measurement = self.table_df.iloc[row,1]
         value = self.table_df.iloc[row,col]
@@ -535,9 +695,9 @@ class MainWindow(QMainWindow):
 
         # Plot visibility
         ## Temporal
-        if column_title == "Plot_temp":
+        if column_title == "Plot_temp" and measurement in self.temp_widget.plots:
             # Toggle visibility
-            self.temp_widget.plots[measurement]["widget"].setVisible(value)
+            self.temp_widget.set_plot_visible(measurement, value)
         ## Adev
         if column_title == "Plot_adev":
             # Check if the plot exists, if not, create it
@@ -545,17 +705,78 @@ class MainWindow(QMainWindow):
                 self.update_adev_plot(measurement)
 
             # Toggle visibility
-            self.adev_widget.plots[measurement]["data"].setVisible(value)
+            if measurement in self.adev_widget.plots:
+                self.adev_widget.plots[measurement]["data"].setVisible(value)
+            self.psd_widget.set_plot_visible(measurement, value)
+            if value and not measurement in self.psd_widget.plots:
+                self.update_psd_plot()
+
+            # The budget depends on the visible measurements
+            if self.param_tree.param.child("Allan deviation plot settings", "Budget").value():
+                self.update_adev_plot()
 
         # Coupling and Fractional coefficient
         if column_title in ["Coeff_", "Fractional_"] and adev_visible:
             self.update_adev_plot(measurement)
 
+        # Expression of a derived measurement
+        if column_title == "Expression":
+            self.cache.set_derived(self.table_df)
+            self.update_temporal_plot()
+            if adev_visible:
+                self.update_adev_plot(measurement)
+
+    def add_derived(self):
+        # Add (or redefine) a derived measurement, from the name and expression of the parameter tree
+        name = self.param_tree.param.child("Data processing", "Derived measurement", "Name").value().strip()
+        text = self.param_tree.param.child("Data processing", "Derived measurement", "Expression").value()
+        if not name:
+            print("The derived measurement needs a name.")
+            return
+        if name in self.cache.data["temporal"].names:
+            print("'{}' is already a measurement.".format(name))
+            return
+        try:
+            expression = Expression(text)
+        except ValueError as e:
+            print(e)
+            return
+        known = set(self.table_df["Name"])
+        unknown = [operand for operand in expression.inputs if not operand in known and operand != name]
+        if unknown:
+            print("Unknown measurements in '{}': {}".format(text, ", ".join(unknown)))
+            return
+
+        if self.table_df["Name"].eq(name).any():
+            self.table_df.loc[self.table_df["Name"] == name, "Expression"] = text
+        else:
+            self.table_df.loc[len(self.table_df)] = [False, name, "Derived", "1", "1", True, False, text]
+        self.cache.set_derived(self.table_df)
+        self.update_table()
+        self.populate_main_measurement()
+        self.update_temporal_plot()
+        if self.table_df.loc[self.table_df["Name"] == name, "Plot_adev"].any():
+            self.update_adev_plot(name)
+
+    def remove_derived(self):
+        name = self.param_tree.param.child("Data processing", "Derived measurement", "Name").value().strip()
+        if not name in self.cache.derived:
+            print("'{}' is not a derived measurement.".format(name))
+            return
+        self.table_df.drop(self.table_df.index[self.table_df["Name"] == name], inplace=True)
+        self.table_df.reset_index(drop=True, inplace=True)
+        self.cache.set_derived(self.table_df)
+        self.temp_widget.removeWidget(name)
+        self.adev_widget.removeWidget(name)
+        self.psd_widget.removeWidget(name)
+        self.update_table()
+        self.populate_main_measurement()
+
     def populate_main_measurement(self):
         # From the fetched data, fill the combobox that defines the main measurement
         combobox = self.param_tree.param.child('Global settings', 'Main measurement')
 
-        content = self.influxdb_data_temp['_measurement'].unique()
+        content = self.cache.data["temporal"].names + list(self.cache.derived)
         combobox.setLimits(content)
 
     def populate_presets(self):
@@ -576,11 +797,10 @@ class MainWindow(QMainWindow):
         def rel_to_abs(param,index):
             try:
                 if any([val in param.value() for val in ['y', 'Y', 'M', 'm', 'd', 'D', 'w', 'h', 'H', 's', 'S', 'now']]):
-                    df = self.influxdb_data_temp
-                    first_meas = df["_measurement"].unique()[0]
-                    df = df[df["_measurement"] == first_meas]
+                    store = self.cache.data["temporal"]
+                    limits = store.limits(store.names[0])
 
-                    abs_val = df["_time"].sort_values().iloc[index].strftime("%Y-%m-%d %H:%M:%S")
+                    abs_val = pd.Timestamp(limits[index], tz="UTC").tz_convert("Europe/Paris").strftime("%Y-%m-%d %H:%M:%S")
 
                     param.setValue(abs_val)
             except Exception as e:
@@ -597,34 +817,23 @@ class MainWindow(QMainWindow):
         if "app_settings" in load_config("config/settings.json").keys():
             save_cached = bool(load_config('config/settings.json')['app_settings']['save_cached'] == "True")
 
-            os.makedirs("presets/cache/", exist_ok=True)
-
             if save_cached:
-                if not self.influxdb_data_temp is None:
-                    self.influxdb_data_temp.to_pickle("presets/cache/"+preset_name+"_temp.pkl")
-                if not self.influxdb_data_adev is None:
-                    self.influxdb_data_adev.to_pickle("presets/cache/"+preset_name+"_adev.pkl")
-                if not self.data_avail_dct is None:
-                    dict_to_json_file(self.data_avail_dct, "presets/cache/"+preset_name+"_avail.json")
+                save_bundle(self.cache, preset_name)
 
 
     def load_preset(self):
         preset_name = self.param_tree.param.child("Presets", "Name").value()
-        new_df = pd.read_json("presets/"+preset_name+".json", dtype=str)
-
-        # Convert plot visibility columns to boolean
-        for col in ["Plot_temp", "Plot_adev"]:
-            new_df[col] = new_df[col].map({'True': np.bool_(True), 'False': np.bool_(False)})
+        new_df = read_table(preset_name)
 
         self.table_df.drop(self.table_df.index, inplace=True)
         self.table_df[self.table_df.columns] = new_df
 
         # Update dataframe as reference to table widget
         self.data_table_widget.dataframe = self.table_df
+        self.cache.set_derived(self.table_df)
 
         # Load parameter tree state
-        filename = "presets/"+preset_name+"_tree.json"
-        state = json_file_to_dict(filename)
+        state = read_tree(preset_name)
         self.param_tree.params_changing = True
         self.param_tree.param.restoreState(state)
         self.param_tree.params_changing = False
@@ -633,18 +842,26 @@ class MainWindow(QMainWindow):
         if "app_settings" in load_config("config/settings.json").keys():
             save_cached = bool(load_config('config/settings.json')['app_settings']['save_cached'] == "True")
 
-            if save_cached:
+            bundle = PresetBundle.open(preset_name) if save_cached else None
+            if bundle is not None:
+                # Read lazily, when the plots fetch their data
+                self.cache.load_bundle(bundle)
+            elif save_cached:
+                # Legacy format (pickles and per-second availability)
                 filename = "presets/cache/"+preset_name+"_temp.pkl"
                 if file_exists(filename):
-                    self.influxdb_data_temp = pd.read_pickle(filename)
+                    self.cache.load("temporal", pd.read_pickle(filename))
 
                 filename = "presets/cache/"+preset_name+"_adev.pkl"
                 if file_exists(filename):
-                    self.influxdb_data_adev = pd.read_pickle(filename)
+                    self.cache.load("adev", pd.read_pickle(filename))
 
                 filename = "presets/cache/"+preset_name+"_avail.json"
                 if file_exists(filename):
-                    self.data_avail_dct = json_file_to_dict_df(filename)
+                    self.cache.coverage = {
+                        mode: {label: Coverage.from_avail_df(df) for label, df in avail_dct.items()}
+                        for mode, avail_dct in json_file_to_dict_df(filename).items()
+                        }
 
         # Update plots and table
         self.get_temporal_data()
@@ -677,27 +894,6 @@ class MainWindow(QMainWindow):
 
                 self.save_preset()
 
-    def db_data_to_array(self, measurement):
-        df = self.influxdb_data_adev
-        measurement_df = df[df["_measurement"] == measurement]
-
-        time = pd.to_datetime(measurement_df["_time"]).to_numpy()
-        time = np.array([ts.timestamp() for ts in time])
-        value = measurement_df["value"].to_numpy()
-
-        start = self.param_to_datetime(self.param_tree.param.child("Data processing", "Allan deviation", "Start")).timestamp()
-        stop = self.param_to_datetime(self.param_tree.param.child("Data processing", "Allan deviation", "Stop")).timestamp()
-
-        region = np.where((time > start) & (time < stop))
-
-        if np.size(region) == 0:
-            region = np.arange(len(time))
-
-        time = time[region]
-        value = df.loc[df["_measurement"] == measurement]["value"].to_numpy()[region]
-
-        return time, value
-
     def compute_auto_value(self, button):
         row = button.row
         col = button.col
@@ -709,21 +905,19 @@ class MainWindow(QMainWindow):
         # Use region
         main_measurement = self.param_tree.param.child('Global settings', 'Main measurement').value()
 
-        param_ts, param_val = self.db_data_to_array(measurement)
-        freq_ts, freq_val = self.db_data_to_array(main_measurement)
+        start = string_to_date(self.param_tree.param.child("Data processing", "Allan deviation", "Start").value())
+        stop = string_to_date(self.param_tree.param.child("Data processing", "Allan deviation", "Stop").value())
+
+        # Make sure that both measurements are in the aligned store
+        avg_window = self.param_tree.param.child('Data processing', 'Allan deviation', 'Initial tau (s)').value()
+        self.cache.fetch(start, stop, [measurement, main_measurement], avg_window, "adev")
         #
 
         if item_type == "Coeff_":
-            # Using linear regression to find correlation
-            _,x = resample_data(param_ts, param_val)
-            _,y = resample_data(freq_ts, freq_val)
-            min_len = min(len(x), len(y))
-            slope, intercept, r_value, p_value, std_err = linregress(x[-min_len:],y[-min_len:])
-
-            value = slope
+            value = coupling_coefficient(self.cache.adev_store, measurement, main_measurement, start.timestamp(), stop.timestamp())
 
         if item_type == "Fractional_":
-            value = np.mean(param_val)
+            value = fractional_factor(self.cache.adev_store, measurement, start.timestamp(), stop.timestamp())
 
         def strip_zeros(value):
             formatted = "{:.3e}".format(value)
@@ -755,3 +949,16 @@ class MainWindow(QMainWindow):
 
         # Recalculate ADev plot
         self.update_adev_plot()
+
+    def closeEvent(self, event):
+        # Stop the background ADev refinement, spectra and prefetch
+        self.prefetch_timer.stop()
+        for worker in list(self.adev_workers) + list(self.psd_workers) + list(self.prefetch_workers):
+            worker.cancel()
+            worker.wait()
+
+        # Save the trace of the session, if configured
+        if self.trace_file:
+            tracer.save_chrome_trace(self.trace_file)
+            print("Trace saved to '{}'.".format(self.trace_file))
+        super().closeEvent(event)
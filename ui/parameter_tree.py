@@ -22,12 +22,26 @@ class ParameterTreeWidget(ParameterTree):
                     {'name': 'Initial tau (s)', 'type': 'str', 'value': "1"},
                     {'name': 'Mode', 'type': 'list', 'value': 'Decade', 'limits': ['Decade','Octave','All']},
                     {'name': 'Auto calculate', 'type': 'bool'},
+                    {'name': 'Progressive', 'type': 'bool', 'value': False},
                     {'name': 'Calculate', 'type': 'action'},
                     {'name': 'Zoom region', 'type': 'action'},
                 ]},
+                {'name': 'Derived measurement', 'type': 'group', 'children': [
+                    {'name': 'Name', 'type': 'str', 'value': ""},
+                    {'name': 'Expression', 'type': 'str', 'value': ""},
+                    {'name': 'Add', 'type': 'action'},
+                    {'name': 'Remove', 'type': 'action'},
+                ]},
+                {'name': 'Power spectral density', 'type': 'group', 'children': [
+                    {'name': 'Enabled', 'type': 'bool', 'value': False},
+                    {'name': 'Segment length', 'type': 'list', 'value': 16384, 'limits': [1024, 4096, 16384, 65536, 262144, 1048576]},
+                    {'name': 'Log averaging', 'type': 'bool', 'value': True},
+                    {'name': 'Points per decade', 'type': 'int', 'value': 20, 'limits': (1, 1000)},
+                ]},
             ]},
             {'name': 'Allan deviation plot settings', 'type': 'group', 'children': [
                 {'name': 'Error bars', 'type': 'list', 'value': '', 'limits': ['Fill between','Bars']},
+                {'name': 'Budget', 'type': 'bool', 'value': False},
             ]},
             {'name': 'Global settings', 'type': 'group', 'children': [
                 {'name': 'Main measurement', 'type': 'list', 'value': '', 'limits': ['']},
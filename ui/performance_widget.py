@@ -0,0 +1,86 @@
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QHeaderView, QPushButton, QFileDialog
+from PyQt5.QtCore import QTimer
+
+from instrumentation.tracer import tracer
+
+class PerformanceWidget(QWidget):
+    """
+    Live view of the tracer: timing of the spans (count, total, mean, max and last duration)
+    and value of the counters, refreshed periodically. With a MemoryBudget, also the memory used
+    per part (MB).
+    """
+    columns = ["Name", "Count", "Total (ms)", "Mean (ms)", "Max (ms)", "Last (ms)"]
+
+    def __init__(self, refresh_interval=1000, budget=None, parent=None):
+        super().__init__(parent)
+        self.budget = budget
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        buttons = QHBoxLayout()
+        reset_button = QPushButton("Reset")
+        reset_button.clicked.connect(self.reset)
+        buttons.addWidget(reset_button)
+        save_button = QPushButton("Save trace")
+        save_button.clicked.connect(self.save_trace)
+        buttons.addWidget(save_button)
+        buttons.addStretch()
+        layout.addLayout(buttons)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(refresh_interval)
+
+    def refresh(self):
+        # Don't spend time updating a hidden panel
+        if not self.isVisible():
+            return
+
+        spans, counters = tracer.stats()
+
+        rows = []
+        for name, stat in sorted(spans.items()):
+            rows.append([name, stat["count"], stat["total"]*1e3, stat["total"]*1e3/stat["count"], stat["max"]*1e3, stat["last"]*1e3])
+        for name, value in sorted(counters.items()):
+            rows.append([name, value, None, None, None, None])
+
+        # Hit ratio of the cache
+        hits, misses = counters.get("cache.hits", 0), counters.get("cache.misses", 0)
+        if hits + misses:
+            rows.append(["cache.hit_ratio", "{:.1%}".format(hits/(hits + misses)), None, None, None, None])
+
+        # Memory used, and its limit
+        if self.budget is not None:
+            usage = self.budget.usage()
+            for name, nbytes in usage.items():
+                rows.append(["memory.{} (MB)".format(name), nbytes/2**20, None, None, None, None])
+            limit = " / {:.0f}".format(self.budget.max_bytes/2**20) if self.budget.max_bytes else ""
+            rows.append(["memory.total (MB)", "{:.2f}{}".format(sum(usage.values())/2**20, limit), None, None, None, None])
+
+        self.table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for col, value in enumerate(values):
+                if value is None:
+                    text = ""
+                elif isinstance(value, float):
+                    text = "{:.2f}".format(value)
+                else:
+                    text = str(value)
+                self.table.setItem(row, col, QTableWidgetItem(text))
+
+    def reset(self):
+        tracer.reset()
+        self.refresh()
+
+    def save_trace(self):
+        filename, _ = QFileDialog.getSaveFileName(self, "Save trace", "trace.json", "Chrome trace (*.json)")
+        if filename:
+            tracer.save_chrome_trace(filename)
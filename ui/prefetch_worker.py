@@ -0,0 +1,51 @@
+import asyncio
+from PyQt5.QtCore import QThread, pyqtSignal
+
+class PrefetchWorker(QThread):
+    """
+    Fetches chunks (mode, measurement, start, stop, avg_window) from the database in the background
+    (see plan_prefetch), one request at a time, the data being inserted in the cache by the GUI
+    thread (see DataCache.fill). Cancelling it also cancels the request in progress.
+    """
+    chunk_ready = pyqtSignal(int, object, object) # Generation, chunk, dataframe (or None)
+
+    def __init__(self, generation, handler, chunks):
+        super().__init__()
+        self.generation = generation
+        self.handler = handler
+        self.chunks = chunks
+        self.cancelled = False
+        self.loop = None
+        self.task = None
+
+    def cancel(self):
+        self.cancelled = True
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.cancel_task)
+            except RuntimeError:
+                pass # Already finished
+
+    def cancel_task(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def run(self):
+        asyncio.run(self.fetch_chunks())
+
+    async def fetch_chunks(self):
+        self.loop = asyncio.get_running_loop()
+        for chunk in self.chunks:
+            if self.cancelled:
+                return
+            mode, measurement, start, stop, avg_window = chunk
+            avg_window_fetch = int(avg_window) if avg_window != "" else None
+            self.task = asyncio.ensure_future(self.handler.db_to_df(start, stop, avg_window=avg_window_fetch, measurement=measurement))
+            try:
+                df = await self.task
+            except asyncio.CancelledError:
+                return
+            except Exception as e:
+                print("Prefetching '{}' data failed ({}).".format("All" if measurement is None else measurement, e))
+                return
+            self.chunk_ready.emit(self.generation, chunk, df)
@@ -0,0 +1,42 @@
+import pyqtgraph as pg
+import numpy as np
+
+from instrumentation.tracer import tracer
+
+class PsdWidget(pg.GraphicsLayoutWidget):
+    def __init__(self):
+        super().__init__()
+        self.psd_widget = self.addPlot()
+
+        self.psd_widget.setLogMode(x=True, y=True)
+        self.psd_widget.setLabel('left', "Power spectral density", units='1/Hz')
+        self.psd_widget.setLabel('bottom', "Frequency", units='Hz')
+        self.psd_widget.getAxis('bottom').enableAutoSIPrefix(False)
+        self.psd_widget.getAxis('left').enableAutoSIPrefix(False)
+        self.psd_widget.showGrid(x=True, y=True, alpha=0.5)
+        self.psd_widget.addLegend(offset=(1,0),labelTextSize= "8pt")
+
+        self.plots = {}
+
+    @tracer.timed("ui.psd.updateWidget")
+    def updateWidget(self, freqs, psd, title, color):
+        # The zero frequency can't be shown in log scale
+        keep = freqs > 0
+        freqs, psd = freqs[keep], psd[keep]
+
+        if title in self.plots:
+            self.plots[title]["data"].setData(freqs, psd)
+            return self.plots[title]
+
+        plot_data = self.psd_widget.plot(freqs, psd, pen=pg.mkPen(color=color, width=1), name=title)
+        self.plots[title] = {"widget": self.psd_widget, "data": plot_data}
+        return self.plots[title]
+
+    def removeWidget(self, title):
+        plot = self.plots.pop(title, None)
+        if plot is not None:
+            self.psd_widget.removeItem(plot["data"])
+
+    def set_plot_visible(self, title, visible):
+        if title in self.plots:
+            self.plots[title]["data"].setVisible(visible)
@@ -0,0 +1,26 @@
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from data_processing.psd import welch_psd
+
+class PsdWorker(QThread):
+    """
+    Computes Welch spectra in the background, one measurement at a time. Jobs are (key, values,
+    rate, segment_length), with the key of the spectrum in the PsdCache, and the results (freqs, psd).
+    """
+    result_ready = pyqtSignal(int, object, object) # Generation, key, result
+
+    def __init__(self, generation, jobs):
+        super().__init__()
+        self.generation = generation
+        self.jobs = jobs
+        self.cancelled = False
+
+    def cancel(self):
+        # Stop after the current measurement
+        self.cancelled = True
+
+    def run(self):
+        for key, values, rate, segment_length in self.jobs:
+            if self.cancelled:
+                return
+            self.result_ready.emit(self.generation, key, welch_psd(values, rate, segment_length))
@@ -100,7 +100,10 @@ class DataTableWidget(QTableWidget):
                     self.setCellWidget(row, col, cell_widget)
                 else:
                     # self.horizontalHeader().setSectionResizeMode(col, QHeaderView.Interactive)  # Column 0: Manual resizing
-                    self.setItem(row, col, QTableWidgetItem(str(value)))
+                    item = QTableWidgetItem(str(value))
+                    if column == "Expression" and not value:
+                        item.setFlags(Qt.ItemIsEnabled) # Fetched measurement, not derived
+                    self.setItem(row, col, item)
 
         self.updating = False
 
@@ -116,6 +119,9 @@ class DataTableWidget(QTableWidget):
                 if item.flags() & Qt.ItemIsUserCheckable:
                     self.dataframe.iloc[row,col] = (item.checkState() == Qt.Checked)
 
+            if self.dataframe.columns[col] == "Expression":
+                self.dataframe.iloc[row,col] = item.text()
+
             if self.dataframe.columns[col] in ["Coeff_","Fractional_"]:
                 try:
                     self.dataframe.iloc[row,col] = item.value_label.text()
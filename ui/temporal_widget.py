@@ -4,13 +4,26 @@ from PyQt5 import QtGui
 from PyQt5.QtCore import pyqtSignal
 import numpy as np
 
+from data_processing.ring_buffer import RingBuffer
+from instrumentation.tracer import tracer
+
 class TemporalWidget(QScrollArea):
+    """
+    Scrollable stack of temporal plots, one per measurement.
+
+    Only the plots within the viewport are redrawn: the data and the region of the plots
+    scrolled off-screen or hidden are kept pending, and applied when they become visible.
+    """
     region_updated = pyqtSignal(object)
 
-    def __init__(self):
+    def __init__(self, buffer_size=200000, dtype=np.float64):
         super().__init__()
         self.updating = False
 
+        # Maximum number of samples kept per curve, and type of the plotted values
+        self.buffer_size = buffer_size
+        self.dtype = dtype
+
         # Available colors
         self.colors = iter(['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']*100)
         self.color_dct = {}
@@ -39,6 +52,13 @@ class TemporalWidget(QScrollArea):
         self.plots = {}
         self.avail_curves = {}
 
+        # Region shared by all the plots
+        self.region = None
+
+        # Render the pending plots when they are scrolled into view
+        self.verticalScrollBar().valueChanged.connect(self.flush)
+        self.verticalScrollBar().rangeChanged.connect(self.flush)
+
     def update_availability_plot(self, x, y, measurement):
         def replace_by_nan(arr):
             return np.where(arr == False, np.nan, arr)
@@ -67,11 +87,16 @@ class TemporalWidget(QScrollArea):
         self.update_availability_plot(x, y, measurement)
 
 
+    @tracer.timed("ui.temporal.updateWidget")
     def updateWidget(self, x, y, title="Plot"):
         # Check if the plots already exists
         if title in self.plots:
-            self.plots[title]["data"].setData(x, y)
-            return self.plots[title]
+            plot = self.plots[title]
+            plot["buffer"].write(x, y)
+            plot["stale_data"] = True
+            if self.is_visible(plot):
+                self.render_plot(plot)
+            return plot
 
         # Create a new plot
         plot_widget = pg.PlotWidget(title=title, axisItems={'bottom': pg.DateAxisItem()})
@@ -79,10 +104,17 @@ class TemporalWidget(QScrollArea):
         plot_widget.setMinimumHeight(150)
         color = next(self.colors)
         self.color_dct[title] = color
+
+        # Preallocated storage, the curve is fed with views of it
+        buffer = RingBuffer(self.buffer_size, self.dtype)
+        buffer.write(x, y)
+        x, y = buffer.view()
         plot_data = plot_widget.plot(x, y, pen=pg.mkPen(color=color, width=2))
 
         # Region
-        region = pg.LinearRegionItem([x[0],x[-1]], swapMode="block")
+        if self.region is None:
+            self.region = [x[0], x[-1]]
+        region = pg.LinearRegionItem(self.region, swapMode="block")
         region.setBrush(QtGui.QColor(255, 0, 0, 30))
         region.sigRegionChangeFinished.connect(self.update_measure_region)
         plot_widget.addItem(region)
@@ -95,10 +127,66 @@ class TemporalWidget(QScrollArea):
         self.plot_layout.addWidget(plot_widget)
 
         # Store plot and its data reference
-        self.plots[title] = {"widget": plot_widget, "data": plot_data, "region": region, "color": color}
+        self.plots[title] = {"widget": plot_widget, "data": plot_data, "region": region, "color": color, "buffer": buffer,
+                             "stale_data": False, "stale_region": False}
 
         return self.plots[title]
 
+    def is_visible(self, plot):
+        # Shown (see Plot_temp) and within the viewport
+        widget = plot["widget"]
+        if not (self.isVisible() and widget.isVisibleTo(self.plot_container)):
+            return False
+        top = self.verticalScrollBar().value()
+        return widget.y() < top + self.viewport().height() and widget.y() + widget.height() > top
+
+    def render_plot(self, plot):
+        # Apply the pending data and region of a plot
+        updating, self.updating = self.updating, True # Not a region change from the user
+        if plot["stale_data"]:
+            plot["data"].setData(*plot["buffer"].view())
+            plot["stale_data"] = False
+        if plot["stale_region"]:
+            plot["region"].setRegion(self.region)
+            plot["stale_region"] = False
+        self.updating = updating
+
+    @tracer.timed("ui.temporal.flush")
+    def flush(self, *args):
+        # Render the pending plots that are visible
+        self.plot_layout.activate() # Up-to-date geometry
+        for plot in self.plots.values():
+            if (plot["stale_data"] or plot["stale_region"]) and self.is_visible(plot):
+                self.render_plot(plot)
+
+    def set_region(self, region, sender=None):
+        # Move the shared region, only the visible plots are redrawn now
+        self.region = list(region)
+        for plot in self.plots.values():
+            plot["stale_region"] = plot["region"] is not sender
+            if plot["stale_region"] and self.is_visible(plot):
+                self.render_plot(plot)
+
+    def removeWidget(self, title):
+        plot = self.plots.pop(title, None)
+        if plot is None:
+            return
+        self.plot_layout.removeWidget(plot["widget"])
+        plot["widget"].deleteLater()
+
+    def set_plot_visible(self, title, visible):
+        self.plots[title]["widget"].setVisible(visible)
+        if visible:
+            self.flush()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.flush()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.flush()
+
     def update_measure_region(self):
         if not self.updating:
             self.updating = True